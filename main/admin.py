@@ -1,9 +1,45 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import format_html
 
 from main import models
 
+# the large user columns, never shown on the page and image changelists
+USER_CONTENT_FIELDS = [f"user__{name}" for name in models.User.CONTENT_FIELDS]
+
+
+def is_changelist(request):
+    match = request.resolver_match
+    return match is not None and match.url_name.endswith("_changelist")
+
+
+def count_per_user(model):
+    """
+    The number of `model` rows of each user, as a correlated subquery: joining
+    both pages and images would aggregate pages x images rows per user.
+    """
+    counts = (
+        model.objects.filter(user=OuterRef("pk"))
+        .order_by()
+        .values("user")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+class UserListFilter(admin.RelatedFieldListFilter):
+    """The user sidebar filter, listing usernames without loading whole users."""
+
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        users = models.User.objects.order_by(*ordering or ["username"])
+        return list(users.values_list("pk", "username"))
+
 
 @admin.register(models.User)
 class UserAdmin(BaseUserAdmin):
@@ -46,27 +82,38 @@ class UserAdmin(BaseUserAdmin):
                     "stripe_subscription_id",
                     "subscription_start_date",
                     "subscription_end_date",
+                    "subscription_status",
+                    "subscription_cancel_at_period_end",
+                    "subscription_synced_at",
                 ),
                 "classes": ("collapse",),
             },
         ),
     )
 
+    @admin.display(description="Pages", ordering="page_count")
     def page_count(self, obj):
-        return obj.page_set.count()
-
-    page_count.short_description = "Pages"
+        return obj.page_count
 
+    @admin.display(description="Images", ordering="image_count")
     def image_count(self, obj):
-        return obj.image_set.count()
+        return obj.image_count
 
-    image_count.short_description = "Images"
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if is_changelist(request):
+            queryset = queryset.defer(*models.User.CONTENT_FIELDS)
+            queryset = queryset.annotate(
+                page_count=count_per_user(models.Page),
+                image_count=count_per_user(models.Image),
+            )
+        return queryset
 
 
 @admin.register(models.Page)
 class PageAdmin(admin.ModelAdmin):
     list_display = ("title", "slug", "user", "created_at", "updated_at", "word_count")
-    list_filter = ("created_at", "updated_at", "user")
+    list_filter = ("created_at", "updated_at", ("user", UserListFilter))
     search_fields = ("title", "slug", "body", "user__username")
     ordering = ("-updated_at",)
     fieldsets = (
@@ -87,15 +134,15 @@ class PageAdmin(admin.ModelAdmin):
     )
     readonly_fields = ("created_at", "updated_at")
 
+    @admin.display(description="Words", ordering="word_count")
     def word_count(self, obj):
-        if obj.body:
-            return len(obj.body.split())
-        return 0
-
-    word_count.short_description = "Words"
+        return obj.word_count
 
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related("user")
+        queryset = super().get_queryset(request).select_related("user")
+        if is_changelist(request):
+            queryset = queryset.defer("body", "body_html", *USER_CONTENT_FIELDS)
+        return queryset
 
 
 @admin.register(models.Image)
@@ -108,7 +155,7 @@ class ImageAdmin(admin.ModelAdmin):
         "uploaded_at",
         "image_preview",
     )
-    list_filter = ("uploaded_at", "extension", "user")
+    list_filter = ("uploaded_at", "extension", ("user", UserListFilter))
     search_fields = ("name", "slug", "user__username")
     ordering = ("-uploaded_at",)
     fieldsets = (
@@ -129,16 +176,15 @@ class ImageAdmin(admin.ModelAdmin):
     file_size_mb.short_description = "Size"
 
     def file_size_display(self, obj):
-        return f"{obj.data_size} MB ({len(obj.data):,} bytes)"
+        return f"{obj.data_size} MB ({obj.size_bytes:,} bytes)"
 
     file_size_display.short_description = "File Size"
 
     def image_preview(self, obj):
         if obj.extension.lower() in ["jpg", "jpeg", "png", "gif", "webp"]:
             return format_html(
-                '<img src="data:image/{};base64,{}" style="max-width: 50px; max-height: 50px;" />',
-                obj.extension,
-                obj.data_as_base64,
+                '<img src="{}" loading="lazy" style="max-width: 50px; max-height: 50px;" />',
+                reverse("image_thumbnail", args=(obj.slug, 100)),
             )
         return "No preview"
 
@@ -147,18 +193,48 @@ class ImageAdmin(admin.ModelAdmin):
     def image_preview_large(self, obj):
         if obj.extension.lower() in ["jpg", "jpeg", "png", "gif", "webp"]:
             return format_html(
-                '<img src="data:image/{};base64,{}" style="max-width: 400px; max-height: 400px;" />',
-                obj.extension,
-                obj.data_as_base64,
+                '<img src="{}" style="max-width: 400px; max-height: 400px;" />',
+                reverse("image_thumbnail", args=(obj.slug, 1000)),
             )
         return "No preview available"
 
     image_preview_large.short_description = "Image Preview"
 
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related("user")
+        # previews are thumbnail URLs, the legacy blob is never needed here
+        queryset = super().get_queryset(request).select_related("user").defer("data")
+        if is_changelist(request):
+            queryset = queryset.defer(*USER_CONTENT_FIELDS)
+        return queryset
 
 
 admin.site.site_header = "Pulsar Admin"
 admin.site.site_title = "Pulsar Admin"
 admin.site.index_title = "Welcome to Pulsar Administration"
+
+
+@admin.register(models.WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("event_id", "type", "customer_id", "status", "attempts", "created")
+    list_filter = ("status", "type")
+    search_fields = ("event_id", "customer_id")
+    ordering = ("-created",)
+    readonly_fields = ("event_id", "type", "customer_id", "payload", "created")
+    actions = ["retry"]
+
+    @admin.action(description="Retry selected events")
+    def retry(self, request, queryset):
+        queryset.exclude(status=models.WebhookEvent.DONE).update(
+            status=models.WebhookEvent.PENDING,
+            attempts=0,
+            run_after=timezone.now(),
+            locked_until=None,
+        )
+
+
+@admin.register(models.OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ("subject", "digest_key", "status", "attempts", "created_at")
+    list_filter = ("status", "digest_key")
+    search_fields = ("subject",)
+    ordering = ("-created_at",)
@@ -0,0 +1,95 @@
+"""
+Per-worker allowlist of the hosts pulsar serves, for Caddy's on-demand TLS.
+
+Caddy asks /accounts/domain/?domain=<host> before getting a certificate for
+any SNI name it hasn't seen, which includes whatever scanners make up. Known
+hosts are answered from an in-memory set of every subdomain and custom
+domain, loaded with one query. Unknown hosts are checked against the
+database once and then remembered as rejected for DOMAIN_CHECK_REJECT_TTL
+seconds, so repeated junk costs a dict lookup.
+
+The set is dropped on User changes in every worker (see main.signals and
+main.bus) and reloaded every DOMAIN_CHECK_REFRESH seconds in case an
+invalidation was missed.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from main import metrics, models
+from main.lru import MISSING, LRUCache
+
+_lock = threading.Lock()
+_hosts = None
+_loaded_at = 0.0
+
+rejected = LRUCache(
+    maxsize=settings.DOMAIN_CHECK_REJECT_SIZE, ttl=settings.DOMAIN_CHECK_REJECT_TTL
+)
+
+
+def _subdomain(host):
+    """Return the username of a <username>.pulsar.pub host, or None."""
+    name, dot, parent = host.partition(".")
+    return name if dot and parent == settings.CANONICAL_HOST else None
+
+
+def load():
+    hosts = {settings.CANONICAL_HOST}
+    for username, custom_domain in models.User.objects.values_list(
+        "username", "custom_domain"
+    ):
+        hosts.add(f"{username}.{settings.CANONICAL_HOST}")
+        if custom_domain:
+            hosts.add(custom_domain)
+    return frozenset(hosts)
+
+
+def hosts():
+    global _hosts, _loaded_at
+    with _lock:
+        if (
+            _hosts is None
+            or time.monotonic() - _loaded_at > settings.DOMAIN_CHECK_REFRESH
+        ):
+            _hosts = load()
+            _loaded_at = time.monotonic()
+        return _hosts
+
+
+def _exists(host):
+    if username := _subdomain(host):
+        return models.User.objects.filter(username=username).exists()
+    return models.User.objects.filter(custom_domain=host).exists()
+
+
+def is_allowed(host):
+    if host in hosts():
+        return True
+    if rejected.get(host) is not MISSING:
+        return False
+    # the host may have been added in another worker since the last load
+    if _exists(host):
+        invalidate()
+        return True
+    rejected.set(host, True)
+    return False
+
+
+def invalidate():
+    global _hosts
+    with _lock:
+        _hosts = None
+    rejected.clear()
+
+
+def respond(host):
+    """Return the answer to Caddy's ask: 200 to issue a certificate, else 403."""
+    if host and is_allowed(host):
+        metrics.incr("domain_check.accepted")
+        return HttpResponse()
+    metrics.incr("domain_check.rejected")
+    return HttpResponseForbidden()
@@ -0,0 +1,20 @@
+from django.contrib.auth.backends import ModelBackend
+
+from main import models
+
+
+class AccountBackend(ModelBackend):
+    """
+    ModelBackend whose request.user is the account row without the website
+    content (see User.CONTENT_FIELDS), which can be large and is needed only
+    by the views that render or edit it. Those fields load on first access.
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = models.User.objects.defer(*models.User.CONTENT_FIELDS).get(
+                pk=user_id
+            )
+        except models.User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,188 @@
+"""
+Invalidation bus between gunicorn workers and hosts.
+
+The per-process caches (main.tenants, main.allowlist, and the page cache
+generations when CACHES is per process) are evicted by main.signals in the
+process that made a change. `publish` broadcasts the same change as a small
+JSON event, and the listener thread of every other process (see `start`,
+called from pulsar/wsgi.py) runs the handler subscribed to its kind.
+
+On PostgreSQL events go through NOTIFY on one channel, so they are delivered
+on commit and never after a rollback. On SQLite they are rows of BusEvent that
+listeners poll every BUS_POLL_INTERVAL seconds and that are deleted after
+BUS_RETENTION seconds.
+
+Events sent while a listener is disconnected are lost. After reconnecting, it
+runs the resync handlers, which drop whole caches, and until then the caches'
+TTLs bound how stale they get.
+"""
+
+import contextlib
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from main import metrics, models
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "pulsar_invalidate"
+
+# Identifies this process, which already evicted what its own events describe.
+ORIGIN = uuid.uuid4().hex[:12]
+
+_handlers = {}
+_resync_handlers = []
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def subscribe(kind):
+    """Register the decorated function as the handler of events of `kind`."""
+
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+
+    return decorator
+
+
+def on_resync(func):
+    """Register the decorated function to run after events may have been lost."""
+    _resync_handlers.append(func)
+    return func
+
+
+def publish(kind, **data):
+    """Send an event to the other processes, in the current transaction."""
+    payload = json.dumps(
+        {"kind": kind, "origin": ORIGIN, "data": data}, separators=(",", ":")
+    )
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, payload])
+    else:
+        models.BusEvent.objects.create(payload=payload)
+    metrics.incr("bus.published")
+
+
+def dispatch(payload):
+    """Run the handler of a received event, unless this process sent it."""
+    event = json.loads(payload)
+    if event["origin"] == ORIGIN:
+        return
+    handler = _handlers.get(event["kind"])
+    if handler is None:
+        logger.warning(f"no bus handler for {event['kind']}")
+        return
+    metrics.incr("bus.received")
+    try:
+        handler(**event["data"])
+    except Exception as e:
+        logger.error(f"bus handler for {event['kind']} failed: {e}")
+
+
+def resync():
+    metrics.incr("bus.resync")
+    for func in _resync_handlers:
+        func()
+
+
+def prune():
+    cutoff = timezone.now() - timedelta(seconds=settings.BUS_RETENTION)
+    models.BusEvent.objects.filter(created_at__lt=cutoff).delete()
+
+
+class Listener(threading.Thread):
+    def __init__(self):
+        super().__init__(name="bus-listener", daemon=True)
+        self.stopped = threading.Event()
+        self.last_id = None
+        self.pruned_at = None
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        failures = 0
+        while not self.stopped.is_set():
+            try:
+                if connection.vendor == "postgresql":
+                    self.listen(resync_first=failures > 0)
+                else:
+                    self.poll(resync_first=failures > 0)
+            except Exception as e:
+                failures += 1
+                metrics.incr("bus.disconnected")
+                logger.warning(f"bus listener lost its connection: {e}")
+                with contextlib.suppress(Exception):
+                    connection.close()
+                self.stopped.wait(min(2**failures, 60))
+            else:
+                failures = 0
+        with contextlib.suppress(Exception):
+            connection.close()
+
+    def listen(self, resync_first):
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        if resync_first:
+            resync()
+        raw = connection.connection
+        checked_at = time.monotonic()
+        while not self.stopped.is_set():
+            readable, _, _ = select.select([raw], [], [], settings.BUS_POLL_INTERVAL)
+            if readable:
+                raw.poll()
+                while raw.notifies:
+                    dispatch(raw.notifies.pop(0).payload)
+            elif time.monotonic() - checked_at > settings.BUS_KEEPALIVE:
+                # a dead peer only shows up when something is sent
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                checked_at = time.monotonic()
+
+    def poll(self, resync_first):
+        if self.last_id is None:
+            # only events published from now on
+            self.last_id = models.BusEvent.objects.aggregate(Max("pk"))["pk__max"] or 0
+        if resync_first:
+            resync()
+        while not self.stopped.is_set():
+            self.poll_once()
+            self.stopped.wait(settings.BUS_POLL_INTERVAL)
+
+    def poll_once(self):
+        for pk, payload in (
+            models.BusEvent.objects.filter(pk__gt=self.last_id)
+            .order_by("pk")
+            .values_list("pk", "payload")
+        ):
+            dispatch(payload)
+            self.last_id = pk
+        if (
+            self.pruned_at is None
+            or time.monotonic() - self.pruned_at > settings.BUS_RETENTION
+        ):
+            prune()
+            self.pruned_at = time.monotonic()
+
+
+def start():
+    """Start this process's listener thread, once."""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = Listener()
+            _listener.start()
+    return _listener
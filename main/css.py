@@ -0,0 +1,139 @@
+"""
+Tenant custom CSS, served as a stylesheet rather than inlined into pages.
+
+User.save minifies custom_css into custom_css_min and stores its hash, so
+pages link /<hash>.css and browsers keep it for as long as it is unchanged.
+The view below answers from a per-hash cache entry holding the minified CSS
+and its compressed variants, made once per stylesheet.
+"""
+
+import gzip
+import hashlib
+import re
+
+import brotli
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+from main import metrics, models
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+
+_TOKEN = re.compile(
+    r"""
+    (?P<comment>/\*.*?(?:\*/|\Z))
+    | (?P<string>"(?:\\.|[^"\\])*"?|'(?:\\.|[^'\\])*'?)
+    | (?P<space>\s+)
+    | (?P<other>[^"'/\s]+|/)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+
+# no whitespace is needed next to these, except before ":" which in
+# selectors like "a :hover" means something else than "a:hover"
+_BEFORE = "{};,>"
+_AFTER = "{};,>:"
+
+
+def _is_name(char):
+    return char.isalnum() or char in "-_\\"
+
+
+def minify(text):
+    """Drop comments and unneeded whitespace, leaving strings alone."""
+    out = []
+    space = comment = False
+    for match in _TOKEN.finditer(text or ""):
+        kind, token = match.lastgroup, match.group()
+        # a comment separates tokens but is not whitespace: ".a/**/.b" is
+        # ".a.b", not the descendant selector ".a .b"
+        if kind == "comment":
+            comment = True
+            continue
+        if kind == "space":
+            space = True
+            continue
+        if space and out and out[-1][-1] not in _AFTER and token[0] not in _BEFORE:
+            out.append(" ")
+        elif comment and out and _is_name(out[-1][-1]) and _is_name(token[0]):
+            out.append("/**/")  # keeps "a/**/b" from becoming one name
+        space = comment = False
+        if kind == "other":
+            if token[0] == "}" and out and out[-1].endswith(";"):
+                out[-1] = out[-1][:-1]
+            token = token.replace(";}", "}")
+        out.append(token)
+    return "".join(out)
+
+
+def digest(minified):
+    """The hash in the stylesheet's URL, empty when there is no CSS."""
+    if not minified:
+        return ""
+    return hashlib.sha256(minified.encode()).hexdigest()[:16]
+
+
+def _entry_key(css_hash):
+    return f"css:{css_hash}"
+
+
+def _to_entry(minified):
+    content = minified.encode()
+    return {
+        "identity": content,
+        "gzip": gzip.compress(content),
+        "br": brotli.compress(content, mode=brotli.MODE_TEXT),
+    }
+
+
+def _negotiate_encoding(request):
+    accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    if re_accepts_brotli.search(accept_encoding):
+        return "br"
+    if re_accepts_gzip.search(accept_encoding):
+        return "gzip"
+    return "identity"
+
+
+def get_entry(css_hash):
+    key = _entry_key(css_hash)
+    entry = cache.get(key)
+    if entry is not None:
+        metrics.incr("css.hit")
+        return entry
+    minified = (
+        models.User.objects.filter(custom_css_hash=css_hash)
+        .values_list("custom_css_min", flat=True)
+        .first()
+    )
+    if minified is None:
+        return None
+    metrics.incr("css.miss")
+    entry = _to_entry(minified)
+    # the content of a hash never changes, so entries only leave by eviction
+    cache.set(key, entry, timeout=None)
+    return entry
+
+
+def respond(request, css_hash):
+    """The response for /<css_hash>.css, or None if no tenant has that CSS."""
+    encoding = _negotiate_encoding(request)
+    etag = f'"{css_hash}-{encoding}"'
+    if request.headers.get("If-None-Match") == etag:
+        metrics.incr("css.not_modified")
+        response = HttpResponseNotModified()
+    else:
+        entry = get_entry(css_hash)
+        if entry is None:
+            return None
+        response = HttpResponse(entry[encoding], content_type="text/css")
+        if encoding != "identity":
+            response["Content-Encoding"] = encoding
+        response["Content-Length"] = str(len(response.content))
+    response["ETag"] = etag
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
@@ -0,0 +1,83 @@
+"""
+Session-free read path for anonymous visitors of tenant sites.
+
+A GET or HEAD request on a tenant host that carries no session cookie and
+resolves to a view marked with `public` runs through PUBLIC_MIDDLEWARE instead
+of MIDDLEWARE: no session, CSRF, auth or messages middleware. request.user is
+an AnonymousUser, and nothing is read from or written to the session, so the
+response is as cacheable as it looks. Everything else, including tenant
+owners browsing their own site, takes the full stack.
+
+Served by FastLaneHandler, see pulsar/wsgi.py.
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIHandler
+from django.urls import Resolver404, resolve, set_urlconf
+from django.utils.log import log_response
+from django.utils.module_loading import import_string
+
+from main import metrics
+
+
+def public(view):
+    """Mark a view function or class-based view as safe for the fast lane."""
+    view.fastlane_public = True
+    return view
+
+
+def _is_public_view(func):
+    view_class = getattr(func, "view_class", None)
+    return getattr(func, "fastlane_public", False) or getattr(
+        view_class, "fastlane_public", False
+    )
+
+
+def is_public_request(request):
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return False
+    # the same exact comparisons as host_middleware, without validating the
+    # host here: host_middleware and CommonMiddleware still run
+    host = request.META.get("HTTP_HOST")
+    if not host or host in (settings.CANONICAL_HOST, "127.0.0.1:5000"):
+        return False
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return False
+    return _is_public_view(match.func)
+
+
+class FastLaneHandler(WSGIHandler):
+    def load_middleware(self, is_async=False):
+        super().load_middleware(is_async)
+        # PUBLIC_MIDDLEWARE must only use __call__/process_request/
+        # process_response: view, template response and exception hooks are
+        # those of MIDDLEWARE, which _get_response runs for both lanes.
+        handler = convert_exception_to_response(self._get_response)
+        for path in reversed(settings.PUBLIC_MIDDLEWARE):
+            handler = convert_exception_to_response(import_string(path)(handler))
+        self._public_chain = handler
+
+    def get_response(self, request):
+        if not is_public_request(request):
+            return super().get_response(request)
+
+        metrics.incr("fastlane.public")
+        set_urlconf(settings.ROOT_URLCONF)
+        request.user = AnonymousUser()
+        response = self._public_chain(request)
+        response._resource_closers.append(request.close)
+        if response.status_code >= 400:
+            log_response(
+                "%s: %s",
+                response.reason_phrase,
+                request.path,
+                response=response,
+                request=request,
+            )
+        return response
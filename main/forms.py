@@ -1,7 +1,8 @@
 from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm as DjUserCreationForm
-from django.core import validators as dj_validators
+
+from main import validators
 
 
 class UserCreationForm(DjUserCreationForm):
@@ -41,11 +42,8 @@ class MultipleFileField(forms.FileField):
 
 
 class UploadImagesForm(forms.Form):
-    file = MultipleFileField(
-        validators=[
-            dj_validators.FileExtensionValidator(["jpeg", "jpg", "png", "gif", "webp"])
-        ],
-    )
+    # the type comes from the file's first bytes, not from its name
+    file = MultipleFileField(validators=[validators.validate_image_file])
 
 
 class SubscriptionForm(forms.Form):
@@ -0,0 +1,125 @@
+"""
+Delivery of stored image files.
+
+Everything under an image URL is immutable (a slug never gets new content and
+variants are derived from it), so responses are cacheable forever, validated
+by the content hash, and support single byte ranges.
+"""
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.utils.regex_helper import _lazy_re_compile
+
+CHUNK_SIZE = 64 * 1024
+
+range_re = _lazy_re_compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Return the (first, last) byte positions of a single-range `Range` header,
+    or None when the header should be ignored and the whole file sent.
+    """
+    match = range_re.match(header.strip())
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range, eg. bytes=-500 for the final 500 bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise RangeNotSatisfiable()
+    return first, last
+
+
+def _read_range(f, first, last):
+    try:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _file_response(request, storage, name, content_type, etag):
+    size = storage.size(name)
+    byte_range = None
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if "HTTP_RANGE" in request.META and (not if_range or if_range == etag):
+        try:
+            byte_range = parse_range(request.META["HTTP_RANGE"], size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    f = storage.open(name, "rb")
+    if byte_range is None:
+        # FileResponse goes through wsgi.file_wrapper, ie. sendfile on gunicorn
+        response = FileResponse(f, content_type=content_type)
+    else:
+        first, last = byte_range
+        response = StreamingHttpResponse(
+            _read_range(f, first, last), status=206, content_type=content_type
+        )
+        response["Content-Range"] = f"bytes {first}-{last}/{size}"
+        response["Content-Length"] = str(last - first + 1)
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def _immutable(response, etag):
+    response["ETag"] = etag
+    patch_cache_control(
+        response, public=True, max_age=settings.IMAGE_CACHE_MAX_AGE, immutable=True
+    )
+    return response
+
+
+def not_modified(request, etag):
+    """Return a 304 (or 412) response if the client's copy matches, else None."""
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag)
+    return _immutable(response, etag) if response else None
+
+
+def serve(request, storage, name, content_type, etag):
+    """
+    Respond with the stored file `name`, or with a 304 when the client's copy
+    matches `etag`. The file is only opened when it actually has to be sent.
+    """
+    if (response := not_modified(request, etag)) is not None:
+        return response
+    etag = quote_etag(etag)
+    if settings.IMAGE_ACCEL_REDIRECT:
+        # the front end sends the file and handles ranges, the worker never
+        # reads it
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = settings.IMAGE_ACCEL_REDIRECT + name
+    else:
+        response = _file_response(request, storage, name, content_type, etag)
+    return _immutable(response, etag)
+
+
+def serve_bytes(data, content_type, etag):
+    """Like `serve` for content already in memory, after `not_modified`."""
+    response = HttpResponse(data, content_type=content_type)
+    return _immutable(response, quote_etag(etag))
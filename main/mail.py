@@ -0,0 +1,221 @@
+"""
+Outbound email queue.
+
+With EMAIL_BACKEND set to QueuedEmailBackend, sending a message (password
+resets, admin notifications) only inserts an OutboundEmail row.
+`manage.py send_queued_email` delivers the rows through EMAIL_QUEUE_BACKEND,
+keeping one SMTP connection open while there is mail to send.
+
+Rows are claimed in a short transaction of their own: marked as sending, with
+run_after pushed EMAIL_CLAIM_TIMEOUT ahead, then delivered with no transaction
+open and each outcome written as soon as it is known. A worker that dies
+mid-batch leaves its unrecorded rows to be claimed again once the claim runs
+out, so at worst those messages go out twice.
+
+Messages with a digest key (the X-Pulsar-Digest header, see
+`mail_admins_digest`) are not sent one by one: once the oldest of a key is
+EMAIL_DIGEST_INTERVAL old, all pending messages of that key go out as one.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from main import metrics, models
+
+logger = logging.getLogger(__name__)
+
+DIGEST_HEADER = "X-Pulsar-Digest"
+
+UNSENT = (models.OutboundEmail.PENDING, models.OutboundEmail.SENDING)
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        rows = [to_row(message) for message in email_messages]
+        try:
+            models.OutboundEmail.objects.bulk_create(rows)
+        except Exception as e:
+            # AdminEmailHandler sends with fail_silently, often about an error
+            # of the database itself
+            if not self.fail_silently:
+                raise
+            logger.warning(f"cannot queue {len(rows)} emails: {e}")
+            return 0
+        metrics.incr("mail.queued", len(rows))
+        return len(rows)
+
+
+def to_row(message):
+    if message.attachments:
+        raise ValueError("queued email does not support attachments")
+    headers = dict(message.extra_headers)
+    digest_key = headers.pop(DIGEST_HEADER, "")
+    return models.OutboundEmail(
+        subject=message.subject,
+        body=message.body,
+        from_email=message.from_email,
+        to=list(message.to),
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        reply_to=list(message.reply_to),
+        headers=headers,
+        alternatives=[list(a) for a in getattr(message, "alternatives", [])],
+        digest_key=digest_key,
+    )
+
+
+def to_message(row, connection=None):
+    message = EmailMultiAlternatives(
+        subject=row.subject,
+        body=row.body,
+        from_email=row.from_email,
+        to=row.to,
+        cc=row.cc,
+        bcc=row.bcc,
+        reply_to=row.reply_to,
+        headers=row.headers,
+        connection=connection,
+    )
+    for content, mimetype in row.alternatives:
+        message.attach_alternative(content, mimetype)
+    return message
+
+
+def mail_admins_digest(digest_key, subject, message):
+    """Like mail_admins, but sent in one digest per digest_key and interval."""
+    if not settings.ADMINS:
+        return
+    EmailMultiAlternatives(
+        subject=settings.EMAIL_SUBJECT_PREFIX + subject,
+        body=message,
+        from_email=settings.SERVER_EMAIL,
+        to=[a[1] for a in settings.ADMINS],
+        headers={DIGEST_HEADER: digest_key},
+    ).send()
+
+
+def get_delivery_connection():
+    return get_connection(settings.EMAIL_QUEUE_BACKEND)
+
+
+def _deliver(connection, rows, message):
+    """Send `message` on behalf of `rows` and record the outcome on them."""
+    now = timezone.now()
+    try:
+        # Opened by the first message and left open for the next ones, unlike
+        # with send_messages on a closed connection. Closed by the caller.
+        connection.open()
+        connection.send_messages([message])
+    except Exception as e:
+        logger.warning(f"cannot send email {message.subject!r}: {e}")
+        metrics.incr("mail.error")
+        # the connection may be broken, the next send opens a new one
+        connection.close()
+        for row in rows:
+            row.last_error = f"{type(e).__name__}: {e}"
+            if row.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                row.status = models.OutboundEmail.FAILED
+            else:
+                row.status = models.OutboundEmail.PENDING
+                row.run_after = now + timedelta(minutes=2**row.attempts)
+    else:
+        metrics.incr("mail.sent")
+        for row in rows:
+            row.status = models.OutboundEmail.SENT
+            row.sent_at = now
+    models.OutboundEmail.objects.bulk_update(
+        rows, ["last_error", "status", "run_after", "sent_at"]
+    )
+
+
+def _claim(queryset, limit):
+    """
+    Mark up to `limit` due rows of `queryset` as sending and return them. Rows still
+    sending after their claim ran out are from a worker that died, and are
+    claimed again unless they are out of attempts.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            queryset.select_for_update(skip_locked=True)
+            .filter(status__in=UNSENT, run_after__lte=now)
+            .order_by("pk")[:limit]
+        )
+        claimed = []
+        for row in rows:
+            if row.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                row.status = models.OutboundEmail.FAILED
+                row.last_error = "interrupted while sending"
+                continue
+            row.status = models.OutboundEmail.SENDING
+            row.attempts += 1
+            row.run_after = now + timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT)
+            claimed.append(row)
+        models.OutboundEmail.objects.bulk_update(
+            rows, ["status", "attempts", "run_after", "last_error"]
+        )
+    return claimed
+
+
+def send_pending(connection, batch_size=100):
+    """Send up to `batch_size` queued messages, return how many were tried."""
+    rows = _claim(models.OutboundEmail.objects.filter(digest_key=""), batch_size)
+    for row in rows:
+        _deliver(connection, [row], to_message(row, connection))
+    return len(rows)
+
+
+def send_digests(connection, max_messages=500):
+    """Send the digests that are due, return how many messages went into them."""
+    cutoff = timezone.now() - timedelta(seconds=settings.EMAIL_DIGEST_INTERVAL)
+    due = (
+        models.OutboundEmail.objects.filter(status__in=UNSENT)
+        .exclude(digest_key="")
+        .values("digest_key")
+        .annotate(oldest=Min("created_at"))
+        .filter(oldest__lte=cutoff)
+        .values_list("digest_key", flat=True)
+    )
+    count = 0
+    for digest_key in list(due):
+        rows = _claim(
+            models.OutboundEmail.objects.filter(digest_key=digest_key), max_messages
+        )
+        if rows:
+            _deliver(connection, rows, digest(digest_key, rows, connection))
+            count += len(rows)
+    return count
+
+
+def digest(digest_key, rows, connection=None):
+    recipients = []
+    for row in rows:
+        recipients += [r for r in row.to if r not in recipients]
+    separator = "\n\n" + "-" * 72 + "\n\n"
+    body = separator.join(
+        f"{row.subject}\n{row.created_at:%Y-%m-%d %H:%M:%S %Z}\n\n{row.body.strip()}"
+        for row in rows
+    )
+    return EmailMultiAlternatives(
+        subject=f"{settings.EMAIL_SUBJECT_PREFIX}{digest_key}: {len(rows)} messages",
+        body=body,
+        from_email=rows[0].from_email,
+        to=recipients,
+        connection=connection,
+    )
+
+
+def prune():
+    """Delete sent messages older than EMAIL_RETENTION_DAYS."""
+    cutoff = timezone.now() - timedelta(days=settings.EMAIL_RETENTION_DAYS)
+    deleted, _ = models.OutboundEmail.objects.filter(
+        status=models.OutboundEmail.SENT, sent_at__lt=cutoff
+    ).delete()
+    return deleted
@@ -0,0 +1,60 @@
+import time
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from main import models
+from main.fastlane import FastLaneHandler
+
+
+class Command(BaseCommand):
+    help = (
+        "Time anonymous GETs of a tenant page through the full middleware "
+        "stack and through the fast lane."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", help="default: the first user's subdomain")
+        parser.add_argument("--path", default="/")
+        parser.add_argument("--requests", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        host = options["host"]
+        if host is None:
+            user = models.User.objects.order_by("pk").first()
+            if user is None:
+                raise CommandError("no users, pass --host")
+            host = f"{user.username}.{settings.CANONICAL_HOST}"
+        factory = RequestFactory(HTTP_HOST=host)
+
+        for name, handler in (
+            ("full stack", WSGIHandler()),
+            ("fast lane", FastLaneHandler()),
+        ):
+            statuses = set()
+
+            def start_response(status, headers, exc_info=None):
+                statuses.add(status)  # noqa: B023
+
+            def request():
+                environ = factory.get(options["path"]).environ
+                handler(environ, start_response).close()  # noqa: B023
+
+            for _ in range(10):  # fill the page cache
+                request()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for _ in range(options["requests"]):
+                    request()
+                elapsed = time.perf_counter() - start
+
+            per_request = elapsed / options["requests"] * 1_000_000
+            self.stdout.write(
+                f"{name:10}  {per_request:8.1f} µs/request  "
+                f"{len(queries) / options['requests']:.2f} queries/request  "
+                f"{', '.join(sorted(statuses))}"
+            )
@@ -0,0 +1,32 @@
+from django.contrib.staticfiles.management.commands import collectstatic
+from django.contrib.staticfiles.storage import staticfiles_storage
+
+from main.staticfiles import ENCODINGS
+
+
+class Command(collectstatic.Command):
+    """collectstatic, followed by the sizes of pulsar's own assets."""
+
+    def handle(self, **options):
+        result = super().handle(**options)
+        if options["verbosity"] >= 1 and not options["dry_run"]:
+            self.report()
+        return result
+
+    def report(self):
+        if not hasattr(staticfiles_storage, "sizes"):
+            return
+        names = sorted(
+            name
+            for name in staticfiles_storage.hashed_files.values()
+            if name.startswith("main/")
+        )
+        columns = ["", *ENCODINGS]
+        self.stdout.write(
+            f"{'asset':40}" + "".join(f"{c or 'bytes':>10}" for c in columns)
+        )
+        for name in names:
+            sizes = staticfiles_storage.sizes(name)
+            self.stdout.write(
+                f"{name:40}" + "".join(f"{sizes.get(c, '-'):>10}" for c in columns)
+            )
@@ -0,0 +1,45 @@
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+
+from main import models
+
+
+class Command(BaseCommand):
+    help = "Move image blobs stored in the database into the image storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        pending = models.Image.objects.filter(file="", data__isnull=False)
+        count = 0
+        last_pk = 0
+        while True:
+            # Only ids are read in batches; each blob is then loaded on its own
+            # so at most one of them is in memory at a time.
+            pks = list(
+                pending.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not pks:
+                break
+            for pk in pks:
+                image = models.Image.objects.only(
+                    "pk", "slug", "extension", "data"
+                ).get(pk=pk)
+                image.store(ContentFile(bytes(image.data)))
+                image.save(
+                    update_fields=[
+                        "file",
+                        "sha256",
+                        "size_bytes",
+                        "width",
+                        "height",
+                        "data",
+                    ]
+                )
+                count += 1
+            last_pk = pks[-1]
+            self.stdout.write(f"moved {count} images")
+        self.stdout.write(f"done, moved {count} images")
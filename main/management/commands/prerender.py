@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from main import models, prerender
+
+
+def _rebuild(user_id, force):
+    try:
+        return user_id, prerender.rebuild(user_id, force=force), None
+    except Exception as e:
+        return user_id, None, str(e)
+
+
+class Command(BaseCommand):
+    help = "Write the static files of tenant sites into PRERENDER_ROOT."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of processes rendering sites, defaults to the CPUs.",
+        )
+        parser.add_argument(
+            "--user", dest="usernames", action="append", help="Only this tenant."
+        )
+        parser.add_argument(
+            "--changed",
+            action="store_true",
+            help="Skip sites unchanged since their last build.",
+        )
+
+    def handle(self, *args, **options):
+        if not prerender.enabled():
+            raise CommandError("PRERENDER_ROOT is not set")
+        users = models.User.objects.order_by("pk")
+        if options["usernames"]:
+            users = users.filter(username__in=options["usernames"])
+        user_ids = list(users.values_list("pk", flat=True))
+        force = not options["changed"]
+
+        started = time.monotonic()
+        if options["jobs"] <= 1:
+            results = [_rebuild(user_id, force) for user_id in user_ids]
+        else:
+            # forked workers must open their own database connections
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options["jobs"],
+                mp_context=multiprocessing.get_context("fork"),
+            ) as executor:
+                results = list(
+                    executor.map(
+                        _rebuild,
+                        user_ids,
+                        [force] * len(user_ids),
+                        chunksize=16,
+                    )
+                )
+
+        sites = pages = failed = 0
+        for user_id, count, error in results:
+            if error is not None:
+                failed += 1
+                self.stderr.write(f"user {user_id}: {error}")
+            elif count is not None:
+                sites += 1
+                pages += count
+        removed = 0 if options["usernames"] else prerender.prune()
+        self.stdout.write(
+            f"pre-rendered {pages} pages of {sites} sites in "
+            f"{time.monotonic() - started:.1f}s, {len(results) - sites - failed} "
+            f"unchanged, {failed} failed, {removed} removed"
+        )
+        if failed:
+            raise CommandError(f"{failed} sites failed")
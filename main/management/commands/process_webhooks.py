@@ -0,0 +1,43 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import webhooks
+
+
+class Command(BaseCommand):
+    help = "Process queued Stripe webhook events, see main/webhooks.py."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=settings.WEBHOOK_CONCURRENCY
+        )
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once the queue is drained."
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        pruned_at = 0
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            while True:
+                if time.monotonic() - pruned_at > 3600:
+                    pruned = webhooks.prune()
+                    if pruned:
+                        self.stdout.write(f"pruned {pruned} handled events")
+                    pruned_at = time.monotonic()
+
+                if webhooks.process_batch(batch_size, executor):
+                    continue
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
@@ -0,0 +1,89 @@
+import itertools
+
+import stripe
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main import models, subscriptions
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare every Stripe subscription with the copy on its user and fix the "
+        "differences that webhooks missed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Report drift without fixing it."
+        )
+
+    def handle(self, *args, **options):
+        started_at = timezone.now()
+        dry_run = options["dry_run"]
+        checked = drifted = 0
+
+        # auto_paging_iter fetches 100 subscriptions per request as it goes, and
+        # only one batch of them and their users is in memory at a time
+        pages = stripe.Subscription.list(status="all", limit=100).auto_paging_iter()
+        while batch := list(itertools.islice(pages, options["batch_size"])):
+            checked += len(batch)
+            drifted += self.reconcile(batch, dry_run)
+
+        self.stdout.write(
+            f"checked {checked} subscriptions, {drifted} users drifted"
+            + (" (dry run, nothing changed)" if dry_run else "")
+        )
+
+        if dry_run:
+            return
+        # Users that were not stamped above point at a subscription that is not
+        # in the list, eg. deleted in the Stripe dashboard. Only reported.
+        unseen = (
+            models.User.objects.filter(stripe_subscription_id__gt="")
+            .exclude(subscription_synced_at__gte=started_at)
+            .values_list("username", "stripe_subscription_id")
+        )
+        for username, subscription_id in unseen.iterator():
+            self.stdout.write(f"{username}: subscription {subscription_id} not found")
+
+    def reconcile(self, batch, dry_run):
+        by_customer = {}
+        for subscription in batch:
+            by_customer.setdefault(subscription["customer"], []).append(subscription)
+        users = models.User.objects.filter(stripe_customer_id__in=by_customer).only(
+            "username", "stripe_customer_id", *subscriptions.FIELDS
+        )
+
+        now = timezone.now()
+        updated = {}
+        drifted = set()
+        for user in users:
+            for subscription in by_customer[user.stripe_customer_id]:
+                if not self.is_current(user, subscription):
+                    continue
+                before = {f: getattr(user, f) for f in subscriptions.FIELDS}
+                changed = subscriptions.mirror(user, subscription)
+                if changed:
+                    drifted.add(user.pk)
+                    for field in changed:
+                        self.stdout.write(
+                            f"{user.username}: {field} "
+                            f"{before[field]!r} -> {getattr(user, field)!r}"
+                        )
+                user.subscription_synced_at = now
+                updated[user.pk] = user
+        if not dry_run:
+            models.User.objects.bulk_update(updated.values(), subscriptions.FIELDS)
+        return len(drifted)
+
+    def is_current(self, user, subscription):
+        """
+        Whether `subscription` is the one `user` should mirror: the one it
+        already points at, or an active one a missed webhook never linked.
+        Old, canceled subscriptions of the customer are skipped.
+        """
+        if subscription["id"] == user.stripe_subscription_id:
+            return True
+        return subscription["status"] == "active" and not user.is_premium
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main import bus, models, rendering, signals
+
+
+class Command(BaseCommand):
+    help = "Re-render stored page and homepage HTML made by an older renderer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        tenants = set()
+        pages = self.rerender(
+            models.Page.objects.exclude(body_html_version=rendering.RENDERER_VERSION),
+            ("user_id", "body"),
+            models.Page.render_body,
+            ("body_html", "body_html_version", *models.Page.METADATA_FIELDS),
+            batch_size,
+            tenants,
+        )
+        homepages = self.rerender(
+            models.User.objects.exclude(
+                homepage_html_version=rendering.RENDERER_VERSION
+            ),
+            ("homepage",),
+            models.User.render_homepage,
+            ("homepage_html", "homepage_html_version"),
+            batch_size,
+            tenants,
+        )
+        self.invalidate(tenants)
+        self.stdout.write(
+            f"re-rendered {pages} pages and {homepages} homepages "
+            f"of {len(tenants)} sites with {rendering.RENDERER_VERSION}"
+        )
+
+    def rerender(self, queryset, sources, render, fields, batch_size, tenants):
+        """
+        Walk `queryset` in primary key order, one batch in memory at a time,
+        and add the ids of the users it belongs to to `tenants`.
+        """
+        count = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                queryset.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", *sources)[:batch_size]
+            )
+            if not batch:
+                return count
+            for obj in batch:
+                render(obj)
+                tenants.add(getattr(obj, "user_id", obj.pk))
+            queryset.model.objects.bulk_update(batch, fields)
+            count += len(batch)
+            last_pk = batch[-1].pk
+
+    def invalidate(self, tenants):
+        """Drop cached copies and validators of the re-rendered sites."""
+        models.User.objects.filter(pk__in=tenants).update(
+            site_updated_at=timezone.now()
+        )
+        for user_id in sorted(tenants):
+            signals.invalidate_site(user_id)
+            bus.publish("site", user_id=user_id)
@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import mail
+
+
+class Command(BaseCommand):
+    help = "Send queued outbound email over one SMTP connection, see main/mail.py."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Seconds to wait when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit once the queue is drained."
+        )
+
+    def handle(self, *args, **options):
+        connection = mail.get_delivery_connection()
+        pruned_at = 0
+        idle_since = None
+        try:
+            while True:
+                if time.monotonic() - pruned_at > 3600:
+                    mail.prune()
+                    pruned_at = time.monotonic()
+
+                sent = mail.send_pending(connection, options["batch_size"])
+                sent += mail.send_digests(connection)
+                if sent:
+                    idle_since = None
+                    continue
+                if options["once"]:
+                    return
+                if idle_since is None:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since > settings.EMAIL_IDLE_TIMEOUT:
+                    # SMTP servers drop idle clients, let go of it first
+                    connection.close()
+                    idle_since = None
+                time.sleep(options["poll_interval"])
+        finally:
+            connection.close()
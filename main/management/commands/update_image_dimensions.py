@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from main import models, thumbnails
+
+
+class Command(BaseCommand):
+    help = "Fill in the width and height of stored images never measured."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        pending = models.Image.objects.filter(width__isnull=True).exclude(file="")
+        checked = updated = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                pending.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", "file", "width", "height")[: options["batch_size"]]
+            )
+            if not batch:
+                break
+            measured = []
+            for image in batch:
+                try:
+                    with image.file.open("rb") as f:
+                        size = thumbnails.dimensions(f)
+                except OSError as e:
+                    self.stderr.write(f"cannot open image {image.pk}: {e}")
+                    continue
+                if size is not None:
+                    image.width, image.height = size
+                    measured.append(image)
+            models.Image.objects.bulk_update(measured, ["width", "height"])
+            checked += len(batch)
+            updated += len(measured)
+            last_pk = batch[-1].pk
+        self.stdout.write(f"checked {checked} images, measured {updated}")
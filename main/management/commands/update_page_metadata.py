@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from main import models, rendering
+
+METADATA_FIELDS = models.Page.METADATA_FIELDS
+
+
+class Command(BaseCommand):
+    help = "Fill in page word counts, excerpts and content hashes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Check every page, not only the ones never filled in.",
+        )
+
+    def handle(self, *args, **options):
+        queryset = models.Page.objects.all()
+        if not options["all"]:
+            queryset = queryset.filter(content_hash="")
+        checked = updated = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                queryset.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", "body", "body_html", "body_html_version", *METADATA_FIELDS)[
+                    : options["batch_size"]
+                ]
+            )
+            if not batch:
+                break
+            changed = []
+            for page in batch:
+                if page.is_rendered():
+                    continue
+                if page.body_html_version != rendering.RENDERER_VERSION:
+                    page.render_body()
+                else:
+                    page.update_metadata()
+                changed.append(page)
+            models.Page.objects.bulk_update(
+                changed, ["body_html", "body_html_version", *METADATA_FIELDS]
+            )
+            checked += len(batch)
+            updated += len(changed)
+            last_pk = batch[-1].pk
+        self.stdout.write(f"checked {checked} pages, updated {updated}")
@@ -0,0 +1,43 @@
+"""
+In-process counters. Every gunicorn worker keeps its own set, so numbers read
+from one worker only describe the requests that worker served.
+"""
+
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+_counters = Counter()
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def get(name):
+    with _lock:
+        return _counters[name]
+
+
+def snapshot():
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def rates():
+    """Hit rate of every counter pair named `<prefix>.hit` and `<prefix>.miss`."""
+    counters = snapshot()
+    result = {}
+    for name, hits in counters.items():
+        if not name.endswith(".hit"):
+            continue
+        prefix = name.removesuffix(".hit")
+        total = hits + counters.get(f"{prefix}.miss", 0)
+        result[prefix] = round(hits / total, 4) if total else 0.0
+    return result
+
+
+def reset():
+    with _lock:
+        _counters.clear()
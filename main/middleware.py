@@ -3,12 +3,28 @@ import logging
 from django.conf import settings
 from django.http import Http404, HttpResponseBadRequest
 from django.shortcuts import redirect
+from django.utils.functional import SimpleLazyObject
 
-from main import models
+from main import allowlist, models, tenants
 
 logger = logging.getLogger(__name__)
 
 
+def domain_check_middleware(get_response):
+    """
+    Answer Caddy's on-demand TLS ask (views.domain_check) from the in-memory
+    allowlist, skipping sessions, CSRF, auth and host_middleware.
+    Must be first in MIDDLEWARE.
+    """
+
+    def middleware(request):
+        if request.path_info == "/accounts/domain/":
+            return allowlist.respond(request.GET.get("domain"))
+        return get_response(request)
+
+    return middleware
+
+
 def host_middleware(get_response):
     def middleware(request):
         logger.debug("host midd begin")
@@ -35,7 +51,7 @@ def host_middleware(get_response):
         # Strategy: don't set request.subdomain, return immediately.
         if host == settings.CANONICAL_HOST:
             if request.user.is_authenticated:
-                request.custom_css = request.user.custom_css
+                request.css_hash = request.user.custom_css_hash
             logger.debug("host midd case [1]")
             logger.debug("host == settings.CANONICAL_HOST, return")
             return get_response(request)
@@ -54,14 +70,12 @@ def host_middleware(get_response):
         ):
             logger.debug("host midd case [3]")
 
-            request.subdomain = host_parts[0]
-
             # Check if subdomain exists.
-            if not models.User.objects.filter(username=request.subdomain).exists():
+            tenant = tenants.by_username(host_parts[0])
+            if tenant is None:
                 raise Http404()
 
-            request.account_user = models.User.objects.get(username=request.subdomain)
-            request.custom_css = request.account_user.custom_css
+            set_tenant(request, tenant)
 
             # Redirect to custom urls for cases:
             # * Logged out / anon users
@@ -73,10 +87,8 @@ def host_middleware(get_response):
                 redir_domain = ""
 
                 # User has set custom domain
-                if request.account_user.custom_domain:
-                    redir_domain = (
-                        request.account_user.custom_domain + request.path_info
-                    )
+                if tenant.custom_domain:
+                    redir_domain = tenant.custom_domain + request.path_info
 
                 # Prepend double slashes to indicate other domain if there is no
                 # protocol prefix.
@@ -89,11 +101,9 @@ def host_middleware(get_response):
             return get_response(request)
 
         # [4] Custom domain case
-        elif models.User.objects.filter(custom_domain=host).exists():
+        elif tenant := tenants.by_custom_domain(host):
             logger.debug("host midd case [4]")
-            request.account_user = models.User.objects.get(custom_domain=host)
-            request.custom_css = request.account_user.custom_css
-            request.subdomain = request.account_user.username
+            set_tenant(request, tenant)
             return get_response(request)
 
         # [5] Bad request
@@ -101,3 +111,17 @@ def host_middleware(get_response):
             return HttpResponseBadRequest()
 
     return middleware
+
+
+def set_tenant(request, tenant):
+    """
+    Attach the tenant of this host to the request. The full User row is only
+    fetched if the view or template actually uses it, pages link the custom CSS
+    by its hash (see main/css.py).
+    """
+    request.tenant = tenant
+    request.subdomain = tenant.username
+    request.account_user = SimpleLazyObject(
+        lambda: models.User.objects.get(pk=tenant.id)
+    )
+    request.css_hash = tenant.css_hash
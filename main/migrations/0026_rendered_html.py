@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0025_remove_user_contact"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="page",
+            name="body_html",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="page",
+            name="body_html_version",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="homepage_html",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="homepage_html_version",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0026_rendered_html"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="site_updated_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
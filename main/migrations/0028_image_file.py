@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+import main.storage
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0027_user_site_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="file",
+            field=models.FileField(
+                blank=True,
+                max_length=300,
+                storage=main.storage.get_image_storage,
+                upload_to=main.storage.image_path,
+            ),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="sha256",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name="image",
+            name="data",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
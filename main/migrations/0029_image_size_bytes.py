@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:45
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+
+
+def backfill_size_bytes(apps, schema_editor):
+    Image = apps.get_model("main", "Image")
+    Image.objects.filter(data__isnull=False).update(size_bytes=Length("data"))
+
+    batch = []
+    for image in Image.objects.exclude(file="").only("pk", "file").iterator():
+        image.size_bytes = image.file.size
+        batch.append(image)
+        if len(batch) == 500:
+            Image.objects.bulk_update(batch, ["size_bytes"])
+            batch = []
+    Image.objects.bulk_update(batch, ["size_bytes"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0028_image_file"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="size_bytes",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_size_bytes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0029_image_size_bytes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
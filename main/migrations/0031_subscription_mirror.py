@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0030_image_dimensions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="subscription_cancel_at_period_end",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="subscription_status",
+            field=models.CharField(blank=True, default="", max_length=32),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="subscription_synced_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
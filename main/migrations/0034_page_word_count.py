@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+def backfill_word_count(apps, schema_editor):
+    Page = apps.get_model("main", "Page")
+    batch = []
+    for page in Page.objects.only("pk", "body").iterator():
+        page.word_count = len((page.body or "").split())
+        batch.append(page)
+        if len(batch) == 500:
+            Page.objects.bulk_update(batch, ["word_count"])
+            batch = []
+    Page.objects.bulk_update(batch, ["word_count"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0033_outbound_email"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="page",
+            name="word_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_word_count, migrations.RunPython.noop),
+    ]
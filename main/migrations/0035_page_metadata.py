@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0034_page_word_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="page",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="page",
+            name="excerpt",
+            field=models.CharField(blank=True, max_length=300),
+        ),
+    ]
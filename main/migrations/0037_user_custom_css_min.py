@@ -0,0 +1,90 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:30
+
+import hashlib
+import re
+
+from django.db import migrations, models
+
+# A copy of main.css.minify and main.css.digest as of this migration, so that
+# later changes to them do not change what it computes.
+
+_TOKEN = re.compile(
+    r"""
+    (?P<comment>/\*.*?(?:\*/|\Z))
+    | (?P<string>"(?:\\.|[^"\\])*"?|'(?:\\.|[^'\\])*'?)
+    | (?P<space>\s+)
+    | (?P<other>[^"'/\s]+|/)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+_BEFORE = "{};,>"
+_AFTER = "{};,>:"
+
+
+def _is_name(char):
+    return char.isalnum() or char in "-_\\"
+
+
+def minify(text):
+    out = []
+    space = comment = False
+    for match in _TOKEN.finditer(text or ""):
+        kind, token = match.lastgroup, match.group()
+        if kind == "comment":
+            comment = True
+            continue
+        if kind == "space":
+            space = True
+            continue
+        if space and out and out[-1][-1] not in _AFTER and token[0] not in _BEFORE:
+            out.append(" ")
+        elif comment and out and _is_name(out[-1][-1]) and _is_name(token[0]):
+            out.append("/**/")
+        space = comment = False
+        if kind == "other":
+            if token[0] == "}" and out and out[-1].endswith(";"):
+                out[-1] = out[-1][:-1]
+            token = token.replace(";}", "}")
+        out.append(token)
+    return "".join(out)
+
+
+def digest(minified):
+    if not minified:
+        return ""
+    return hashlib.sha256(minified.encode()).hexdigest()[:16]
+
+
+def minify_custom_css(apps, schema_editor):
+    User = apps.get_model("main", "User")
+    batch = []
+    for user in User.objects.exclude(custom_css="").only("pk", "custom_css").iterator():
+        user.custom_css_min = minify(user.custom_css)
+        user.custom_css_hash = digest(user.custom_css_min)
+        batch.append(user)
+        if len(batch) == 500:
+            User.objects.bulk_update(batch, ["custom_css_min", "custom_css_hash"])
+            batch = []
+    User.objects.bulk_update(batch, ["custom_css_min", "custom_css_hash"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0036_bus_event"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="custom_css_hash",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=16
+            ),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="custom_css_min",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.RunPython(minify_custom_css, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,29 @@
-import base64
+import math
 from datetime import timedelta
 
-import mistune
-import stripe
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import Count, Sum
 from django.urls import reverse
 from django.utils import timezone
 
-from main import validators
+from main import css, rendering, storage, thumbnails, validators
 
 
 class User(AbstractUser):
+    # Fields that show up on the user's public website.
+    SITE_FIELDS = {
+        "username",
+        "custom_domain",
+        "custom_css",
+        "website_title",
+        "homepage",
+        "show_nav",
+    }
+    # Large website content, not loaded for request.user (see main.auth).
+    CONTENT_FIELDS = ("homepage", "homepage_html", "custom_css", "custom_css_min")
+
     username = models.CharField(
         max_length=150,
         unique=True,
@@ -32,10 +43,19 @@ class User(AbstractUser):
         validators=[validators.validate_domain_name],
     )
     custom_css = models.TextField("Custom CSS", blank=True, null=True, default="")
+    # what /<custom_css_hash>.css serves, see main/css.py
+    custom_css_min = models.TextField(blank=True, default="")
+    custom_css_hash = models.CharField(
+        max_length=16, blank=True, default="", db_index=True
+    )
 
     website_title = models.CharField(max_length=500, blank=True, null=True)
     homepage = models.TextField(blank=True, null=True, default="")
+    homepage_html = models.TextField(blank=True, default="")
+    homepage_html_version = models.CharField(max_length=100, blank=True, default="")
     show_nav = models.BooleanField(default=True)
+    # last change of anything on the website, including its pages
+    site_updated_at = models.DateTimeField(default=timezone.now)
 
     # subscription fields
     is_premium = models.BooleanField(default=False)
@@ -43,6 +63,10 @@ class User(AbstractUser):
     stripe_subscription_id = models.CharField(max_length=255, blank=True, null=True)
     subscription_start_date = models.DateTimeField(blank=True, null=True)
     subscription_end_date = models.DateTimeField(blank=True, null=True)
+    # mirror of the Stripe subscription, see main/subscriptions.py
+    subscription_status = models.CharField(max_length=32, blank=True, default="")
+    subscription_cancel_at_period_end = models.BooleanField(default=False)
+    subscription_synced_at = models.DateTimeField(blank=True, null=True)
 
     @property
     def website_url(self):
@@ -55,22 +79,51 @@ class User(AbstractUser):
 
     @property
     def homepage_as_html(self):
-        markdown = mistune.create_markdown(
-            escape=False,
-            plugins=["task_lists", "footnotes"],
-        )
-        return markdown(self.homepage)
+        if self.homepage_html_version == rendering.RENDERER_VERSION:
+            return self.homepage_html
+        return rendering.render(self.homepage)
+
+    def render_homepage(self):
+        self.homepage_html = rendering.render(self.homepage)
+        self.homepage_html_version = rendering.RENDERER_VERSION
+
+    def minify_css(self):
+        self.custom_css_min = css.minify(self.custom_css)
+        self.custom_css_hash = css.digest(self.custom_css_min)
 
     @property
     def subscription_is_canceled(self):
-        if not self.is_premium or not self.stripe_subscription_id:
-            return False
-        try:
-            subscription = stripe.Subscription.retrieve(self.stripe_subscription_id)
-            return subscription.cancel_at_period_end
-        except Exception:
-            # if we can't retrieve, assume it's not canceled
-            return False
+        return self.is_premium and self.subscription_cancel_at_period_end
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None:
+            # A deferred homepage or CSS was not changed, and Django saves only
+            # the loaded fields of a partially loaded row.
+            deferred = self.get_deferred_fields()
+            if "homepage" not in deferred:
+                self.render_homepage()
+            if "custom_css" not in deferred:
+                self.minify_css()
+            self.site_updated_at = timezone.now()
+        else:
+            update_fields = set(update_fields)
+            if "homepage" in update_fields:
+                self.render_homepage()
+                update_fields |= {"homepage_html", "homepage_html_version"}
+            if "custom_css" in update_fields:
+                self.minify_css()
+                update_fields |= {"custom_css_min", "custom_css_hash"}
+            if update_fields & self.SITE_FIELDS:
+                self.site_updated_at = timezone.now()
+                update_fields.add("site_updated_at")
+            kwargs["update_fields"] = update_fields
+        super().save(*args, **kwargs)
+
+    def image_usage(self):
+        """Return the number of images and their total size in bytes."""
+        usage = self.image_set.aggregate(count=Count("pk"), size=Sum("size_bytes"))
+        return usage["count"], usage["size"] or 0
 
     def __str__(self):
         return self.username
@@ -86,15 +139,70 @@ class Page(models.Model):
     )
     title = models.CharField(max_length=300)
     body = models.TextField(blank=True, null=True)
+    body_html = models.TextField(blank=True, default="")
+    body_html_version = models.CharField(max_length=100, blank=True, default="")
+    word_count = models.PositiveIntegerField(default=0)
+    excerpt = models.CharField(max_length=rendering.EXCERPT_LENGTH, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    # Enough for links and summaries, for listings that should not load bodies
+    LISTING_FIELDS = (
+        "id",
+        "user_id",
+        "slug",
+        "title",
+        "created_at",
+        "updated_at",
+        "word_count",
+        "excerpt",
+    )
+    # derived from body by update_metadata
+    METADATA_FIELDS = ("word_count", "excerpt", "content_hash")
+    WORDS_PER_MINUTE = 200
+
     @property
     def body_as_html(self):
-        markdown = mistune.create_markdown(
-            escape=False,
-            plugins=["task_lists", "footnotes"],
+        if self.body_html_version == rendering.RENDERER_VERSION:
+            return self.body_html
+        return rendering.render(self.body)
+
+    @property
+    def reading_time(self):
+        """Minutes it takes to read the page, at least 1."""
+        return max(1, math.ceil(self.word_count / self.WORDS_PER_MINUTE))
+
+    def render_body(self):
+        self.body_html = rendering.render(self.body)
+        self.body_html_version = rendering.RENDERER_VERSION
+        self.update_metadata()
+
+    def update_metadata(self):
+        """Derive the summary columns from body and an up to date body_html."""
+        self.word_count = len((self.body or "").split())
+        self.excerpt = rendering.excerpt(self.body_html)
+        self.content_hash = rendering.content_hash(self.body)
+
+    def is_rendered(self):
+        return (
+            self.body_html_version == rendering.RENDERER_VERSION
+            and self.content_hash == rendering.content_hash(self.body)
         )
-        return markdown(self.body)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "body" in update_fields:
+            # saving an unchanged body does not render it again
+            if not self.is_rendered():
+                self.render_body()
+            if update_fields is not None:
+                kwargs["update_fields"] = {
+                    *update_fields,
+                    "body_html",
+                    "body_html_version",
+                    *self.METADATA_FIELDS,
+                }
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
@@ -107,7 +215,18 @@ class Image(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=300)  # original filename
     slug = models.CharField(max_length=300, unique=True)
-    data = models.BinaryField()
+    file = models.FileField(
+        storage=storage.get_image_storage,
+        upload_to=storage.image_path,
+        max_length=300,
+        blank=True,
+    )
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    size_bytes = models.PositiveIntegerField(default=0)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    # legacy in-database blob, moved to `file` by `manage.py migrate_image_blobs`
+    data = models.BinaryField(blank=True, null=True)
     extension = models.CharField(max_length=10)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
@@ -115,14 +234,25 @@ class Image(models.Model):
     def filename(self):
         return self.slug + "." + self.extension
 
-    @property
-    def data_as_base64(self):
-        return base64.b64encode(self.data).decode("utf-8")
-
     @property
     def data_size(self):
         """Get image size in MB."""
-        return round(len(self.data) / (1024 * 1024), 2)
+        return round(self.size_bytes / (1024 * 1024), 2)
+
+    def store(self, f):
+        """Write the file-like `f` to the image storage, without saving the row."""
+        self.sha256 = storage.sha256(f)
+        self.size_bytes = f.size
+        self.width, self.height = thumbnails.dimensions(f) or (None, None)
+        self.file.save(self.filename, f, save=False)
+        self.data = None
+
+    def read(self):
+        """Return the whole image in memory. Only for small or rare uses."""
+        if self.file:
+            with self.file.open("rb") as f:
+                return f.read()
+        return bytes(self.data)
 
     def get_raw_absolute_url(self):
         path = reverse(
@@ -136,3 +266,81 @@ class Image(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class WebhookEvent(models.Model):
+    """A verified Stripe event waiting for `manage.py process_webhooks`."""
+
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (DONE, "Done"), (FAILED, "Failed")]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    customer_id = models.CharField(max_length=255, blank=True, default="")
+    payload = models.JSONField()
+    # Stripe's event creation time, events of a customer are handled in order
+    created = models.DateTimeField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.type} {self.event_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"]),
+            models.Index(fields=["customer_id", "created"]),
+        ]
+
+
+class OutboundEmail(models.Model):
+    """An email waiting for `manage.py send_queued_email`, see main/mail.py."""
+
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENDING, "Sending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=300)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list)
+    bcc = models.JSONField(default=list)
+    reply_to = models.JSONField(default=list)
+    headers = models.JSONField(default=dict)
+    alternatives = models.JSONField(default=list)  # [[content, mimetype], ...]
+    # messages with the same key are sent together as one digest
+    digest_key = models.CharField(max_length=100, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return self.subject
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "digest_key", "run_after"])]
+
+
+class BusEvent(models.Model):
+    """An invalidation event for SQLite deployments, see main/bus.py."""
+
+    payload = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
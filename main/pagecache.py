@@ -0,0 +1,186 @@
+"""
+Full-page cache for anonymous visitors of tenant sites.
+
+Entries are keyed by host, path and a per-tenant generation. The generation is
+replaced whenever anything that shows up on the tenant's site changes (see
+main.signals), which orphans every stored page of that tenant at once.
+
+The same registry data backs ETag/Last-Modified validators, so revalidations
+are answered with a 304 without touching the database.
+"""
+
+import gzip
+import hashlib
+import time
+from functools import wraps
+
+import zstandard
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.views.decorators.http import condition
+
+from main import metrics, rendering
+
+re_accepts_zstd = _lazy_re_compile(r"\bzstd\b")
+
+
+def _generation_key(tenant_id):
+    return f"pagecache:generation:{tenant_id}"
+
+
+def generation(tenant_id):
+    key = _generation_key(tenant_id)
+    value = cache.get(key)
+    if value is None:
+        value = time.time_ns()
+        cache.add(key, value, timeout=None)
+        value = cache.get(key, value)
+    return value
+
+
+def bump(tenant_id):
+    """Invalidate every cached page of the tenant."""
+    # A timestamp rather than a counter, so that a generation key that got
+    # evicted can never come back with a value that was already used.
+    cache.set(_generation_key(tenant_id), time.time_ns(), timeout=None)
+    metrics.incr("pagecache.invalidate")
+
+
+def _page_key(request):
+    url = request.get_host() + request.path
+    digest = hashlib.sha256(url.encode()).hexdigest()
+    return (
+        f"pagecache:page:{request.tenant.id}:{generation(request.tenant.id)}:{digest}"
+    )
+
+
+def _cacheable(request):
+    # The owner sees the edit toolbar and everyone logged in may see their
+    # trial banner or flash messages, so only anonymous requests share pages.
+    # Pre-rendering needs the page as it is now, not as it was cached.
+    return (
+        request.method in ("GET", "HEAD")
+        and not getattr(request, "prerender", False)
+        and hasattr(request, "tenant")
+        and not request.user.is_authenticated
+        and not len(messages.get_messages(request))
+    )
+
+
+def _to_entry(response):
+    content = response.content
+    entry = {
+        "content_type": response["Content-Type"],
+        "identity": content,
+        "gzip": gzip.compress(content),
+        "zstd": zstandard.compress(content),
+    }
+    return entry
+
+
+def _negotiate_encoding(request):
+    accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    if re_accepts_zstd.search(accept_encoding):
+        return "zstd"
+    if re_accepts_gzip.search(accept_encoding):
+        return "gzip"
+    return "identity"
+
+
+def _from_entry(request, entry):
+    encoding = _negotiate_encoding(request)
+    response = HttpResponse(entry[encoding], content_type=entry["content_type"])
+    if encoding != "identity":
+        response["Content-Encoding"] = encoding
+    response["Content-Length"] = str(len(response.content))
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+def cache_tenant_page(view):
+    """
+    Serve anonymous GET/HEAD requests without a query string on tenant hosts
+    from the cache, storing successful responses on a miss. Everything else passes straight through.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        # Tenant views ignore query strings, so storing a page per query
+        # string would only let anyone fill the cache with copies.
+        if not _cacheable(request) or request.GET:
+            if hasattr(request, "tenant"):
+                metrics.incr("pagecache.bypass")
+            return view(request, *args, **kwargs)
+
+        key = _page_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            metrics.incr("pagecache.hit")
+            return _from_entry(request, entry)
+
+        metrics.incr("pagecache.miss")
+        response = view(request, *args, **kwargs)
+        if hasattr(response, "render") and callable(response.render):
+            response.render()
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return response
+
+        entry = _to_entry(response)
+        cache.set(key, entry, timeout=settings.PAGE_CACHE_TIMEOUT)
+        return _from_entry(request, entry)
+
+    return wrapper
+
+
+def _tenant_etag(request, *args, **kwargs):
+    if not _cacheable(request):
+        return None
+    tenant = request.tenant
+    # Every change to the tenant's pages, homepage, CSS or settings moves
+    # updated_at. The negotiated encoding is part of it because each encoding
+    # is a different representation.
+    value = ":".join(
+        (
+            str(tenant.id),
+            tenant.updated_at.isoformat(),
+            rendering.RENDERER_VERSION,
+            request.get_host(),
+            request.get_full_path(),
+            _negotiate_encoding(request),
+        )
+    )
+    return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+
+def _tenant_last_modified(request, *args, **kwargs):
+    if not _cacheable(request):
+        return None
+    return request.tenant.updated_at
+
+
+_condition = condition(etag_func=_tenant_etag, last_modified_func=_tenant_last_modified)
+
+
+def conditional_tenant_page(view):
+    """
+    Answer If-None-Match / If-Modified-Since with a 304 from the tenant registry
+    alone, before the view runs any query, markdown or template work.
+    """
+    conditional_view = _condition(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        cacheable = _cacheable(request)
+        response = conditional_view(request, *args, **kwargs)
+        if cacheable and response.status_code in (200, 304):
+            # Without it browsers guess a freshness lifetime from Last-Modified
+            # and show stale pages without ever revalidating.
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    return wrapper
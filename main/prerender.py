@@ -0,0 +1,209 @@
+"""
+Tenant sites pre-rendered to static files, for Caddy to send without Django.
+
+With PRERENDER_ROOT set, every tenant's homepage and pages are written as
+<PRERENDER_ROOT>/<host>/index.html and <host>/<slug>/index.html, plus .gz
+copies, where <host> is the custom domain if there is one, else the
+subdomain. They are exactly what an anonymous visitor gets from the fast lane
+(main.fastlane). Caddy tries these files for cookie-less GETs and falls
+through to Django on a miss (see ansible/Caddyfile.j2).
+
+A change to a page or to the tenant's site fields rebuilds that tenant in a
+background thread of every process that hears about it (main.signals and
+main.bus). The whole site is rebuilt because every page carries the nav.
+Builds of a tenant are serialized with a file lock, and each records the
+tenant's site_updated_at, so the processes after the first find the files up
+to date and skip. `manage.py prerender` rebuilds every tenant regardless, for
+deployments and template changes.
+
+Bookkeeping lives in <PRERENDER_ROOT>/.tenants/<id>.json: the tenant's host,
+so that a renamed site's old files are removed, and the site_updated_at of
+its last build.
+"""
+
+import contextlib
+import fcntl
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.test import RequestFactory
+from django.urls import reverse
+
+from main import metrics, models
+
+logger = logging.getLogger(__name__)
+
+STATE_DIRECTORY = ".tenants"
+
+_handler = None
+_executor = None
+_lock = threading.Lock()
+
+
+def enabled():
+    return bool(settings.PRERENDER_ROOT)
+
+
+def _get_handler():
+    global _handler
+    with _lock:
+        if _handler is None:
+            from main.fastlane import FastLaneHandler
+
+            _handler = FastLaneHandler()
+        return _handler
+
+
+def host(user):
+    return user.custom_domain or f"{user.username}.{settings.CANONICAL_HOST}"
+
+
+def _state_path(user_id, suffix):
+    return os.path.join(settings.PRERENDER_ROOT, STATE_DIRECTORY, f"{user_id}{suffix}")
+
+
+def _read_state(user_id):
+    try:
+        with open(_state_path(user_id, ".json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_atomic(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def render(site_host, path):
+    """Return the body an anonymous GET of `path` on `site_host` gets, or None."""
+    request = RequestFactory(HTTP_HOST=site_host).get(path)
+    # rendered from the database: a cached copy may predate the change
+    request.prerender = True
+    response = _get_handler().get_response(request)
+    try:
+        if response.status_code != 200 or response.streaming:
+            return None
+        return response.content
+    finally:
+        response.close()
+
+
+def _remove_site(site_host):
+    shutil.rmtree(os.path.join(settings.PRERENDER_ROOT, site_host), ignore_errors=True)
+
+
+def _build(user):
+    site_host = host(user)
+    root = os.path.join(settings.PRERENDER_ROOT, site_host)
+    paths = [reverse("index")] + [
+        reverse("page_detail", args=(slug,))
+        for slug in models.Page.objects.filter(user=user).values_list("slug", flat=True)
+    ]
+    written = set()
+    for path in paths:
+        content = render(site_host, path)
+        if content is None:
+            continue
+        name = os.path.join(root, path.strip("/"), "index.html")
+        _write_atomic(name, content)
+        _write_atomic(f"{name}.gz", gzip.compress(content, mtime=0))
+        written |= {name, f"{name}.gz"}
+
+    # pages that were deleted or renamed
+    for directory, _, files in os.walk(root, topdown=False):
+        for filename in files:
+            name = os.path.join(directory, filename)
+            if name not in written:
+                os.remove(name)
+        if directory != root and not os.listdir(directory):
+            os.rmdir(directory)
+    return len(written) // 2
+
+
+def rebuild(user_id, force=False):
+    """
+    Write the static files of a tenant, or delete them if the user is gone.
+    Return the number of pages written, or None if they were up to date.
+    """
+    os.makedirs(os.path.join(settings.PRERENDER_ROOT, STATE_DIRECTORY), exist_ok=True)
+    with open(_state_path(user_id, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = _read_state(user_id)
+        user = models.User.objects.filter(pk=user_id).first()
+        if state.get("host") and (user is None or state["host"] != host(user)):
+            _remove_site(state["host"])
+        if user is None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(_state_path(user_id, ".json"))
+            return 0
+
+        # read before the pages, so a change committed meanwhile rebuilds again
+        new_state = {"host": host(user), "version": user.site_updated_at.isoformat()}
+        if state == new_state and not force:
+            metrics.incr("prerender.skip")
+            return None
+        count = _build(user)
+        _write_atomic(_state_path(user_id, ".json"), json.dumps(new_state).encode())
+        metrics.incr("prerender.build")
+        return count
+
+
+def _rebuild_in_thread(user_id):
+    try:
+        rebuild(user_id)
+    except Exception as e:
+        logger.error(f"cannot pre-render site of user {user_id}: {e}")
+    finally:
+        close_old_connections()
+
+
+def schedule(user_id):
+    """Rebuild a tenant in the background, if pre-rendering is enabled."""
+    global _executor
+    if not enabled():
+        return
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="prerender"
+            )
+    _executor.submit(_rebuild_in_thread, user_id)
+
+
+def schedule_all():
+    """Bring every tenant up to date in the background, after missed events."""
+    if not enabled():
+        return
+    for user_id in models.User.objects.values_list("pk", flat=True).iterator():
+        schedule(user_id)
+
+
+def prune():
+    """Delete the files of tenants that no longer exist, return how many."""
+    directory = os.path.join(settings.PRERENDER_ROOT, STATE_DIRECTORY)
+    if not os.path.isdir(directory):
+        return 0
+    user_ids = {
+        int(name.removesuffix(".json"))
+        for name in os.listdir(directory)
+        if name.endswith(".json")
+    }
+    existing = set(
+        models.User.objects.filter(pk__in=user_ids).values_list("pk", flat=True)
+    )
+    for user_id in user_ids - existing:
+        rebuild(user_id)
+    return len(user_ids - existing)
@@ -0,0 +1,32 @@
+import hashlib
+from html import unescape
+
+import mistune
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+PLUGINS = ["task_lists", "footnotes"]
+
+# Stored HTML stamped with a different version is re-rendered by
+# `manage.py rerender_markdown`. Bump the trailing number whenever the output of
+# the renderer changes for reasons other than the mistune version or plugins.
+RENDERER_VERSION = f"mistune-{mistune.__version__}:{','.join(PLUGINS)}:1"
+
+_markdown = mistune.create_markdown(escape=False, plugins=PLUGINS)
+
+
+def render(text):
+    return _markdown(text or "")
+
+
+EXCERPT_LENGTH = 300
+
+
+def excerpt(html):
+    """Plain text start of rendered HTML, at most EXCERPT_LENGTH characters."""
+    text = " ".join(unescape(strip_tags(html or "")).split())
+    return Truncator(text).chars(EXCERPT_LENGTH)
+
+
+def content_hash(text):
+    return hashlib.sha256((text or "").encode()).hexdigest()
@@ -0,0 +1,91 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from main import (
+    allowlist,
+    bus,
+    models,
+    pagecache,
+    prerender,
+    tenants,
+    thumbnails,
+    variants,
+)
+
+# Each change is evicted here, in the process that made it, and published on
+# the bus to the handler of the same name in every other process.
+
+
+@bus.subscribe("user")
+def invalidate_user(user_id, username, custom_domain, hosts, site):
+    tenants.invalidate(user_id, username, custom_domain)
+    if hosts:
+        allowlist.invalidate()
+    if site:
+        pagecache.bump(user_id)
+    if hosts or site:
+        transaction.on_commit(partial(prerender.schedule, user_id))
+
+
+@bus.subscribe("site")
+def invalidate_site(user_id):
+    tenants.invalidate_id(user_id)
+    pagecache.bump(user_id)
+    transaction.on_commit(partial(prerender.schedule, user_id))
+
+
+@bus.subscribe("image")
+def delete_image_copies(sha256, extension):
+    # thumbnails and variants live on each host's own image storage
+    image = models.Image(sha256=sha256, extension=extension)
+    if sha256 and not models.Image.objects.filter(sha256=sha256).exists():
+        thumbnails.delete(image)
+        variants.delete(image)
+
+
+@bus.on_resync
+def clear_caches():
+    tenants.clear()
+    allowlist.invalidate()
+    prerender.schedule_all()
+
+
+@receiver(post_save, sender=models.User)
+@receiver(post_delete, sender=models.User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    event = {
+        "user_id": instance.id,
+        "username": instance.username,
+        "custom_domain": instance.custom_domain,
+        "hosts": update_fields is None
+        or bool({"username", "custom_domain"}.intersection(update_fields)),
+        "site": update_fields is None
+        or bool(models.User.SITE_FIELDS.intersection(update_fields)),
+    }
+    invalidate_user(**event)
+    bus.publish("user", **event)
+
+
+@receiver(post_save, sender=models.Page)
+@receiver(post_delete, sender=models.Page)
+def page_changed(sender, instance, **kwargs):
+    models.User.objects.filter(pk=instance.user_id).update(
+        site_updated_at=timezone.now()
+    )
+    invalidate_site(instance.user_id)
+    bus.publish("site", user_id=instance.user_id)
+
+
+@receiver(post_delete, sender=models.Image)
+def image_deleted(sender, instance, **kwargs):
+    # Files are shared by identical uploads, only delete the last reference.
+    name = instance.file.name
+    if name and not models.Image.objects.filter(file=name).exists():
+        instance.file.storage.delete(name)
+        thumbnails.delete(instance)
+        variants.delete(instance)
+        bus.publish("image", sha256=instance.sha256, extension=instance.extension)
@@ -0,0 +1,64 @@
+"""
+Static files storage: fingerprinted names plus precompressed copies.
+
+collectstatic stores every file under a name with its content hash (eg.
+main/layout.3f2a9c1b7d4e.css) and, for text formats, writes .gz, .br and
+.zst copies next to the hashed file, so Caddy's `file_server { precompressed }`
+sends them as they are with immutable caching (see ansible/Caddyfile.j2).
+"""
+
+import gzip
+import os
+
+import brotli
+import zstandard
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+COMPRESSIBLE = (".css", ".js", ".svg", ".txt", ".json", ".map", ".html")
+
+ENCODINGS = {
+    "gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+    "br": lambda data: brotli.compress(data, quality=11),
+    "zst": lambda data: zstandard.compress(data, level=19),
+}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        # Without a manifest collectstatic has not run, as in development and
+        # tests, where the unhashed names are served from the app directories.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files.values()):
+            if name.endswith(COMPRESSIBLE):
+                self.compress(name)
+
+    def compress(self, name):
+        """Write a copy of `name` per encoding, return {extension: size}."""
+        path = self.path(name)
+        with open(path, "rb") as f:
+            data = f.read()
+        sizes = {}
+        for extension, compress in ENCODINGS.items():
+            compressed = compress(data)
+            if len(compressed) >= len(data):
+                continue  # the original is served instead
+            with open(f"{path}.{extension}", "wb") as f:
+                f.write(compressed)
+            sizes[extension] = len(compressed)
+        return sizes
+
+    def sizes(self, name):
+        """Size of the stored `name` and of its compressed copies."""
+        path = self.path(name)
+        sizes = {"": os.path.getsize(path)}
+        for extension in ENCODINGS:
+            if os.path.exists(f"{path}.{extension}"):
+                sizes[extension] = os.path.getsize(f"{path}.{extension}")
+        return sizes
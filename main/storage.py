@@ -0,0 +1,67 @@
+"""
+Content-addressed file store for uploaded images.
+
+Files are named after the SHA-256 of their bytes and sharded two levels deep,
+eg. images/9f/86/9f86d08...15b0.png, so identical uploads share one file and a
+stored file never changes. The backend is the "images" alias of STORAGES and
+can be swapped for any Django storage that keeps the same names.
+"""
+
+import contextlib
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage, storages
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Same name means same content, so never pick an alternative name.
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        # Written aside and linked into place, so the file shows up complete.
+        # Racing writers of the same name have the same content, and the ones
+        # that find it already there are done.
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            with contextlib.suppress(FileExistsError):
+                os.link(tmp_path, path)
+        finally:
+            os.unlink(tmp_path)
+        return name
+
+
+def get_image_storage():
+    return storages["images"]
+
+
+def sha256(f):
+    """Hash a file-like object in chunks and rewind it."""
+    digest = hashlib.sha256()
+    if hasattr(f, "chunks"):
+        for chunk in f.chunks():
+            digest.update(chunk)
+    else:
+        f.seek(0)
+        while chunk := f.read(64 * 1024):
+            digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def image_path(instance, filename):
+    """`upload_to` for Image.file; expects `instance.sha256` to be set."""
+    digest = instance.sha256
+    return f"images/{digest[:2]}/{digest[2:4]}/{digest}.{instance.extension}"
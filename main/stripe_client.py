@@ -0,0 +1,127 @@
+"""
+Configuration of the stripe library and the wrapper for calls made while a
+request waits.
+
+The library is set up once per process (MainConfig.ready) with tight connect
+and read timeouts, and its own bounded retries, which back off exponentially
+with jitter. `call` adds a per-process circuit breaker: after
+STRIPE_CIRCUIT_THRESHOLD consecutive failures it raises StripeUnavailable
+without calling Stripe for STRIPE_CIRCUIT_COOLDOWN seconds, then lets one call
+through to probe whether Stripe is back.
+"""
+
+import logging
+import threading
+import time
+
+import stripe
+from django.conf import settings
+
+from main import metrics
+
+logger = logging.getLogger(__name__)
+
+# Errors that say Stripe is unreachable or unwell, as opposed to a bad request
+OUTAGE_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.APIError,
+    stripe.error.RateLimitError,
+)
+
+LATENCY_BUCKETS_MS = (100, 300, 1000, 3000)
+
+
+class StripeUnavailable(Exception):
+    pass
+
+
+def configure():
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    if settings.STRIPE_API_BASE:
+        stripe.api_base = settings.STRIPE_API_BASE
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    stripe.default_http_client = stripe.RequestsClient(
+        timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT)
+    )
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            # half-open: this call probes Stripe, the others keep failing fast
+            # until it reports back
+            self.opened_at = time.monotonic()
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning(
+                        f"stripe circuit open after {self.failures} failures"
+                    )
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+breaker = CircuitBreaker(
+    threshold=settings.STRIPE_CIRCUIT_THRESHOLD,
+    cooldown=settings.STRIPE_CIRCUIT_COOLDOWN,
+)
+
+
+def _record_latency(elapsed_ms):
+    metrics.incr("stripe.calls")
+    metrics.incr("stripe.latency_ms", round(elapsed_ms))
+    for bucket in LATENCY_BUCKETS_MS:
+        if elapsed_ms <= bucket:
+            metrics.incr(f"stripe.latency_le_{bucket}ms")
+            return
+    metrics.incr("stripe.latency_slow")
+
+
+def call(method, *args, **kwargs):
+    """
+    Run `method` (eg. stripe.Customer.create) with the arguments given, unless
+    the circuit is open, in which case raise StripeUnavailable.
+    """
+    if not breaker.allow():
+        metrics.incr("stripe.rejected")
+        raise StripeUnavailable("Stripe is unavailable, not calling it")
+
+    start = time.monotonic()
+    try:
+        result = method(*args, **kwargs)
+    except OUTAGE_ERRORS:
+        metrics.incr("stripe.error")
+        breaker.failure()
+        raise
+    except stripe.error.StripeError:
+        # Stripe answered, the request was wrong
+        breaker.success()
+        raise
+    else:
+        breaker.success()
+        return result
+    finally:
+        _record_latency((time.monotonic() - start) * 1000)
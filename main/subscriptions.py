@@ -0,0 +1,154 @@
+"""
+Local mirror of each user's Stripe subscription.
+
+Pages read the subscription state from the User row only. The row is updated
+from the objects Stripe hands us anyway: webhook payloads and the responses to
+our own cancel/resume calls. If the webhook stream lags, `refresh_if_stale`
+re-fetches the subscription in a background thread and the page renders with
+what is stored meanwhile.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from main import models, stripe_client
+
+logger = logging.getLogger(__name__)
+
+FIELDS = [
+    "stripe_subscription_id",
+    "subscription_status",
+    "subscription_start_date",
+    "subscription_cancel_at_period_end",
+    "subscription_end_date",
+    "subscription_synced_at",
+    "is_premium",
+]
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def _timestamp(value):
+    return timezone.datetime.fromtimestamp(value, tz=timezone.timezone.utc)
+
+
+def period_end(subscription):
+    """Return the end of the current billing period of a Stripe subscription."""
+    # moved from the subscription to its items in Stripe API version 2025-03-31
+    items = subscription.get("items") or {}
+    for item in items.get("data") or []:
+        if item.get("current_period_end"):
+            return _timestamp(item["current_period_end"])
+    if subscription.get("current_period_end"):
+        return _timestamp(subscription["current_period_end"])
+    return None
+
+
+def mirror(user, subscription):
+    """
+    Copy the state of a Stripe subscription object onto `user` without saving,
+    return the names of the fields that changed.
+    """
+    values = {
+        "stripe_subscription_id": subscription["id"],
+        "subscription_status": subscription["status"],
+        "subscription_cancel_at_period_end": bool(
+            subscription.get("cancel_at_period_end")
+        ),
+        "is_premium": subscription["status"] == "active",
+    }
+    if end := period_end(subscription):
+        values["subscription_end_date"] = end
+    if user.subscription_start_date is None and subscription.get("created"):
+        values["subscription_start_date"] = _timestamp(subscription["created"])
+    changed = []
+    for field, value in values.items():
+        if getattr(user, field) != value:
+            setattr(user, field, value)
+            changed.append(field)
+    return changed
+
+
+def apply(user, subscription):
+    """Copy the state of a Stripe subscription object onto `user` and save it."""
+    mirror(user, subscription)
+    user.subscription_synced_at = timezone.now()
+    user.save(update_fields=FIELDS)
+
+
+def apply_deleted(user):
+    user.subscription_status = "canceled"
+    user.subscription_cancel_at_period_end = False
+    user.is_premium = False
+    user.subscription_end_date = timezone.now()
+    user.subscription_synced_at = timezone.now()
+    user.save(update_fields=FIELDS)
+
+
+def refresh(user_id):
+    """Fetch the subscription of the user from Stripe and store it."""
+    user = models.User.objects.get(pk=user_id)
+    if not user.stripe_subscription_id:
+        return
+    subscription = stripe_client.call(
+        stripe.Subscription.retrieve, user.stripe_subscription_id
+    )
+    apply(user, subscription)
+
+
+def reconcile_checkout(user, session_id):
+    """
+    Apply the subscription of a completed checkout session of `user`, for when
+    the customer is back from Stripe before the webhook is.
+    """
+    session = stripe_client.call(
+        stripe.checkout.Session.retrieve, session_id, expand=["subscription"]
+    )
+    if session["customer"] != user.stripe_customer_id:
+        return
+    subscription = session.get("subscription")
+    if session["status"] == "complete" and subscription:
+        apply(user, subscription)
+
+
+def is_stale(user):
+    if not user.stripe_subscription_id or not settings.SUBSCRIPTION_REFRESH_AFTER:
+        return False
+    synced_at = user.subscription_synced_at
+    max_age = timedelta(seconds=settings.SUBSCRIPTION_REFRESH_AFTER)
+    return synced_at is None or timezone.now() - synced_at > max_age
+
+
+def _refresh_in_background(user_id):
+    try:
+        refresh(user_id)
+    except Exception as e:
+        logger.warning(f"cannot refresh subscription of user {user_id}: {e}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(user_id)
+        # the thread ends here, with CONN_MAX_AGE its connection would linger
+        connection.close()
+
+
+def refresh_if_stale(user):
+    """
+    Start a background refresh of the user's subscription if its mirror is
+    older than SUBSCRIPTION_REFRESH_AFTER. Never blocks on Stripe.
+    """
+    if not is_stale(user):
+        return
+    with _refreshing_lock:
+        if user.id in _refreshing:
+            return
+        _refreshing.add(user.id)
+    threading.Thread(
+        target=_refresh_in_background, args=(user.id,), daemon=True
+    ).start()
@@ -0,0 +1,80 @@
+"""
+Per-worker registry mapping hosts to tenants.
+
+Public pages are resolved from here with zero queries on a hit. Entries are
+evicted on User save/delete in every worker (see main.signals and main.bus)
+and expire after TENANT_CACHE_TTL seconds, which bounds staleness while the
+bus is disconnected.
+"""
+
+from datetime import datetime
+from typing import NamedTuple
+
+from django.conf import settings
+
+from main import metrics, models
+from main.lru import MISSING, LRUCache
+
+
+class Tenant(NamedTuple):
+    id: int
+    username: str
+    custom_domain: str | None
+    show_nav: bool
+    updated_at: datetime
+    css_hash: str
+
+
+cache = LRUCache(maxsize=settings.TENANT_CACHE_SIZE, ttl=settings.TENANT_CACHE_TTL)
+
+
+def _lookup(key, **filters):
+    tenant = cache.get(key)
+    if tenant is not MISSING:
+        metrics.incr("tenants.hit")
+        return tenant
+
+    metrics.incr("tenants.miss")
+    row = (
+        models.User.objects.filter(**filters)
+        .values_list(
+            "id",
+            "username",
+            "custom_domain",
+            "show_nav",
+            "site_updated_at",
+            "custom_css_hash",
+        )
+        .first()
+    )
+    tenant = Tenant(*row) if row else None
+    cache.set(key, tenant)
+    return tenant
+
+
+def by_username(username):
+    """Return the Tenant for a <username>.pulsar.pub host, or None."""
+    return _lookup(("username", username), username=username)
+
+
+def by_custom_domain(domain):
+    """Return the Tenant that has attached `domain`, or None."""
+    return _lookup(("domain", domain), custom_domain=domain)
+
+
+def invalidate_id(tenant_id):
+    cache.delete_where(lambda tenant: tenant is not None and tenant.id == tenant_id)
+    metrics.incr("tenants.invalidate")
+
+
+def invalidate(tenant_id, username, custom_domain):
+    """Drop every entry for a user, including cached misses for its new names."""
+    invalidate_id(tenant_id)
+    cache.delete(("username", username))
+    if custom_domain:
+        cache.delete(("domain", custom_domain))
+
+
+def clear():
+    cache.clear()
+    metrics.incr("tenants.invalidate")
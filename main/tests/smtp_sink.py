@@ -0,0 +1,59 @@
+"""
+A local SMTP server that accepts every message and keeps it, for tests of
+the real SMTP email backend.
+"""
+
+import socketserver
+import threading
+from email import message_from_bytes
+from email.policy import default
+
+
+class SMTPSink:
+    """
+    Use as a context manager. `messages` collects the received messages as
+    email.message.EmailMessage objects, `connections` counts SMTP sessions.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+
+    def __enter__(self):
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                sink.connections += 1
+                self.reply("220 localhost SMTP sink")
+                while line := self.rfile.readline():
+                    command = line.decode().strip().upper()
+                    if command.startswith("DATA"):
+                        self.reply("354 end data with <CR><LF>.<CR><LF>")
+                        sink.messages.append(self.read_data())
+                        self.reply("250 OK")
+                    elif command.startswith("QUIT"):
+                        self.reply("221 bye")
+                        return
+                    else:  # EHLO, MAIL FROM, RCPT TO, RSET, NOOP
+                        self.reply("250 OK")
+
+            def read_data(self):
+                lines = []
+                while (line := self.rfile.readline()) not in (b".\r\n", b""):
+                    lines.append(line[1:] if line.startswith(b"..") else line)
+                return message_from_bytes(b"".join(lines), policy=default)
+
+            def reply(self, text):
+                self.wfile.write(text.encode() + b"\r\n")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
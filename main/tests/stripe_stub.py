@@ -0,0 +1,97 @@
+"""
+A local HTTP server that answers the few Stripe API calls pulsar makes, so
+tests exercise the real stripe library, its HTTP client and pagination.
+"""
+
+import contextlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import stripe
+
+
+class StripeStub:
+    """
+    Use as a context manager, with `subscriptions` a list of subscription
+    dicts, newest first like Stripe returns them. `delay` slows every
+    response down and `status` makes every response fail with that code.
+    """
+
+    def __init__(self, subscriptions=(), delay=0, status=200):
+        self.subscriptions = list(subscriptions)
+        self.delay = delay
+        self.status = status
+        self.requests = []
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(self.path)
+                if stub.delay:
+                    time.sleep(stub.delay)
+                url = urlparse(self.path)
+                if stub.status != 200:
+                    self.reply(stub.status, {"error": {"message": "stub error"}})
+                elif url.path == "/v1/subscriptions":
+                    self.reply(200, stub.list_subscriptions(parse_qs(url.query)))
+                elif url.path.startswith("/v1/subscriptions/"):
+                    subscription_id = url.path.rsplit("/", 1)[1]
+                    for subscription in stub.subscriptions:
+                        if subscription["id"] == subscription_id:
+                            self.reply(200, subscription)
+                            return
+                    self.reply(404, {"error": {"message": "no such subscription"}})
+                else:
+                    self.reply(404, {"error": {"message": "unknown path"}})
+
+            def reply(self, status, body):
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                # the client may have timed out already
+                with contextlib.suppress(BrokenPipeError, ConnectionResetError):
+                    self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.patches = [
+            mock.patch.object(stripe, "api_base", self.url),
+            mock.patch.object(stripe, "api_key", "sk_test_stub"),
+        ]
+        for patch in self.patches:
+            patch.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def list_subscriptions(self, query):
+        limit = int(query.get("limit", ["10"])[0])
+        start = 0
+        if starting_after := query.get("starting_after", [None])[0]:
+            ids = [s["id"] for s in self.subscriptions]
+            start = ids.index(starting_after) + 1
+        page = self.subscriptions[start : start + limit]
+        return {
+            "object": "list",
+            "url": "/v1/subscriptions",
+            "has_more": start + limit < len(self.subscriptions),
+            "data": page,
+        }
@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from main import models
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = models.User.objects.create_superuser(
+            username="admin", password="password", email="admin@example.com"
+        )
+        self.client = Client(HTTP_HOST=settings.CANONICAL_HOST)
+        self.client.force_login(self.admin)
+
+    def add_users(self, count):
+        for _ in range(count):
+            username = f"user{models.User.objects.count()}"
+            user = models.User.objects.create_user(
+                username=username, email=f"{username}@example.com"
+            )
+            for j in range(2):
+                models.Page.objects.create(
+                    user=user, title=f"page {j}", slug=f"page-{j}", body="one two"
+                )
+                models.Image.objects.create(
+                    user=user, name=f"image {j}", slug=f"{user.username}-{j}"
+                )
+
+    def queries(self, name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f"admin:main_{name}_changelist"))
+        self.assertEqual(response.status_code, 200)
+        return queries
+
+    def assertConstantQueries(self, name):
+        self.add_users(2)
+        few = len(self.queries(name))
+        self.add_users(10)
+        self.assertEqual(len(self.queries(name)), few)
+        return self.queries(name)
+
+    def test_user_changelist(self):
+        queries = self.assertConstantQueries("user")
+        rows = [q["sql"] for q in queries if '"page_count"' in q["sql"]]
+        self.assertTrue(rows)
+        self.assertFalse(any('"homepage_html"' in sql for sql in rows))
+        self.assertFalse(any('"custom_css_min"' in sql for sql in rows))
+        self.assertFalse(any("JOIN" in sql for sql in rows))
+
+        # sortable by the annotation, page_count is the ninth column
+        response = self.client.get(reverse("admin:main_user_changelist"), {"o": "8"})
+        self.assertContains(response, '<td class="field-page_count">2</td>')
+
+    def test_user_change_view_not_annotated(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("admin:main_user_change", args=(self.admin.pk,))
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('"page_count"' in q["sql"] for q in queries))
+
+    def test_page_changelist(self):
+        queries = self.assertConstantQueries("page")
+        self.assertFalse(any('"body_html"' in q["sql"] for q in queries))
+        self.assertFalse(any('"custom_css_min"' in q["sql"] for q in queries))
+        response = self.client.get(reverse("admin:main_page_changelist"))
+        self.assertContains(response, '<td class="field-word_count">2</td>')
+        user = models.User.objects.get(username="user1")
+        self.assertContains(response, f'href="?user__id__exact={user.pk}"')
+
+    def test_image_changelist(self):
+        queries = self.assertConstantQueries("image")
+        self.assertFalse(any('"main_image"."data"' in q["sql"] for q in queries))
+        self.assertFalse(any('"custom_css_min"' in q["sql"] for q in queries))
+
+    def test_word_count_follows_body(self):
+        page = models.Page.objects.create(
+            user=self.admin, title="hello", slug="hello", body="a b c"
+        )
+        self.assertEqual(page.word_count, 3)
+        page.body = "a b"
+        page.save(update_fields=["body"])
+        page.refresh_from_db()
+        self.assertEqual(page.word_count, 2)
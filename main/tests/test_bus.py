@@ -0,0 +1,66 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils import timezone
+
+from main import bus, metrics, models, tenants
+
+
+class BusTests(TestCase):
+    def setUp(self):
+        tenants.cache.clear()
+        metrics.reset()
+        self.user = models.User.objects.create_user(
+            username="alice", password="password", email="alice@example.com"
+        )
+        self.listener = bus.Listener()
+        self.listener.last_id = models.BusEvent.objects.latest("pk").pk
+
+    def foreign(self, kind, **data):
+        """Publish an event as if it came from another process."""
+        payload = {"kind": kind, "origin": "elsewhere", "data": data}
+        models.BusEvent.objects.create(payload=json.dumps(payload))
+
+    def test_user_save_publishes(self):
+        self.user.website_title = "Alice"
+        self.user.save(update_fields=["website_title"])
+        event = json.loads(models.BusEvent.objects.latest("pk").payload)
+        self.assertEqual(event["kind"], "user")
+        self.assertEqual(event["origin"], bus.ORIGIN)
+        self.assertEqual(event["data"]["username"], "alice")
+        self.assertTrue(event["data"]["site"])
+        self.assertFalse(event["data"]["hosts"])
+
+    def test_foreign_event_evicts(self):
+        tenants.by_username("alice")
+        tenants.by_username("alice")
+        self.assertEqual(metrics.get("tenants.miss"), 1)
+
+        self.foreign("site", user_id=self.user.id)
+        self.listener.poll_once()
+        self.assertEqual(metrics.get("bus.received"), 1)
+        tenants.by_username("alice")
+        self.assertEqual(metrics.get("tenants.miss"), 2)
+
+    def test_own_events_are_skipped(self):
+        metrics.reset()
+        models.Page.objects.create(user=self.user, title="Hi", slug="hi")
+        self.listener.poll_once()
+        self.assertEqual(metrics.get("bus.published"), 1)
+        self.assertEqual(metrics.get("bus.received"), 0)
+
+    def test_resync_clears_caches(self):
+        tenants.by_username("alice")
+        bus.resync()
+        tenants.by_username("alice")
+        self.assertEqual(metrics.get("tenants.miss"), 2)
+
+    def test_old_events_are_pruned(self):
+        self.foreign("site", user_id=self.user.id)
+        models.BusEvent.objects.update(
+            created_at=timezone.now() - timedelta(seconds=settings.BUS_RETENTION + 1)
+        )
+        self.listener.poll_once()
+        self.assertFalse(models.BusEvent.objects.exists())
@@ -0,0 +1,80 @@
+import gzip
+
+import brotli
+from django.conf import settings
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from main import css, metrics, models
+
+
+class CustomCSSTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            custom_css="/* colors */\nbody {\n  color: #abcdef;\n}\n",
+        )
+        self.client = Client(HTTP_HOST=f"alice.{settings.CANONICAL_HOST}")
+        self.url = reverse("custom_css", args=(self.user.custom_css_hash,))
+
+    def test_minify(self):
+        self.assertEqual(
+            css.minify('a :hover , p > b { content: "x ; }"; margin: 0 auto ; }'),
+            'a :hover,p>b{content:"x ; }";margin:0 auto}',
+        )
+        self.assertEqual(self.user.custom_css_min, "body{color:#abcdef}")
+
+    def test_minify_comments_are_not_whitespace(self):
+        self.assertEqual(css.minify(".a/**/.b{}"), ".a.b{}")
+        self.assertEqual(css.minify(".a /* x */ .b{}"), ".a .b{}")
+        self.assertEqual(css.minify("p{margin:0/**/auto}"), "p{margin:0/**/auto}")
+
+    def test_pages_link_stylesheet(self):
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, f'<link rel="stylesheet" href="{self.url}">')
+        self.assertNotContains(response, "#abcdef")
+
+    def test_no_link_without_css(self):
+        self.user.custom_css = "/* nothing yet */"
+        self.user.save()
+        self.assertEqual(self.user.custom_css_hash, "")
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, 'rel="stylesheet"', count=1)  # layout.css
+
+    def test_serves_immutable_compressed(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(gzip.decompress(response.content), b"body{color:#abcdef}")
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.content, b"body{color:#abcdef}")
+        self.assertEqual(metrics.get("css.miss"), 1)
+
+    def test_serves_brotli(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), b"body{color:#abcdef}")
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_css_new_url(self):
+        owner = Client(HTTP_HOST=settings.CANONICAL_HOST)
+        owner.force_login(self.user)
+        owner.post(reverse("css_update"), {"custom_css": "body { color: blue; }"})
+        self.user.refresh_from_db()
+        new_url = reverse("custom_css", args=(self.user.custom_css_hash,))
+        self.assertNotEqual(new_url, self.url)
+        self.assertEqual(self.client.get(new_url).content, b"body{color:blue}")
+        self.assertEqual(self.client.get("/0123456789abcdef.css").status_code, 404)
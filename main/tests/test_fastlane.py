@@ -0,0 +1,75 @@
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from main import metrics, models
+from main.fastlane import FastLaneHandler
+
+
+class FastLaneTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            website_title="Alice",
+            homepage="Hi there",
+        )
+        self.page = models.Page.objects.create(
+            user=self.user, title="Hello", slug="hello", body="world"
+        )
+        self.handler = FastLaneHandler()
+        self.factory = RequestFactory(
+            HTTP_HOST=f"{self.user.username}.{settings.CANONICAL_HOST}"
+        )
+
+    def get_response(self, request):
+        response = self.handler.get_response(request)
+        self.addCleanup(response.close)
+        return response
+
+    def test_anonymous_read_skips_session(self):
+        request = self.factory.get(reverse("page_detail", args=(self.page.slug,)))
+        response = self.get_response(request)
+        self.assertContains(response, "world")
+        self.assertFalse(hasattr(request, "session"))
+        self.assertFalse(request.user.is_authenticated)
+        self.assertFalse(response.cookies)
+        self.assertEqual(response["X-Frame-Options"], "DENY")
+        self.assertEqual(metrics.get("fastlane.public"), 1)
+
+    def test_session_cookie_takes_full_stack(self):
+        self.client.force_login(self.user)
+        session_key = self.client.session.session_key
+        request = self.factory.get(
+            reverse("index"),
+            HTTP_COOKIE=f"{settings.SESSION_COOKIE_NAME}={session_key}",
+        )
+        response = self.get_response(request)
+        self.assertContains(response, "edit home page")
+        self.assertTrue(hasattr(request, "session"))
+        self.assertEqual(metrics.get("fastlane.public"), 0)
+
+    def test_forms_take_full_stack(self):
+        request = self.factory.get(reverse("login"))
+        response = self.get_response(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        self.assertEqual(metrics.get("fastlane.public"), 0)
+
+    def test_landing_host_takes_full_stack(self):
+        request = RequestFactory(HTTP_HOST=settings.CANONICAL_HOST).get("/")
+        self.assertEqual(self.get_response(request).status_code, 200)
+        self.assertEqual(metrics.get("fastlane.public"), 0)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("benchmark_public_reads", requests=5, stdout=out)
+        self.assertIn("full stack", out.getvalue())
+        self.assertIn("fast lane", out.getvalue())
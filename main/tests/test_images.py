@@ -0,0 +1,532 @@
+import base64
+import io
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image as PILImage
+
+from main import metrics, models, thumbnails, variants
+from main.storage import get_image_storage
+
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+class ImageStorageTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = self.settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.media_root = media.name
+
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+        )
+
+    def upload(self, name="dot.png", content=PNG):
+        self.client.force_login(self.user)
+        return self.client.post(
+            reverse("image_list"),
+            {"file": SimpleUploadedFile(name, content, content_type="image/png")},
+            HTTP_HOST=settings.CANONICAL_HOST,
+        )
+
+    def test_upload_is_content_addressed(self):
+        self.upload()
+        image = models.Image.objects.get()
+        self.assertIsNone(image.data)
+        self.assertEqual(len(image.sha256), 64)
+        self.assertEqual(
+            image.file.name,
+            f"images/{image.sha256[:2]}/{image.sha256[2:4]}/{image.sha256}.png",
+        )
+        self.assertEqual(image.read(), PNG)
+
+    def test_identical_uploads_share_file(self):
+        self.upload("one.png")
+        self.upload("two.png")
+        first, second = models.Image.objects.order_by("pk")
+        self.assertEqual(first.file.name, second.file.name)
+        path = first.file.path
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_save_racing_an_existing_file(self):
+        storage = get_image_storage()
+        name = "images/ab/cd/abcd.png"
+        storage.save(name, ContentFile(PNG))
+        # another writer got there between the exists() check and the write
+        with mock.patch.object(storage, "exists", return_value=False):
+            self.assertEqual(storage.save(name, ContentFile(PNG)), name)
+        self.assertEqual(os.listdir(os.path.dirname(storage.path(name))), ["abcd.png"])
+        self.assertEqual(os.stat(storage.path(name)).st_mode & 0o777, 0o644)
+
+    def test_image_raw_streams_file(self):
+        self.upload()
+        image = models.Image.objects.get()
+        response = self.client.get(reverse("image_raw", args=(image.slug, "png")))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b"".join(response.streaming_content), PNG)
+        self.assertEqual(response["Content-Type"], "image/png")
+
+    def test_image_raw_accel_redirect(self):
+        self.upload()
+        image = models.Image.objects.get()
+        with self.settings(IMAGE_ACCEL_REDIRECT="/"):
+            response = self.client.get(reverse("image_raw", args=(image.slug, "png")))
+        self.assertEqual(response["X-Accel-Redirect"], "/" + image.file.name)
+        self.assertEqual(response.content, b"")
+
+    def test_migrate_image_blobs(self):
+        image = models.Image.objects.create(
+            user=self.user, name="dot", slug="legacy", extension="png", data=PNG
+        )
+        response = self.client.get(reverse("image_raw", args=(image.slug, "png")))
+        self.assertEqual(response.content, PNG)
+
+        call_command("migrate_image_blobs", stdout=StringIO())
+        image.refresh_from_db()
+        self.assertIsNone(image.data)
+        self.assertEqual(image.read(), PNG)
+        self.assertTrue(image.file.path.startswith(self.media_root))
+        self.assertEqual((image.width, image.height), (1, 1))
+
+    def test_update_image_dimensions(self):
+        self.upload()
+        models.Image.objects.update(width=None, height=None)
+        out = StringIO()
+        call_command("update_image_dimensions", stdout=out)
+        self.assertIn("checked 1 images, measured 1", out.getvalue())
+        image = models.Image.objects.get()
+        self.assertEqual((image.width, image.height), (1, 1))
+
+
+class ImageDeliveryTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = self.settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+        )
+        self.image = models.Image(
+            user=self.user, name="dot", slug="dot", extension="png"
+        )
+        self.image.store(SimpleUploadedFile("dot.png", PNG))
+        self.image.save()
+        self.url = reverse("image_raw", args=(self.image.slug, "png"))
+
+    def test_caching_headers(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["ETag"], f'"{self.image.sha256}"')
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+        self.assertEqual(response["Content-Length"], str(len(PNG)))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+    def test_not_modified_without_blob(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                self.url, HTTP_IF_NONE_MATCH=f'"{self.image.sha256}"'
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"data"', queries[0]["sql"])
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-7")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 0-7/{len(PNG)}")
+        self.assertEqual(b"".join(response.streaming_content), PNG[:8])
+
+    def test_suffix_range(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-4")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), PNG[-4:])
+
+    def test_range_not_satisfiable(self):
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(PNG)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(PNG)}")
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        response = self.client.get(
+            self.url, HTTP_RANGE="bytes=0-7", HTTP_IF_RANGE='"other"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_legacy_blob_not_modified(self):
+        models.Image.objects.create(
+            user=self.user, name="old", slug="old", extension="png", data=PNG
+        )
+        url = reverse("image_raw", args=("old", "png"))
+        etag = self.client.get(url)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+
+
+class ImageQuotaTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = self.settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+        )
+        self.client.force_login(self.user)
+
+    def upload(self, *names):
+        files = [SimpleUploadedFile(name, PNG) for name in names]
+        return self.client.post(
+            reverse("image_list"), {"file": files}, HTTP_HOST=settings.CANONICAL_HOST
+        )
+
+    def test_size_bytes_stored(self):
+        self.upload("dot.png")
+        self.assertEqual(models.Image.objects.get().size_bytes, len(PNG))
+        self.assertEqual(self.user.image_usage(), (1, len(PNG)))
+
+    def test_quota_without_blobs(self):
+        self.upload("one.png", "two.png")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("image_list"), HTTP_HOST=settings.CANONICAL_HOST
+            )
+        self.assertEqual(response.context["image_count"], 2)
+        for query in queries:
+            self.assertNotIn('"data"', query["sql"])
+
+    def test_count_limit(self):
+        with self.settings(IMAGE_COUNT_LIMIT=2):
+            self.upload("one.png")
+            response = self.upload("two.png", "three.png")
+        self.assertContains(response, "Image limit reached")
+        self.assertEqual(models.Image.objects.count(), 1)
+
+    def test_bytes_limit(self):
+        with self.settings(IMAGE_BYTES_LIMIT=len(PNG) * 2):
+            self.upload("one.png", "two.png")
+            response = self.upload("three.png")
+        self.assertContains(response, "Storage quota reached")
+        self.assertEqual(models.Image.objects.count(), 2)
+
+
+class ImageUploadTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = self.settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.client = Client(enforce_csrf_checks=True)
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+        )
+        self.client.force_login(self.user)
+        self.client.get(reverse("image_list"), HTTP_HOST=settings.CANONICAL_HOST)
+        self.csrf_token = self.client.cookies["csrftoken"].value
+
+    def upload(self, *files, path=None, **extra):
+        return self.client.post(
+            path or reverse("image_list"),
+            {"file": list(files), "csrfmiddlewaretoken": self.csrf_token},
+            HTTP_HOST=settings.CANONICAL_HOST,
+            **extra,
+        )
+
+    def test_type_from_content(self):
+        response = self.upload(SimpleUploadedFile("photo.jpg", PNG))
+        self.assertEqual(response.status_code, 302)
+        image = models.Image.objects.get()
+        self.assertEqual((image.name, image.extension), ("photo", "png"))
+
+    def test_not_an_image(self):
+        response = self.upload(SimpleUploadedFile("fake.png", b"<svg></svg>"))
+        self.assertContains(response, "Unsupported file type")
+        self.assertFalse(models.Image.objects.exists())
+
+    def test_too_many_pixels(self):
+        with self.settings(MAX_IMAGE_PIXELS=0):
+            response = self.upload(SimpleUploadedFile("dot.png", PNG))
+        self.assertContains(response, "Image too large")
+        self.assertFalse(models.Image.objects.exists())
+
+    def test_bulk_insert(self):
+        files = [SimpleUploadedFile(f"{i}.png", PNG) for i in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            self.upload(*files)
+        inserts = [
+            q for q in queries if q["sql"].startswith('INSERT INTO "main_image"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(models.Image.objects.count(), 3)
+
+    def test_file_too_big_stops_upload(self):
+        with self.settings(IMAGE_MAX_BYTES=len(PNG) - 1):
+            response = self.upload(
+                SimpleUploadedFile("dot.png", PNG),
+                path=reverse("image_list") + "?raw=true",
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"too big", response.content)
+        self.assertFalse(models.Image.objects.exists())
+
+    def test_too_many_files(self):
+        with self.settings(IMAGE_UPLOAD_MAX_FILES=1):
+            response = self.upload(
+                SimpleUploadedFile("one.png", PNG),
+                SimpleUploadedFile("two.png", PNG),
+                follow=True,
+            )
+        self.assertContains(response, "Too many files")
+        self.assertFalse(models.Image.objects.exists())
+
+    def test_content_length_rejected_unread(self):
+        with mock.patch("django.http.multipartparser.MultiPartParser.parse") as parse:
+            response = self.upload(
+                SimpleUploadedFile("dot.png", PNG),
+                path=reverse("image_list") + "?raw=true",
+                CONTENT_LENGTH=str(100 * 1000 * 1000),
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"Upload too big", response.content)
+        parse.assert_not_called()
+
+    def test_csrf_still_checked(self):
+        response = self.client.post(
+            reverse("image_list"),
+            {"file": SimpleUploadedFile("dot.png", PNG)},
+            HTTP_HOST=settings.CANONICAL_HOST,
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(models.Image.objects.exists())
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = self.settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+        )
+        out = io.BytesIO()
+        PILImage.new("RGB", (640, 480), "orange").save(out, "PNG")
+        self.image = models.Image(
+            user=self.user, name="orange", slug="orange", extension="png"
+        )
+        self.image.store(SimpleUploadedFile("orange.png", out.getvalue()))
+        self.image.save()
+
+    def test_thumbnail_made_once(self):
+        url = reverse("image_thumbnail", args=(self.image.slug, 100))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], thumbnails.CONTENT_TYPE)
+        self.assertIn("immutable", response["Cache-Control"])
+        with PILImage.open(io.BytesIO(b"".join(response.streaming_content))) as im:
+            self.assertEqual(im.size, (100, 75))
+
+        with mock.patch.object(thumbnails, "render") as render:
+            self.assertEqual(self.client.get(url).status_code, 200)
+            render.assert_not_called()
+
+    def test_thumbnail_not_modified(self):
+        url = reverse("image_thumbnail", args=(self.image.slug, 300))
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_size_not_allowed(self):
+        url = reverse("image_thumbnail", args=(self.image.slug, 123))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_undecodable_redirects_to_original(self):
+        image = models.Image(user=self.user, name="bad", slug="bad", extension="png")
+        image.store(SimpleUploadedFile("bad.png", b"not an image"))
+        image.save()
+        with self.assertLogs("main.thumbnails", "WARNING"):
+            response = self.client.get(reverse("image_thumbnail", args=("bad", 100)))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response["Location"], reverse("image_raw", args=("bad", "png"))
+        )
+
+    def test_too_many_pixels_redirects_to_original(self):
+        url = reverse("image_thumbnail", args=(self.image.slug, 100))
+        with (
+            self.settings(MAX_IMAGE_PIXELS=640 * 480 - 1),
+            self.assertLogs("main.thumbnails", "WARNING"),
+        ):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_admin_preview_uses_thumbnail_url(self):
+        admin = models.User.objects.create_superuser(
+            username="admin", password="password", email="admin@example.com"
+        )
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse("admin:main_image_changelist"), HTTP_HOST=settings.CANONICAL_HOST
+        )
+        self.assertContains(
+            response, reverse("image_thumbnail", args=(self.image.slug, 100))
+        )
+        self.assertNotContains(response, "base64")
+
+
+class VariantTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = self.settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.media_root = media.name
+
+        metrics.reset()
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+        )
+        self.image = self.create_image("wide", 1000, 500)
+
+    def create_image(self, slug, width, height, extension="jpeg"):
+        out = io.BytesIO()
+        PILImage.new("RGB", (width, height), "orange").save(out, extension)
+        image = models.Image(user=self.user, name=slug, slug=slug, extension=extension)
+        image.store(SimpleUploadedFile(f"{slug}.{extension}", out.getvalue()))
+        image.save()
+        return image
+
+    def test_dimensions_stored(self):
+        self.assertEqual((self.image.width, self.image.height), (1000, 500))
+
+    def test_variant(self):
+        url = reverse("image_raw", args=(self.image.slug, "jpeg"))
+        response = self.client.get(url, {"w": "400"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["ETag"], f'"{self.image.sha256}-w400"')
+        self.assertIn("immutable", response["Cache-Control"])
+        with PILImage.open(io.BytesIO(b"".join(response.streaming_content))) as im:
+            self.assertEqual(im.size, (400, 200))
+
+        self.client.get(url, {"w": "400"})
+        self.assertEqual(metrics.get("variants.miss"), 1)
+        self.assertEqual(metrics.get("variants.hit"), 1)
+
+    def test_width_not_allowed(self):
+        url = reverse("image_raw", args=(self.image.slug, "jpeg"))
+        self.assertEqual(self.client.get(url, {"w": "401"}).status_code, 404)
+        self.assertEqual(self.client.get(url, {"w": "big"}).status_code, 404)
+
+    def test_narrow_original_not_upscaled(self):
+        image = self.create_image("narrow", 300, 300)
+        self.assertEqual(variants.get_or_create(image, 400), image.file.name)
+
+    def test_unmeasured_original_not_upscaled(self):
+        image = self.create_image("legacy", 120, 80)
+        models.Image.objects.filter(pk=image.pk).update(width=None, height=None)
+        image.refresh_from_db()
+        self.assertEqual(variants.get_or_create(image, 1600), image.file.name)
+        self.assertFalse(
+            os.path.exists(default_storage.path(variants.name(image, 1600)))
+        )
+
+    def test_single_flight(self):
+        calls = []
+
+        def slow_render(*args):
+            calls.append(args)
+            time.sleep(0.2)
+            return b"variant"
+
+        with mock.patch.object(variants, "render", slow_render):
+            threads = [
+                threading.Thread(target=variants.get_or_create, args=(self.image, 800))
+                for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_evict_least_recently_used(self):
+        with mock.patch.object(variants, "render", return_value=b"x" * 100):
+            old = variants.get_or_create(self.image, 400)
+            os.utime(default_storage.path(old), (0, 0))
+            with self.settings(IMAGE_VARIANT_CACHE_BYTES=150):
+                new = variants.get_or_create(self.image, 800)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, old)))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, new)))
+        self.assertEqual(metrics.get("variants.evict"), 1)
+
+    def test_evict_not_walked_on_every_miss(self):
+        variants._written = None
+        with (
+            mock.patch.object(variants, "render", return_value=b"x" * 100),
+            mock.patch.object(variants, "evict") as evict,
+        ):
+            for width in settings.IMAGE_VARIANT_WIDTHS:
+                variants.get_or_create(self.image, width)
+        self.assertEqual(evict.call_count, 1)
+
+    def test_too_many_pixels(self):
+        image = self.create_image("big", 1000, 500, "png")
+        url = reverse("image_raw", args=(image.slug, "png"))
+        with (
+            self.settings(MAX_IMAGE_PIXELS=1000 * 500 - 1),
+            self.assertLogs("main.variants", "WARNING"),
+        ):
+            response = self.client.get(url, {"w": "400"})
+        self.assertEqual(response.status_code, 200)
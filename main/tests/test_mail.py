@@ -0,0 +1,130 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, mail_admins, send_mail
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from main import mail, models, webhooks
+from main.tests.smtp_sink import SMTPSink
+
+
+@override_settings(
+    EMAIL_BACKEND="main.mail.QueuedEmailBackend",
+    EMAIL_QUEUE_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+    EMAIL_HOST="127.0.0.1",
+    EMAIL_USE_TLS=False,
+    EMAIL_HOST_USER="",
+    EMAIL_HOST_PASSWORD="",
+    ADMINS=[("Admin", "admin@example.com")],
+)
+class QueuedEmailTests(TestCase):
+    def setUp(self):
+        self.sink = SMTPSink().__enter__()
+        self.addCleanup(self.sink.__exit__, None, None, None)
+        override = self.settings(EMAIL_PORT=self.sink.port)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def send_queued(self):
+        call_command("send_queued_email", "--once", stdout=StringIO())
+
+    def test_password_reset_is_queued(self):
+        models.User.objects.create_user(
+            username="alice", password="password", email="alice@example.com"
+        )
+        response = Client().post(
+            reverse("password_reset"),
+            {"email": "alice@example.com"},
+            HTTP_HOST=settings.CANONICAL_HOST,
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.sink.messages, [])
+        queued = models.OutboundEmail.objects.get()
+        self.assertEqual(queued.to, ["alice@example.com"])
+
+        self.send_queued()
+        self.assertEqual(self.sink.messages[0]["To"], "alice@example.com")
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, models.OutboundEmail.SENT)
+
+    def test_one_connection_for_many_messages(self):
+        for i in range(5):
+            send_mail(f"hello {i}", "body", None, [f"user{i}@example.com"])
+        self.send_queued()
+        self.assertEqual(len(self.sink.messages), 5)
+        self.assertEqual(self.sink.connections, 1)
+        self.assertFalse(
+            models.OutboundEmail.objects.exclude(
+                status=models.OutboundEmail.SENT
+            ).exists()
+        )
+
+    def test_webhook_mails_are_digested(self):
+        for event_type in (
+            "invoice.payment_succeeded",
+            "customer.subscription.updated",
+        ):
+            webhooks.send_webhook_admin_email(event_type, {"type": event_type})
+        self.send_queued()
+        self.assertEqual(self.sink.messages, [])  # not due yet
+
+        models.OutboundEmail.objects.update(
+            created_at=timezone.now()
+            - timedelta(seconds=settings.EMAIL_DIGEST_INTERVAL + 1)
+        )
+        self.send_queued()
+        self.assertEqual(len(self.sink.messages), 1)
+        digest = self.sink.messages[0]
+        self.assertIn("Stripe webhooks: 2 messages", digest["Subject"])
+        self.assertNotIn("X-Pulsar-Digest", digest)
+        body = digest.get_content()
+        self.assertIn("invoice.payment_succeeded", body)
+        self.assertIn("customer.subscription.updated", body)
+
+    def test_failed_send_is_retried_later(self):
+        send_mail("hello", "body", None, ["user@example.com"])
+        self.sink.__exit__(None, None, None)  # nothing listens anymore
+        with self.assertLogs("main.mail", "WARNING"):
+            self.send_queued()
+        queued = models.OutboundEmail.objects.get()
+        self.assertEqual(queued.status, models.OutboundEmail.PENDING)
+        self.assertEqual(queued.attempts, 1)
+        self.assertGreater(queued.run_after, timezone.now())
+
+    def test_claimed_rows_are_not_sent_twice(self):
+        send_mail("hello", "body", None, ["user@example.com"])
+        rows = mail._claim(models.OutboundEmail.objects.all(), 10)
+        self.assertEqual(rows[0].status, models.OutboundEmail.SENDING)
+        self.send_queued()  # another worker
+        self.assertEqual(self.sink.messages, [])
+
+        # the claiming worker died before recording anything
+        models.OutboundEmail.objects.update(run_after=timezone.now())
+        self.send_queued()
+        self.assertEqual(len(self.sink.messages), 1)
+        queued = models.OutboundEmail.objects.get()
+        self.assertEqual(queued.status, models.OutboundEmail.SENT)
+        self.assertEqual(queued.attempts, 2)
+
+    def test_fail_silently_when_queueing_fails(self):
+        with (
+            mock.patch.object(
+                models.OutboundEmail.objects, "bulk_create", side_effect=DatabaseError
+            ),
+            self.assertLogs("main.mail", "WARNING"),
+        ):
+            mail_admins("subject", "body", fail_silently=True)
+            with self.assertRaises(DatabaseError):
+                mail_admins("subject", "body")
+
+    def test_attachments_are_refused(self):
+        message = EmailMultiAlternatives("hello", "body", None, ["a@example.com"])
+        message.attach("file.txt", "content", "text/plain")
+        with self.assertRaises(ValueError):
+            message.send()
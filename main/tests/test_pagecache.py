@@ -0,0 +1,159 @@
+import gzip
+
+import zstandard
+from django.conf import settings
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from main import metrics, models
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            website_title="Alice",
+            homepage="Hi there",
+        )
+        self.page = models.Page.objects.create(
+            user=self.user,
+            title="Hello",
+            slug="hello",
+            body="world",
+        )
+        self.host = f"{self.user.username}.{settings.CANONICAL_HOST}"
+
+    def get(self, path, **extra):
+        return self.client.get(path, HTTP_HOST=self.host, **extra)
+
+    def test_anonymous_hit(self):
+        url = reverse("page_detail", args=(self.page.slug,))
+        self.assertContains(self.get(url), "world")
+        with self.assertNumQueries(0):
+            response = self.get(url)
+        self.assertContains(response, "world")
+        self.assertEqual(metrics.get("pagecache.miss"), 1)
+        self.assertEqual(metrics.get("pagecache.hit"), 1)
+
+    def test_gzip_body(self):
+        response = self.get(reverse("index"), HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn(b"Hi there", gzip.decompress(response.content))
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_zstd_body(self):
+        response = self.get(reverse("index"), HTTP_ACCEPT_ENCODING="gzip, zstd")
+        self.assertEqual(response["Content-Encoding"], "zstd")
+        self.assertIn(b"Hi there", zstandard.decompress(response.content))
+
+    def test_invalidated_by_page_edit(self):
+        url = reverse("page_detail", args=(self.page.slug,))
+        self.get(url)
+        self.page.body = "updated"
+        self.page.save()
+        self.assertContains(self.get(url), "updated")
+
+    def test_invalidated_by_new_page(self):
+        self.get(reverse("index"))
+        models.Page.objects.create(user=self.user, title="Second", slug="second")
+        self.assertContains(self.get(reverse("index")), "Second")
+
+    def test_invalidated_by_site_settings(self):
+        self.get(reverse("index"))
+        self.user.website_title = "Renamed"
+        self.user.save()
+        self.assertContains(self.get(reverse("index")), "Renamed")
+
+    def test_not_invalidated_by_login(self):
+        self.get(reverse("index"))
+        self.user.save(update_fields=["last_login"])
+        self.get(reverse("index"))
+        self.assertEqual(metrics.get("pagecache.hit"), 1)
+
+    def test_bypassed_for_owner(self):
+        self.get(reverse("index"))
+        self.client.force_login(self.user)
+        response = self.get(reverse("index"))
+        self.assertContains(response, "edit home page")
+        self.assertEqual(metrics.get("pagecache.bypass"), 1)
+
+    def test_bypassed_with_query_string(self):
+        self.get(reverse("index"), data={"x": "1"})
+        self.get(reverse("index"), data={"x": "2"})
+        self.assertEqual(metrics.get("pagecache.miss"), 0)
+        self.assertEqual(metrics.get("pagecache.bypass"), 2)
+
+    def test_missing_page_not_cached(self):
+        url = reverse("page_detail", args=("nosuch",))
+        self.assertEqual(self.get(url).status_code, 404)
+        self.assertEqual(self.get(url).status_code, 404)
+        self.assertEqual(metrics.get("pagecache.hit"), 0)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            homepage="Hi there",
+        )
+        self.page = models.Page.objects.create(
+            user=self.user,
+            title="Hello",
+            slug="hello",
+            body="world",
+        )
+        self.host = f"{self.user.username}.{settings.CANONICAL_HOST}"
+        self.url = reverse("page_detail", args=(self.page.slug,))
+
+    def get(self, path, **extra):
+        return self.client.get(path, HTTP_HOST=self.host, **extra)
+
+    def test_validators_sent(self):
+        response = self.get(self.url)
+        self.assertTrue(response.has_header("ETag"))
+        self.assertFalse(response["ETag"].startswith("W/"))
+        self.assertTrue(response.has_header("Last-Modified"))
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+    def test_if_none_match_without_queries(self):
+        etag = self.get(self.url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+    def test_if_modified_since(self):
+        last_modified = self.get(reverse("index"))["Last-Modified"]
+        response = self.get(reverse("index"), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_page(self):
+        etag = self.get(self.url)["ETag"]
+        self.page.body = "updated"
+        self.page.save()
+        response = self.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_changes_with_css(self):
+        etag = self.get(reverse("index"))["ETag"]
+        self.user.custom_css = "body { color: red; }"
+        self.user.save()
+        response = self.get(reverse("index"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_validators_for_owner(self):
+        self.client.force_login(self.user)
+        response = self.get(self.url)
+        self.assertFalse(response.has_header("ETag"))
@@ -0,0 +1,115 @@
+import gzip
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from main import metrics, models, prerender
+
+
+class PrerenderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.enterContext(override_settings(PRERENDER_ROOT=self.root))
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            website_title="Alice",
+            homepage="Hi there",
+        )
+        self.page = models.Page.objects.create(
+            user=self.user, title="Hello", slug="hello", body="world"
+        )
+        self.host = f"alice.{settings.CANONICAL_HOST}"
+
+    def read(self, *parts):
+        with open(os.path.join(self.root, *parts), "rb") as f:
+            return f.read()
+
+    def exists(self, *parts):
+        return os.path.exists(os.path.join(self.root, *parts))
+
+    def test_rebuild_writes_site(self):
+        self.assertEqual(prerender.rebuild(self.user.id), 2)
+        self.assertIn(b"Hi there", self.read(self.host, "index.html"))
+        page = self.read(self.host, "hello", "index.html")
+        self.assertIn(b"world", page)
+        self.assertEqual(
+            gzip.decompress(self.read(self.host, "hello", "index.html.gz")),
+            page,
+        )
+
+    def test_rebuild_skips_unchanged(self):
+        prerender.rebuild(self.user.id)
+        self.assertIsNone(prerender.rebuild(self.user.id))
+        self.assertEqual(prerender.rebuild(self.user.id, force=True), 2)
+
+        self.page.body = "everyone"
+        self.page.save()
+        self.assertEqual(prerender.rebuild(self.user.id), 2)
+        self.assertIn(b"everyone", self.read(self.host, "hello", "index.html"))
+        self.assertEqual(metrics.get("prerender.skip"), 1)
+
+    def test_bypasses_page_cache(self):
+        url = f"/{self.page.slug}/"
+        self.client.get(url, HTTP_HOST=self.host)  # cached
+        models.Page.objects.filter(pk=self.page.pk).update(body_html="<p>fresh</p>")
+        prerender.rebuild(self.user.id)
+        self.assertIn(b"fresh", self.read(self.host, "hello", "index.html"))
+
+    def test_removes_renamed_pages(self):
+        prerender.rebuild(self.user.id)
+        self.page.slug = "hi"
+        self.page.save()
+        prerender.rebuild(self.user.id)
+        self.assertTrue(self.exists(self.host, "hi", "index.html"))
+        self.assertFalse(self.exists(self.host, "hello"))
+
+    def test_moves_site_to_new_host(self):
+        prerender.rebuild(self.user.id)
+        self.user.custom_domain = "alice.example.com"
+        self.user.save()
+        prerender.rebuild(self.user.id)
+        self.assertTrue(self.exists("alice.example.com", "hello", "index.html"))
+        self.assertFalse(self.exists(self.host))
+
+        user_id = self.user.id
+        self.user.delete()
+        self.assertEqual(prerender.rebuild(user_id), 0)
+        self.assertFalse(self.exists("alice.example.com"))
+
+    def test_changes_schedule_rebuild(self):
+        with (
+            mock.patch.object(prerender, "schedule") as schedule,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            self.page.body = "everyone"
+            self.page.save()
+        schedule.assert_called_with(self.user.id)
+
+    def test_command(self):
+        models.User.objects.create_user(
+            username="bob", email="bob@example.com", homepage="Hello"
+        )
+        prerender.rebuild(self.user.id)
+        # a tenant deleted while its events were missed
+        stale = models.User.objects.create_user(username="carol", email="c@x.com")
+        prerender.rebuild(stale.id)
+        models.User.objects.filter(pk=stale.pk).delete()
+
+        out = StringIO()
+        call_command("prerender", jobs=1, changed=True, stdout=out)
+        self.assertIn("pre-rendered 1 pages of 1 sites", out.getvalue())
+        self.assertIn("1 unchanged, 0 failed, 1 removed", out.getvalue())
+        self.assertTrue(self.exists(f"bob.{settings.CANONICAL_HOST}", "index.html"))
+        self.assertFalse(self.exists(f"carol.{settings.CANONICAL_HOST}"))
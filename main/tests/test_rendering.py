@@ -0,0 +1,121 @@
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from main import models, rendering
+
+
+class RenderingTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            homepage="# Welcome",
+        )
+        self.page = models.Page.objects.create(
+            user=self.user,
+            title="Hello",
+            slug="hello",
+            body="**world**",
+        )
+
+    def test_rendered_on_save(self):
+        page = models.Page.objects.get(pk=self.page.pk)
+        self.assertEqual(page.body_html, "<p><strong>world</strong></p>\n")
+        self.assertEqual(page.body_html_version, rendering.RENDERER_VERSION)
+        user = models.User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.homepage_as_html, "<h1>Welcome</h1>\n")
+
+    def test_rendered_on_save_with_update_fields(self):
+        self.user.homepage = "changed"
+        self.user.save(update_fields=["homepage"])
+        user = models.User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.homepage_html, "<p>changed</p>\n")
+
+    def test_stale_version_renders_live(self):
+        models.Page.objects.filter(pk=self.page.pk).update(
+            body_html="stale", body_html_version="old"
+        )
+        page = models.Page.objects.get(pk=self.page.pk)
+        self.assertEqual(page.body_as_html, "<p><strong>world</strong></p>\n")
+
+    def test_rerender_markdown_command(self):
+        models.Page.objects.update(body_html="", body_html_version="old", excerpt="old")
+        models.User.objects.update(homepage_html="", homepage_html_version="")
+        site_updated_at = models.User.objects.get().site_updated_at
+        out = StringIO()
+        with mock.patch("main.pagecache.bump") as bump:
+            call_command("rerender_markdown", batch_size=1, stdout=out)
+        self.assertIn("re-rendered 1 pages and 1 homepages of 1 sites", out.getvalue())
+        page = models.Page.objects.get(pk=self.page.pk)
+        self.assertEqual(page.body_html, "<p><strong>world</strong></p>\n")
+        self.assertEqual(page.body_html_version, rendering.RENDERER_VERSION)
+        self.assertEqual(page.excerpt, "world")
+        bump.assert_called_once_with(self.user.id)
+        user = models.User.objects.get()
+        self.assertGreater(user.site_updated_at, site_updated_at)
+
+
+class PageMetadataTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            username="alice", password="password", email="alice@example.com"
+        )
+        self.page = models.Page.objects.create(
+            user=self.user,
+            title="Hello",
+            slug="hello",
+            body="# Title\n\nSome *emphasis* &amp; [a link](https://example.com).",
+        )
+
+    def test_metadata_on_save(self):
+        page = models.Page.objects.get(pk=self.page.pk)
+        self.assertEqual(page.excerpt, "Title Some emphasis & a link.")
+        self.assertEqual(page.word_count, 7)
+        self.assertEqual(page.reading_time, 1)
+        self.assertEqual(page.content_hash, rendering.content_hash(page.body))
+
+    def test_long_excerpt_is_truncated(self):
+        self.page.body = "word " * 1000
+        self.page.save(update_fields=["body"])
+        page = models.Page.objects.get(pk=self.page.pk)
+        self.assertEqual(len(page.excerpt), rendering.EXCERPT_LENGTH)
+        self.assertTrue(page.excerpt.endswith("…"))
+        self.assertEqual(page.reading_time, 5)
+
+    def test_unchanged_body_is_not_rendered_again(self):
+        page = models.Page.objects.get(pk=self.page.pk)
+        page.title = "Changed"
+        with mock.patch.object(rendering, "render") as render:
+            page.save()
+        render.assert_not_called()
+
+    def test_update_page_metadata_command(self):
+        models.Page.objects.update(word_count=0, excerpt="", content_hash="")
+        out = StringIO()
+        call_command("update_page_metadata", batch_size=1, stdout=out)
+        self.assertIn("checked 1 pages, updated 1", out.getvalue())
+        page = models.Page.objects.get(pk=self.page.pk)
+        self.assertEqual(page.word_count, 7)
+        self.assertEqual(page.content_hash, rendering.content_hash(page.body))
+
+        out = StringIO()
+        call_command("update_page_metadata", "--all", stdout=out)
+        self.assertIn("checked 1 pages, updated 0", out.getvalue())
+
+    def test_listings_do_not_load_bodies(self):
+        client = Client(HTTP_HOST=settings.CANONICAL_HOST)
+        client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse("dashboard"))
+        self.assertContains(response, "7 words, 1 min")
+        pages = [q["sql"] for q in queries if 'FROM "main_page"' in q["sql"]]
+        self.assertTrue(pages)
+        self.assertFalse(any('"main_page"."body' in sql for sql in pages))
@@ -0,0 +1,31 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.templatetags.static import static
+from django.test import Client, TestCase
+
+
+class StaticFilesTests(TestCase):
+    def test_layout_links_stylesheet(self):
+        response = Client().get("/", HTTP_HOST=settings.CANONICAL_HOST)
+        self.assertContains(
+            response, f'<link rel="stylesheet" href="{static("main/layout.css")}">'
+        )
+        self.assertNotContains(response, "--total-width")
+
+    def test_collectstatic_fingerprints_and_compresses(self):
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        with self.settings(STATIC_ROOT=static_root.name):
+            out = StringIO()
+            call_command("collectstatic", interactive=False, stdout=out)
+            url = static("main/layout.css")
+            self.assertRegex(url, r"^/static/main/layout\.[0-9a-f]{12}\.css$")
+            path = os.path.join(static_root.name, url.removeprefix("/static/"))
+            for extension in ("gz", "br", "zst"):
+                compressed = f"{path}.{extension}"
+                self.assertLess(os.path.getsize(compressed), os.path.getsize(path))
+            self.assertIn(url.removeprefix("/static/"), out.getvalue())
@@ -0,0 +1,100 @@
+import time
+from unittest import mock
+
+import stripe
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from main import metrics, models, stripe_client
+from main.tests.stripe_stub import StripeStub
+
+SUBSCRIPTION = {"id": "sub_1", "object": "subscription", "status": "active"}
+
+
+class StripeClientTests(TestCase):
+    def setUp(self):
+        self.addCleanup(stripe_client.configure)
+        override = self.settings(
+            STRIPE_CONNECT_TIMEOUT=0.5,
+            STRIPE_READ_TIMEOUT=0.2,
+            STRIPE_MAX_NETWORK_RETRIES=0,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        stripe_client.configure()
+
+        breaker = stripe_client.CircuitBreaker(threshold=2, cooldown=60)
+        patch = mock.patch.object(stripe_client, "breaker", breaker)
+        patch.start()
+        self.addCleanup(patch.stop)
+        metrics.reset()
+
+    def retrieve(self):
+        return stripe_client.call(stripe.Subscription.retrieve, "sub_1")
+
+    def test_call(self):
+        with StripeStub([SUBSCRIPTION]):
+            self.assertEqual(self.retrieve().status, "active")
+        self.assertEqual(metrics.get("stripe.calls"), 1)
+        self.assertEqual(metrics.get("stripe.latency_le_100ms"), 1)
+
+    def test_read_timeout_and_retries(self):
+        with self.settings(STRIPE_MAX_NETWORK_RETRIES=1):
+            stripe_client.configure()
+            with StripeStub([SUBSCRIPTION], delay=0.5) as stub:
+                start = time.monotonic()
+                with self.assertRaises(stripe.error.APIConnectionError):
+                    self.retrieve()
+        self.assertLess(time.monotonic() - start, 2.5)
+        self.assertEqual(len(stub.requests), 2)
+        self.assertEqual(metrics.get("stripe.error"), 1)
+
+    def test_circuit_opens_and_recovers(self):
+        with StripeStub([SUBSCRIPTION], status=500) as stub:
+            for _ in range(2):
+                with self.assertRaises(stripe.error.APIError):
+                    self.retrieve()
+            with self.assertRaises(stripe_client.StripeUnavailable):
+                self.retrieve()
+            self.assertEqual(len(stub.requests), 2)
+            self.assertEqual(metrics.get("stripe.rejected"), 1)
+
+            # after the cooldown one call goes through and closes it again
+            stub.status = 200
+            stripe_client.breaker.cooldown = 0
+            self.retrieve()
+            self.assertFalse(stripe_client.breaker.is_open)
+
+    def test_client_errors_keep_circuit_closed(self):
+        with StripeStub([]):
+            for _ in range(3):
+                with self.assertRaises(stripe.error.InvalidRequestError):
+                    self.retrieve()
+        self.assertFalse(stripe_client.breaker.is_open)
+
+    def test_open_circuit_message(self):
+        user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            stripe_subscription_id="sub_1",
+        )
+        client = Client()
+        client.force_login(user)
+        stripe_client.breaker.failure()
+        stripe_client.breaker.failure()
+        with StripeStub([SUBSCRIPTION]) as stub:
+            response = client.post(
+                reverse("subscription_resume"), HTTP_HOST=settings.CANONICAL_HOST
+            )
+        # not followed: the subscription page would start a background refresh
+        self.assertRedirects(
+            response, reverse("subscription_index"), fetch_redirect_response=False
+        )
+        self.assertIn(
+            "please contact admin@pulsar.pub",
+            " ".join(str(m) for m in get_messages(response.wsgi_request)),
+        )
+        self.assertEqual(stub.requests, [])
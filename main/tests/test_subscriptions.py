@@ -0,0 +1,251 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from main import models, subscriptions, webhooks
+from main.tests.stripe_stub import StripeStub
+
+
+def fake_subscription(**fields):
+    subscription = {
+        "id": "sub_1",
+        "object": "subscription",
+        "customer": "cus_1",
+        "status": "active",
+        "created": 1700000000,
+        "cancel_at_period_end": False,
+        "items": {"data": [{"current_period_end": 1800000000}]},
+    }
+    subscription.update(fields)
+    return subscription
+
+
+class SubscriptionMirrorTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            stripe_customer_id="cus_1",
+        )
+        self.client.force_login(self.user)
+
+    def test_webhook_handlers_update_mirror(self):
+        webhooks.handle_subscription_created(fake_subscription())
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_premium)
+        self.assertEqual(self.user.stripe_subscription_id, "sub_1")
+        self.assertEqual(self.user.subscription_status, "active")
+        self.assertEqual(self.user.subscription_end_date.timestamp(), 1800000000)
+        self.assertIsNotNone(self.user.subscription_synced_at)
+
+        webhooks.handle_subscription_updated(
+            fake_subscription(cancel_at_period_end=True)
+        )
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.subscription_is_canceled)
+
+        webhooks.handle_subscription_deleted(fake_subscription(status="canceled"))
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_premium)
+        self.assertFalse(self.user.subscription_is_canceled)
+
+    @mock.patch("stripe.Subscription.retrieve", side_effect=AssertionError)
+    def test_render_without_stripe_call(self, retrieve):
+        subscriptions.apply(self.user, fake_subscription(cancel_at_period_end=True))
+        response = self.client.get(
+            reverse("subscription_index"), HTTP_HOST=settings.CANONICAL_HOST
+        )
+        self.assertContains(response, "subscription has been canceled")
+        retrieve.assert_not_called()
+
+    @mock.patch("stripe.Subscription.modify")
+    def test_cancel_and_resume_update_mirror(self, modify):
+        subscriptions.apply(self.user, fake_subscription())
+        modify.return_value = fake_subscription(cancel_at_period_end=True)
+        self.client.post(
+            reverse("subscription_cancel"), HTTP_HOST=settings.CANONICAL_HOST
+        )
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.subscription_is_canceled)
+
+        modify.return_value = fake_subscription()
+        self.client.post(
+            reverse("subscription_resume"), HTTP_HOST=settings.CANONICAL_HOST
+        )
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.subscription_is_canceled)
+
+    @mock.patch("main.subscriptions.threading.Thread")
+    def test_refresh_if_stale(self, thread):
+        subscriptions.apply(self.user, fake_subscription())
+        subscriptions.refresh_if_stale(self.user)
+        thread.assert_not_called()
+
+        self.user.subscription_synced_at = timezone.now() - timedelta(
+            seconds=settings.SUBSCRIPTION_REFRESH_AFTER + 1
+        )
+        subscriptions.refresh_if_stale(self.user)
+        thread.assert_called_once()
+        subscriptions._refreshing.clear()
+
+    @mock.patch("main.subscriptions.connection")
+    @mock.patch("main.subscriptions.refresh", side_effect=Exception("timeout"))
+    def test_background_refresh_closes_connection(self, refresh, connection):
+        subscriptions._refreshing.add(self.user.id)
+        with self.assertLogs("main.subscriptions", "WARNING"):
+            subscriptions._refresh_in_background(self.user.id)
+        connection.close.assert_called_once()
+        self.assertNotIn(self.user.id, subscriptions._refreshing)
+
+    @mock.patch("stripe.Subscription.retrieve")
+    def test_refresh(self, retrieve):
+        subscriptions.apply(self.user, fake_subscription())
+        retrieve.return_value = fake_subscription(status="past_due")
+        subscriptions.refresh(self.user.id)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.subscription_status, "past_due")
+        self.assertFalse(self.user.is_premium)
+
+
+class CheckoutConfirmationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            stripe_customer_id="cus_1",
+        )
+        self.client.force_login(self.user)
+
+    def status(self, session_id="cs_1"):
+        return self.client.get(
+            reverse("subscription_status"),
+            {"session_id": session_id},
+            HTTP_HOST=settings.CANONICAL_HOST,
+        ).json()
+
+    @mock.patch("time.sleep", side_effect=AssertionError)
+    def test_success_page_polls(self, sleep):
+        response = self.client.get(
+            reverse("subscription_success"),
+            {"session_id": "cs_1"},
+            HTTP_HOST=settings.CANONICAL_HOST,
+        )
+        self.assertContains(
+            response, reverse("subscription_status") + "?session_id=cs_1"
+        )
+
+    @mock.patch("stripe.checkout.Session.retrieve", side_effect=AssertionError)
+    def test_status_from_webhook(self, retrieve):
+        subscriptions.apply(self.user, fake_subscription())
+        self.assertEqual(self.status(), {"is_premium": True})
+
+    @mock.patch("stripe.checkout.Session.retrieve")
+    def test_status_reconciles_session(self, retrieve):
+        retrieve.return_value = {
+            "customer": "cus_1",
+            "status": "complete",
+            "subscription": fake_subscription(),
+        }
+        self.assertEqual(self.status(), {"is_premium": True})
+        retrieve.assert_called_once_with("cs_1", expand=["subscription"])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.stripe_subscription_id, "sub_1")
+        self.assertIsNotNone(self.user.subscription_start_date)
+
+    @mock.patch("stripe.checkout.Session.retrieve")
+    def test_status_lookups_are_rate_limited(self, retrieve):
+        retrieve.return_value = {"customer": "cus_1", "status": "open"}
+        self.assertEqual(self.status(), {"is_premium": False})
+        self.assertEqual(self.status(), {"is_premium": False})
+        retrieve.assert_called_once()
+
+    @mock.patch("stripe.checkout.Session.retrieve")
+    def test_status_ignores_other_customers(self, retrieve):
+        retrieve.return_value = {
+            "customer": "cus_2",
+            "status": "complete",
+            "subscription": fake_subscription(customer="cus_2"),
+        }
+        self.assertEqual(self.status(), {"is_premium": False})
+
+
+class ReconcileSubscriptionsTests(TestCase):
+    def setUp(self):
+        # missed the created webhook
+        self.alice = models.User.objects.create_user(
+            username="alice", email="alice@example.com", stripe_customer_id="cus_1"
+        )
+        # in sync
+        self.bob = models.User.objects.create_user(
+            username="bob", email="bob@example.com", stripe_customer_id="cus_2"
+        )
+        subscriptions.apply(self.bob, fake_subscription(id="sub_2", customer="cus_2"))
+        # missed the deleted webhook
+        self.carol = models.User.objects.create_user(
+            username="carol", email="carol@example.com", stripe_customer_id="cus_3"
+        )
+        subscriptions.apply(self.carol, fake_subscription(id="sub_3", customer="cus_3"))
+        # subscription gone from Stripe
+        self.dave = models.User.objects.create_user(
+            username="dave", email="dave@example.com", stripe_customer_id="cus_4"
+        )
+        subscriptions.apply(self.dave, fake_subscription(id="sub_4", customer="cus_4"))
+
+        others = [
+            fake_subscription(id=f"sub_x{i}", customer=f"cus_x{i}") for i in range(250)
+        ]
+        self.stripe_subscriptions = [
+            fake_subscription(id="sub_1", customer="cus_1"),
+            fake_subscription(id="sub_2", customer="cus_2"),
+            *others,
+            fake_subscription(id="sub_3", customer="cus_3", status="canceled"),
+            # an old subscription of alice's
+            fake_subscription(id="sub_0", customer="cus_1", status="canceled"),
+        ]
+
+    def reconcile(self, *args):
+        out = StringIO()
+        with StripeStub(self.stripe_subscriptions) as stub:
+            call_command(
+                "reconcile_subscriptions", "--batch-size", "100", *args, stdout=out
+            )
+        return out.getvalue(), stub
+
+    def test_fixes_drift(self):
+        output, stub = self.reconcile()
+        self.assertEqual(len(stub.requests), 3)  # 254 subscriptions, 100 per page
+        self.assertIn("checked 254 subscriptions, 2 users drifted", output)
+        self.assertIn("dave: subscription sub_4 not found", output)
+
+        for user in (self.alice, self.bob, self.carol):
+            user.refresh_from_db()
+        self.assertTrue(self.alice.is_premium)
+        self.assertEqual(self.alice.stripe_subscription_id, "sub_1")
+        self.assertIsNotNone(self.alice.subscription_start_date)
+        self.assertTrue(self.bob.is_premium)
+        self.assertFalse(self.carol.is_premium)
+        self.assertEqual(self.carol.subscription_status, "canceled")
+
+    def test_dry_run(self):
+        output, _ = self.reconcile("--dry-run")
+        self.assertIn("alice: is_premium False -> True", output)
+        self.alice.refresh_from_db()
+        self.assertFalse(self.alice.is_premium)
+
+    def test_queries_per_batch(self):
+        # per batch one select, and one bulk update if any user matched, plus
+        # the report of unseen subscriptions
+        with self.assertNumQueries(6):
+            self.reconcile()
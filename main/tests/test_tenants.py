@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from main import allowlist, metrics, models, tenants
+
+
+class TenantRegistryTests(TestCase):
+    def setUp(self):
+        tenants.cache.clear()
+        metrics.reset()
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            custom_css="body { color: red; }",
+        )
+        self.domain_user = models.User.objects.create_user(
+            username="bob",
+            password="password",
+            email="bob@example.com",
+            custom_domain="example.com",
+        )
+
+    def test_by_username_caches(self):
+        tenant = tenants.by_username("alice")
+        self.assertEqual(tenant.id, self.user.id)
+        self.assertEqual(tenant.css_hash, self.user.custom_css_hash)
+        with self.assertNumQueries(0):
+            self.assertEqual(tenants.by_username("alice"), tenant)
+        self.assertEqual(metrics.get("tenants.miss"), 1)
+        self.assertEqual(metrics.get("tenants.hit"), 1)
+
+    def test_by_custom_domain(self):
+        self.assertEqual(tenants.by_custom_domain("example.com").username, "bob")
+        self.assertIsNone(tenants.by_custom_domain("nosuch.domain"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(tenants.by_custom_domain("nosuch.domain"))
+
+    def test_invalidated_on_save(self):
+        self.assertTrue(tenants.by_username("alice").show_nav)
+        self.user.show_nav = False
+        self.user.save()
+        self.assertFalse(tenants.by_username("alice").show_nav)
+
+    def test_invalidated_on_rename(self):
+        self.assertIsNone(tenants.by_username("carol"))
+        self.user.username = "carol"
+        self.user.save()
+        self.assertIsNone(tenants.by_username("alice"))
+        self.assertEqual(tenants.by_username("carol").id, self.user.id)
+
+    def test_invalidated_on_delete(self):
+        self.assertIsNotNone(tenants.by_custom_domain("example.com"))
+        self.domain_user.delete()
+        self.assertIsNone(tenants.by_custom_domain("example.com"))
+
+    def test_redirect_to_custom_domain_without_queries(self):
+        tenants.by_username("bob")
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse("index"), HTTP_HOST=f"bob.{settings.CANONICAL_HOST}"
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], "//example.com/")
+
+    def test_unknown_subdomain(self):
+        response = self.client.get(
+            reverse("index"), HTTP_HOST=f"nosuch.{settings.CANONICAL_HOST}"
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class DomainCheckTests(TestCase):
+    def setUp(self):
+        allowlist.invalidate()
+        metrics.reset()
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            custom_domain="example.com",
+        )
+        self.url = reverse("domain_check")
+
+    def ask(self, domain):
+        return self.client.get(self.url, {"domain": domain}).status_code
+
+    def test_known_hosts_without_queries(self):
+        allowlist.hosts()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ask(settings.CANONICAL_HOST), 200)
+            self.assertEqual(self.ask(f"alice.{settings.CANONICAL_HOST}"), 200)
+            self.assertEqual(self.ask("example.com"), 200)
+        self.assertEqual(metrics.get("domain_check.accepted"), 3)
+
+    def test_rejections_are_cached(self):
+        self.assertEqual(self.ask("nosuch.domain"), 403)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ask("nosuch.domain"), 403)
+            self.assertEqual(self.ask(""), 403)
+        self.assertEqual(metrics.get("domain_check.rejected"), 3)
+
+    def test_only_subdomains_of_canonical_host(self):
+        self.assertEqual(self.ask("alice.example.org"), 403)
+
+    def test_host_added_elsewhere(self):
+        allowlist.hosts()
+        # bulk_create sends no signals, like a save in another worker
+        models.User.objects.bulk_create(
+            [models.User(username="bob", email="bob@example.com")]
+        )
+        self.assertEqual(self.ask(f"bob.{settings.CANONICAL_HOST}"), 200)
+
+    def test_refreshed_on_save(self):
+        self.assertEqual(self.ask("example.net"), 403)
+        self.user.custom_domain = "example.net"
+        self.user.save()
+        self.assertEqual(self.ask("example.net"), 200)
+        self.assertEqual(self.ask("example.com"), 403)
@@ -1,5 +1,7 @@
 from django.conf import settings
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from main import models
@@ -98,3 +100,46 @@ class ViewTests(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "main/dashboard.html")
+
+
+class AccountRowTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            homepage="# " + "big " * 1000,
+            custom_css="body { color: #123456; }",
+        )
+        self.client = Client(HTTP_HOST=settings.CANONICAL_HOST)
+        self.client.force_login(self.user)
+
+    def user_queries(self, queries):
+        return [q["sql"] for q in queries if 'FROM "main_user"' in q["sql"]]
+
+    def test_json_request_reads_narrow_row(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("subscription_status"))
+        self.assertEqual(response.status_code, 200)
+        for sql in self.user_queries(queries):
+            self.assertNotIn('"homepage"', sql)
+            self.assertNotIn('"homepage_html"', sql)
+            self.assertNotIn('"custom_css"', sql)
+
+    def test_dashboard_links_css(self):
+        response = self.client.get(reverse("dashboard"))
+        self.assertContains(
+            response, reverse("custom_css", args=(self.user.custom_css_hash,))
+        )
+        self.assertNotContains(response, "#123456")
+
+    def test_saving_partial_user_keeps_content(self):
+        self.client.post(
+            reverse("user_update"),
+            {"username": "alice", "email": "new@example.com", "show_nav": "on"},
+        )
+        user = models.User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.email, "new@example.com")
+        self.assertTrue(user.homepage.startswith("# big"))
+        self.assertTrue(user.homepage_html.startswith("<h1>big"))
+        self.assertEqual(user.custom_css, "body { color: #123456; }")
@@ -0,0 +1,167 @@
+import hashlib
+import hmac
+import itertools
+import json
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from main import models, webhooks
+
+WEBHOOK_SECRET = "whsec_test"
+
+_ids = itertools.count(1)
+
+
+def fake_event(type, customer="cus_1", created=None, **fields):
+    """A Stripe event about a subscription of `customer`."""
+    subscription = {
+        "id": "sub_1",
+        "object": "subscription",
+        "customer": customer,
+        "status": "active",
+        "created": 1700000000,
+        "cancel_at_period_end": False,
+        "items": {"data": [{"current_period_end": 1800000000}]},
+    }
+    subscription.update(fields)
+    return {
+        "id": f"evt_{next(_ids)}",
+        "object": "event",
+        "type": type,
+        "created": created or int(time.time()),
+        "data": {"object": subscription},
+    }
+
+
+def sign(payload, secret=WEBHOOK_SECRET):
+    """Return a Stripe-Signature header for `payload`."""
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class WebhookQueueTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = models.User.objects.create_user(
+            username="alice",
+            password="password",
+            email="alice@example.com",
+            stripe_customer_id="cus_1",
+        )
+
+    def post(self, event, secret=WEBHOOK_SECRET):
+        payload = json.dumps(event)
+        return self.client.post(
+            reverse("stripe_webhook"),
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=sign(payload, secret),
+        )
+
+    def test_endpoint_only_queues(self):
+        event = fake_event("customer.subscription.created")
+        with mock.patch("main.webhooks.handle") as handle:
+            self.assertEqual(self.post(event).status_code, 200)
+        handle.assert_not_called()
+        queued = models.WebhookEvent.objects.get()
+        self.assertEqual(queued.event_id, event["id"])
+        self.assertEqual(queued.customer_id, "cus_1")
+        self.assertEqual(queued.status, models.WebhookEvent.PENDING)
+
+    def test_bad_signature(self):
+        event = fake_event("customer.subscription.created")
+        with self.assertLogs("main.views", "ERROR"):
+            response = self.post(event, secret="whsec_other")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.WebhookEvent.objects.exists())
+
+    def test_redelivery_is_idempotent(self):
+        event = fake_event("customer.subscription.created")
+        self.post(event)
+        webhooks.process_batch(10)
+        self.post(event)
+        self.assertEqual(models.WebhookEvent.objects.count(), 1)
+        with mock.patch("main.webhooks.handle") as handle:
+            self.assertEqual(webhooks.process_batch(10), 0)
+        handle.assert_not_called()
+
+    def test_process(self):
+        self.post(fake_event("customer.subscription.created"))
+        self.assertEqual(webhooks.process_batch(10), 1)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_premium)
+        event = models.WebhookEvent.objects.get()
+        self.assertEqual(event.status, models.WebhookEvent.DONE)
+        self.assertEqual(event.attempts, 1)
+
+    def test_order_per_customer(self):
+        models.User.objects.create_user(
+            username="bob", email="bob@example.com", stripe_customer_id="cus_2"
+        )
+        created = int(time.time())
+        self.post(fake_event("customer.subscription.deleted", created=created + 1))
+        self.post(fake_event("customer.subscription.created", created=created))
+        self.post(fake_event("customer.subscription.created", customer="cus_2"))
+
+        first = webhooks.claim(10)
+        self.assertEqual(
+            [(e.customer_id, e.type) for e in first],
+            [
+                ("cus_1", "customer.subscription.created"),
+                ("cus_2", "customer.subscription.created"),
+            ],
+        )
+        for event in first:
+            webhooks.process(event)
+        second = webhooks.claim(10)
+        self.assertEqual([e.type for e in second], ["customer.subscription.deleted"])
+
+    def test_retry_with_backoff(self):
+        self.post(fake_event("customer.subscription.created"))
+        with (
+            mock.patch("main.webhooks.handle", side_effect=RuntimeError("boom")),
+            self.assertLogs("main.webhooks", "WARNING"),
+        ):
+            webhooks.process_batch(10)
+        event = models.WebhookEvent.objects.get()
+        self.assertEqual(event.status, models.WebhookEvent.PENDING)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn("boom", event.last_error)
+        self.assertGreater(event.run_after, timezone.now())
+        # not due yet
+        self.assertEqual(webhooks.process_batch(10), 0)
+
+        event.run_after = timezone.now()
+        event.save()
+        webhooks.process_batch(10)
+        self.assertEqual(
+            models.WebhookEvent.objects.get().status, models.WebhookEvent.DONE
+        )
+
+    @override_settings(WEBHOOK_MAX_ATTEMPTS=1)
+    def test_gives_up(self):
+        self.post(fake_event("customer.subscription.created"))
+        with (
+            mock.patch("main.webhooks.handle", side_effect=RuntimeError("boom")),
+            self.assertLogs("main.webhooks", "ERROR"),
+        ):
+            webhooks.process_batch(10)
+        event = models.WebhookEvent.objects.get()
+        self.assertEqual(event.status, models.WebhookEvent.FAILED)
+
+    def test_prune(self):
+        self.post(fake_event("customer.subscription.created"))
+        webhooks.process_batch(10)
+        models.WebhookEvent.objects.update(
+            processed_at=timezone.now() - timedelta(days=31)
+        )
+        self.assertEqual(webhooks.prune(), 1)
@@ -0,0 +1,91 @@
+"""
+Downscaled previews of uploaded images, made with Pillow on first request.
+
+Thumbnails are stored next to the originals in the image storage and named
+after the original's content hash, so they are made once per distinct file
+and are as immutable as the original.
+"""
+
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image as PILImage
+from PIL import ImageOps, UnidentifiedImageError, features
+
+from main.storage import get_image_storage
+
+logger = logging.getLogger(__name__)
+
+if features.check("webp"):
+    FORMAT, EXTENSION, CONTENT_TYPE = "WEBP", "webp", "image/webp"
+else:
+    FORMAT, EXTENSION, CONTENT_TYPE = "JPEG", "jpeg", "image/jpeg"
+
+
+def name(image, size):
+    digest = image.sha256
+    return f"thumbnails/{digest[:2]}/{digest[2:4]}/{digest}-{size}.{EXTENSION}"
+
+
+def get_or_create(image, size):
+    """
+    Return the storage name of the `size` px thumbnail of `image`, making it if
+    needed, or None if the original can't be decoded.
+    """
+    storage = get_image_storage()
+    thumbnail_name = name(image, size)
+    if storage.exists(thumbnail_name):
+        return thumbnail_name
+
+    try:
+        with storage.open(image.file.name, "rb") as f:
+            content = render(f, size)
+    except (UnidentifiedImageError, PILImage.DecompressionBombError, OSError) as e:
+        logger.warning(f"cannot make thumbnail of image {image.slug}: {e}")
+        return None
+    return storage.save(thumbnail_name, ContentFile(content))
+
+
+def check_pixels(im):
+    """Refuse to decode `im` if it is over MAX_IMAGE_PIXELS."""
+    width, height = im.size
+    if width * height > settings.MAX_IMAGE_PIXELS:
+        raise PILImage.DecompressionBombError(
+            f"{width}x{height} px is over MAX_IMAGE_PIXELS"
+        )
+
+
+def render(f, size):
+    """Return the encoded thumbnail of the image file `f`, fitting size x size."""
+    with PILImage.open(f) as original:
+        original.draft("RGB", (size, size))  # cheap JPEG downscale on decode
+        check_pixels(original)
+        thumbnail = ImageOps.exif_transpose(original)
+        thumbnail.thumbnail((size, size))
+        if thumbnail.mode not in ("RGB", "RGBA"):
+            thumbnail = thumbnail.convert("RGBA" if FORMAT == "WEBP" else "RGB")
+        if FORMAT == "JPEG" and thumbnail.mode == "RGBA":
+            thumbnail = thumbnail.convert("RGB")
+        out = io.BytesIO()
+        thumbnail.save(out, FORMAT, quality=settings.THUMBNAIL_QUALITY)
+        return out.getvalue()
+
+
+def dimensions(f):
+    """Return (width, height) of the image file `f` from its header, or None."""
+    try:
+        with PILImage.open(f) as im:
+            return im.size
+    except (UnidentifiedImageError, PILImage.DecompressionBombError, OSError):
+        return None
+    finally:
+        f.seek(0)
+
+
+def delete(image):
+    """Delete every thumbnail of `image`."""
+    storage = get_image_storage()
+    for size in settings.THUMBNAIL_SIZES:
+        storage.delete(name(image, size))
@@ -0,0 +1,103 @@
+"""
+Memory-bounded handling of image uploads.
+
+ImageList installs `LimitedUploadHandler` in front of Django's temporary file
+handler, so uploaded files stream to disk in chunks and an oversized file or
+too many files stop the upload as soon as they show up, instead of after the
+whole multipart body has been read.
+"""
+
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    StopUpload,
+    TemporaryFileUploadHandler,
+)
+
+# Leading bytes of each accepted format, see the IANA media type registrations
+SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+
+def max_request_bytes():
+    # every file at the limit, plus room for the multipart framing
+    return settings.IMAGE_UPLOAD_MAX_FILES * settings.IMAGE_MAX_BYTES + 64 * 1024
+
+
+def too_big(request):
+    """Tell from the headers alone whether the request body is over the limit."""
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return False  # Django's own parser rejects it
+    return content_length > max_request_bytes()
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """
+    Abort the upload on the first file over IMAGE_MAX_BYTES or past
+    IMAGE_UPLOAD_MAX_FILES. The reason ends up in `error`.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.error = None
+        self.file_count = 0
+        self.received = 0
+
+    def new_file(self, field_name, file_name, content_type, content_length, *args):
+        super().new_file(field_name, file_name, content_type, content_length, *args)
+        self.file_count += 1
+        self.received = 0
+        if self.file_count > settings.IMAGE_UPLOAD_MAX_FILES:
+            self.abort(
+                f"Too many files. Limit is {settings.IMAGE_UPLOAD_MAX_FILES} per upload."
+            )
+        if content_length and content_length > settings.IMAGE_MAX_BYTES:
+            self.abort_too_big(file_name)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_MAX_BYTES:
+            self.abort_too_big(self.file_name)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None  # the temporary file handler behind us makes the file
+
+    def abort_too_big(self, file_name):
+        limit = settings.IMAGE_MAX_BYTES / (1000 * 1000)
+        self.abort(f"File {file_name} too big. Limit is {limit:g}MB.")
+
+    def abort(self, error):
+        self.error = error
+        # drain the rest of the body without keeping it so the response can
+        # still be sent on the same connection
+        raise StopUpload(connection_reset=False)
+
+
+def install_handlers(request):
+    """Replace the request's upload handlers, return the limiting one."""
+    limiter = LimitedUploadHandler(request)
+    request.upload_handlers = [limiter, TemporaryFileUploadHandler(request)]
+    return limiter
+
+
+def image_type(f):
+    """
+    Return the image extension matching the first bytes of the file-like `f`,
+    or None if it is not an accepted image format. Rewinds `f`.
+    """
+    f.seek(0)
+    head = f.read(12)
+    f.seek(0)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, extension in SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
@@ -5,8 +5,10 @@ from main import views
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("<slug:css_hash>.css", views.custom_css, name="custom_css"),
     path("dashboard/", views.dashboard, name="dashboard"),
     path("dashboard/landing/", views.landing, name="landing"),
+    path("dashboard/metrics/", views.metrics_index, name="metrics_index"),
     path("dashboard/css/", views.CSSUpdate.as_view(), name="css_update"),
     path(
         "dashboard/homepage/",
@@ -52,6 +54,7 @@ urlpatterns += [
     path(
         "subscription/success/", views.subscription_success, name="subscription_success"
     ),
+    path("subscription/status/", views.subscription_status, name="subscription_status"),
     path("subscription/cancel/", views.subscription_cancel, name="subscription_cancel"),
     path("subscription/resume/", views.subscription_resume, name="subscription_resume"),
     path("webhooks/stripe/", views.stripe_webhook, name="stripe_webhook"),
@@ -60,6 +63,11 @@ urlpatterns += [
 # Images
 urlpatterns += [
     path("images/<slug:slug>.<slug:extension>", views.image_raw, name="image_raw"),
+    path(
+        "images/<slug:slug>/thumbnail-<int:size>",
+        views.image_thumbnail,
+        name="image_thumbnail",
+    ),
     re_path(
         r"^images/list/(?P<options>\?[\w\=]+)?$",  # e.g. images/ or images/?raw=true
         views.ImageList.as_view(),
@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.core import validators as dj_validators
 from django.core.exceptions import ValidationError
 
+from main import thumbnails, uploads
+
 
 class AlphanumericHyphenValidator(dj_validators.RegexValidator):
     regex = r"^[a-z\d-]+\Z"
@@ -18,3 +21,19 @@ class HyphenOnlyValidator(dj_validators.RegexValidator):
 def validate_domain_name(value):
     if "." not in value:
         raise ValidationError("Invalid domain name")
+
+
+def validate_image_file(value):
+    if uploads.image_type(value) is None:
+        raise ValidationError(
+            f"Unsupported file type: {value.name}. Allowed: JPEG, PNG, GIF, WebP."
+        )
+    size = thumbnails.dimensions(value)
+    if size is None:
+        raise ValidationError(f"Cannot read image: {value.name}.")
+    width, height = size
+    if width * height > settings.MAX_IMAGE_PIXELS:
+        raise ValidationError(
+            f"Image too large: {value.name} is {width}x{height} pixels. "
+            f"Limit is {settings.MAX_IMAGE_PIXELS:,} pixels."
+        )
@@ -0,0 +1,180 @@
+"""
+Resized variants of uploaded images, requested as images/<slug>.<ext>?w=<width>.
+
+Variants live under variants/ in the image storage, which has to be on the
+local filesystem. They form an LRU disk cache: every hit refreshes the file's
+mtime, and the least recently used ones are evicted once the directory grows
+past IMAGE_VARIANT_CACHE_BYTES. Measuring the directory means walking it, so
+each process does so when it writes its first variant and then after every
+EVICT_EVERY of the limit it has written. Generation takes an exclusive
+flock per variant, so a burst of requests for a cold variant, across threads
+and gunicorn workers, resizes it only once.
+"""
+
+import contextlib
+import fcntl
+import io
+import logging
+import os
+import threading
+
+from django.conf import settings
+from PIL import ExifTags, ImageOps, UnidentifiedImageError
+from PIL import Image as PILImage
+
+from main import metrics, thumbnails
+from main.storage import get_image_storage
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY = "variants"
+
+FORMATS = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+
+EVICT_EVERY = 0.05
+
+# bytes of variants written by this process since it last walked the directory
+_written = None
+_written_lock = threading.Lock()
+
+
+def name(image, width):
+    digest = image.sha256
+    return f"{DIRECTORY}/{digest[:2]}/{digest}-w{width}.{image.extension}"
+
+
+def get_or_create(image, width):
+    """
+    Return the storage name to serve for `image` at `width`: a cached variant,
+    a freshly made one, or the original if it is not wider than `width`.
+    Return None if no variant can be made.
+    """
+    if image.width and image.width <= width:
+        return image.file.name
+    if image.extension not in FORMATS:
+        return None  # eg. gif, resizing would drop the animation
+
+    storage = get_image_storage()
+    variant_name = name(image, width)
+    path = storage.path(variant_name)
+    if _touch(path):
+        metrics.incr("variants.hit")
+        return variant_name
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # someone else may have made it while we waited for the lock
+            if _touch(path):
+                metrics.incr("variants.hit")
+                return variant_name
+            metrics.incr("variants.miss")
+            try:
+                with storage.open(image.file.name, "rb") as f:
+                    content = render(f, width, FORMATS[image.extension])
+            except (
+                UnidentifiedImageError,
+                PILImage.DecompressionBombError,
+                OSError,
+            ) as e:
+                logger.warning(f"cannot resize image {image.slug}: {e}")
+                return None
+            if content is None:
+                # not measured yet (width is NULL) and narrow enough already
+                return image.file.name
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as out:
+                out.write(content)
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    if _should_evict(len(content)):
+        evict(storage.path(DIRECTORY), settings.IMAGE_VARIANT_CACHE_BYTES)
+    return variant_name
+
+
+def _should_evict(size):
+    global _written
+    with _written_lock:
+        limit = settings.IMAGE_VARIANT_CACHE_BYTES * EVICT_EVERY
+        if _written is not None and _written + size < limit:
+            _written += size
+            return False
+        _written = 0
+        return True
+
+
+def _displayed_width(im):
+    # EXIF orientations 5 to 8 turn the image by 90 degrees
+    orientation = im.getexif().get(ExifTags.Base.Orientation)
+    return im.height if orientation in (5, 6, 7, 8) else im.width
+
+
+def render(f, width, image_format):
+    """
+    Return `f` encoded at `width` px wide, or None if it is not wider than
+    that: originals are never enlarged.
+    """
+    with PILImage.open(f) as original:
+        if _displayed_width(original) <= width:
+            return None
+        original.draft("RGB", (width, width * 10))
+        thumbnails.check_pixels(original)
+        variant = ImageOps.exif_transpose(original)
+        if variant.mode in ("1", "P"):
+            variant = variant.convert("RGBA")
+        height = max(round(variant.height * width / variant.width), 1)
+        variant = variant.resize((width, height), PILImage.Resampling.LANCZOS)
+        if image_format == "JPEG" and variant.mode not in ("RGB", "L"):
+            variant = variant.convert("RGB")
+        out = io.BytesIO()
+        variant.save(out, image_format, quality=settings.THUMBNAIL_QUALITY)
+        return out.getvalue()
+
+
+def _touch(path):
+    """Mark a cached variant as recently used, return False if there is none."""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def evict(directory, max_bytes):
+    """Delete least recently used variants until `directory` fits in max_bytes."""
+    entries = []
+    total = 0
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            if filename.endswith((".lock", ".tmp")):
+                continue
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= max_bytes:
+        return
+
+    # evict down to 90% of the limit so that the next writes don't walk again
+    target = max_bytes * 0.9
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        for stale in (path, path + ".lock"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(stale)
+        total -= size
+        metrics.incr("variants.evict")
+
+
+def delete(image):
+    """Delete every cached variant of `image`."""
+    storage = get_image_storage()
+    for width in settings.IMAGE_VARIANT_WIDTHS:
+        storage.delete(name(image, width))
@@ -1,26 +1,30 @@
 import json
 import logging
-import time
+import os
 import uuid
 
 import stripe
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
-from django.core.mail import mail_admins
+from django.db import transaction
 from django.http import (
     Http404,
     HttpResponse,
     HttpResponseBadRequest,
     HttpResponseRedirect,
+    JsonResponse,
 )
 from django.shortcuts import redirect, render
 from django.urls import reverse, reverse_lazy
-from django.utils import timezone
-from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.http import require_POST
 from django.views.generic import (
     CreateView,
@@ -31,9 +35,23 @@ from django.views.generic import (
     UpdateView,
 )
 
-from main import denylist, forms, models
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from main import (
+    allowlist,
+    css,
+    denylist,
+    fastlane,
+    forms,
+    images,
+    metrics,
+    models,
+    pagecache,
+    stripe_client,
+    subscriptions,
+    thumbnails,
+    uploads,
+    variants,
+    webhooks,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -46,27 +64,28 @@ def landing(request):
     return render(request, "main/landing.html")
 
 
+@fastlane.public
+@pagecache.conditional_tenant_page
+@pagecache.cache_tenant_page
 def index(request):
-    # check if there is a subdomain already
-    if hasattr(request, "subdomain"):  # noqa: SIM102
-        # check if subdomain is valid
-        if models.User.objects.filter(username=request.subdomain).exists():
-            # check if user is logged in and on their own website
-            if request.user.is_authenticated and request.user == request.account_user:  # noqa: SIM102
-                # check if user has set website title
-                if request.user.website_title is None:
-                    return redirect("onboarding_title")
-            return render(
-                request,
-                "main/account_index.html",
-                {
-                    "canonical_url": f"{settings.PROTOCOL}//{settings.CANONICAL_HOST}",
-                    "account_user": request.account_user,
-                    "page_list": models.Page.objects.filter(
-                        user=request.account_user
-                    ).defer("body"),
-                },
-            )
+    # check if there is a subdomain already, host_middleware has validated it
+    if hasattr(request, "subdomain"):
+        # check if user is logged in and on their own website
+        if request.user.is_authenticated and request.user == request.account_user:  # noqa: SIM102
+            # check if user has set website title
+            if request.user.website_title is None:
+                return redirect("onboarding_title")
+        return render(
+            request,
+            "main/account_index.html",
+            {
+                "canonical_url": f"{settings.PROTOCOL}//{settings.CANONICAL_HOST}",
+                "account_user": request.account_user,
+                "page_list": models.Page.objects.filter(user_id=request.tenant.id).only(
+                    *models.Page.LISTING_FIELDS
+                ),
+            },
+        )
 
     # Account site as owner:
     # Redirect to "account_index" so that the requests gets a subdomain
@@ -81,29 +100,25 @@ def index(request):
 
 def domain_check(request):
     """
-    This view returns 200 if domain given exists as custom domain in any user account.
+    This view returns 200 if domain given is the landing host, a user subdomain or
+    a custom domain of any user account. Normally answered by
+    domain_check_middleware before the rest of the middleware stack.
     """
-    url = request.GET.get("domain")
-    if not url:
-        raise PermissionDenied()
-
-    # Landing case
-    if url == settings.CANONICAL_HOST:
-        return HttpResponse()
-
-    # Custom domain case, can by anything
-    if models.User.objects.filter(custom_domain=url).exists():
-        return HttpResponse()
-
-    # Subdomain case, can only by <username>.pulsar.pub
-    if len(url.split(".")) != 3:
-        raise PermissionDenied()
+    return allowlist.respond(request.GET.get("domain"))
 
-    username = url.split(".")[0]
-    if models.User.objects.filter(username=username).exists():
-        return HttpResponse()
 
-    raise PermissionDenied()
+@staff_member_required
+def metrics_index(request):
+    """
+    Counters of the worker process that served this request.
+    """
+    return JsonResponse(
+        {
+            "pid": os.getpid(),
+            "counters": metrics.snapshot(),
+            "hit_rates": metrics.rates(),
+        }
+    )
 
 
 def markdown(request):
@@ -179,7 +194,9 @@ class UserDelete(LoginRequiredMixin, DeleteView):
         self.object = self.get_object()
         if self.object.stripe_subscription_id:
             try:
-                stripe.Subscription.delete(self.object.stripe_subscription_id)
+                stripe_client.call(
+                    stripe.Subscription.delete, self.object.stripe_subscription_id
+                )
             except Exception as e:
                 logger.warning(
                     f"Failed to cancel subscription for user {self.object.username}: {e}"
@@ -188,6 +205,14 @@ class UserDelete(LoginRequiredMixin, DeleteView):
         return HttpResponseRedirect(self.get_success_url())
 
 
+@fastlane.public
+def custom_css(request, css_hash):
+    response = css.respond(request, css_hash)
+    if response is None:
+        raise Http404()
+    return response
+
+
 class CSSUpdate(LoginRequiredMixin, UpdateView):
     model = models.User
     fields = ["custom_css"]
@@ -209,7 +234,9 @@ def dashboard(request):
         {
             "subscription_enabled": bool(settings.STRIPE_SECRET_KEY),
             "website_url": request.user.website_url,
-            "page_list": models.Page.objects.filter(user=request.user),
+            "page_list": models.Page.objects.filter(user=request.user).only(
+                *models.Page.LISTING_FIELDS
+            ),
         },
     )
 
@@ -245,6 +272,9 @@ class PageCreate(LoginRequiredMixin, CreateView):
         return reverse("page_detail", args=(self.object.slug,))
 
 
+@fastlane.public
+@method_decorator(pagecache.conditional_tenant_page, name="dispatch")
+@method_decorator(pagecache.cache_tenant_page, name="dispatch")
 class PageDetail(DetailView):
     model = models.Page
 
@@ -252,7 +282,7 @@ class PageDetail(DetailView):
         return reverse("page_detail", args=(self.object.slug,))
 
     def get_queryset(self):
-        return models.Page.objects.filter(user__username=self.request.subdomain)
+        return models.Page.objects.filter(user_id=self.request.tenant.id)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -260,8 +290,8 @@ class PageDetail(DetailView):
         if hasattr(self.request, "subdomain"):
             context["account_user"] = self.request.account_user
             context["page_list"] = models.Page.objects.filter(
-                user__username=self.request.subdomain
-            )
+                user_id=self.request.tenant.id
+            ).only(*models.Page.LISTING_FIELDS)
         return context
 
     def dispatch(self, request, *args, **kwargs):
@@ -324,6 +354,7 @@ class PageDelete(LoginRequiredMixin, DeleteView):
 # Images
 
 
+@method_decorator(csrf_exempt, name="dispatch")
 class ImageList(LoginRequiredMixin, FormView):
     form_class = forms.UploadImagesForm
     template_name = "main/image_list.html"
@@ -331,43 +362,80 @@ class ImageList(LoginRequiredMixin, FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["image_list"] = models.Image.objects.filter(user=self.request.user)
-
-        context["total_quota"] = 0
-        for image in models.Image.objects.filter(user=self.request.user):
-            context["total_quota"] += image.data_size
-        context["total_quota"] = round(context["total_quota"], 2)
+        context["image_list"] = models.Image.objects.filter(
+            user=self.request.user
+        ).defer("data")
+
+        image_count, image_bytes = self.request.user.image_usage()
+        context["image_count"] = image_count
+        context["image_count_limit"] = settings.IMAGE_COUNT_LIMIT
+        context["total_quota"] = round(image_bytes / (1024 * 1024), 2)
+        context["total_quota_limit"] = settings.IMAGE_BYTES_LIMIT // (1024 * 1024)
         return context
 
     def post(self, request, *args, **kwargs):
-        form_class = self.get_form_class()
-        form = self.get_form(form_class)
-        files = request.FILES.getlist("file")
-        if form.is_valid():
-            for f in files:
-                name_ext_parts = f.name.rsplit(".", 1)
-                name = name_ext_parts[0].replace(".", "-")
-                self.extension = name_ext_parts[1].casefold()
-                if self.extension == "jpg":
-                    self.extension = "jpeg"
-                data = f.read()
-
-                # Image file limit 1.1MB = 1.1 * 1000^2
-                if len(data) > 1.1 * 1000 * 1000:
-                    form.add_error("file", "File too big. Limit is 1MB.")
-                    return self.form_invalid(form)
+        # Reject oversized uploads from their headers, before reading the body.
+        if uploads.too_big(request):
+            return self.reject(
+                f"Upload too big. Limit is {settings.IMAGE_UPLOAD_MAX_FILES} files"
+                f" of {settings.IMAGE_MAX_BYTES / (1000 * 1000):g}MB."
+            )
+        # Has to happen before anything reads request.POST, which is why the
+        # view is csrf_exempt and runs the CSRF check itself in upload().
+        upload_handler = uploads.install_handlers(request)
+        request.FILES  # noqa: B018 -- parse the body through the handlers
+        if upload_handler.error:
+            # the CSRF token may come after the part that stopped the upload
+            # and go unread, but nothing is stored here
+            return self.reject(upload_handler.error)
+        return self.upload(request, *args, **kwargs)
+
+    @method_decorator(csrf_protect)
+    def upload(self, request, *args, **kwargs):
+        form = self.get_form()
+        if not form.is_valid():
+            return self.form_invalid(form)
 
+        files = form.cleaned_data["file"]
+        with transaction.atomic():
+            # Lock the user row so that concurrent uploads of the same user
+            # can't both fit in the quota that is left.
+            models.User.objects.select_for_update().filter(pk=request.user.pk).first()
+            image_count, image_bytes = request.user.image_usage()
+            if image_count + len(files) > settings.IMAGE_COUNT_LIMIT:
+                form.add_error(
+                    "file",
+                    f"Image limit reached. Limit is {settings.IMAGE_COUNT_LIMIT} images.",
+                )
+                return self.form_invalid(form)
+            if image_bytes + sum(f.size for f in files) > settings.IMAGE_BYTES_LIMIT:
+                form.add_error(
+                    "file",
+                    f"Storage quota reached. Limit is {settings.IMAGE_BYTES_LIMIT // (1024 * 1024)}MB.",
+                )
+                return self.form_invalid(form)
+
+            new_images = []
+            for f in files:
+                self.extension = uploads.image_type(f)
                 self.slug = str(uuid.uuid4())[:8]
-                models.Image.objects.create(
-                    name=name,
-                    data=data,
+                image = models.Image(
+                    name=os.path.splitext(f.name)[0].replace(".", "-"),
                     extension=self.extension,
                     user=request.user,
                     slug=self.slug,
                 )
-            return self.form_valid(form)
-        else:
-            return self.form_invalid(form)
+                image.store(f)
+                new_images.append(image)
+            models.Image.objects.bulk_create(new_images)
+        return self.form_valid(form)
+
+    def reject(self, error):
+        """Refuse an upload whose files were not (all) read."""
+        if self.request.GET.get("raw") == "true":
+            return HttpResponseBadRequest(error)
+        messages.error(self.request, error)
+        return redirect("image_list")
 
     def get_success_url(self):
         # if ?raw=true in url, return to image_raw instead of image_list
@@ -400,11 +468,73 @@ class ImageDetail(LoginRequiredMixin, DetailView):
         return super().dispatch(request, *args, **kwargs)
 
 
+@fastlane.public
 async def image_raw(request, slug, extension):
-    image = await models.Image.objects.filter(slug=slug).afirst()
+    width = request.GET.get("w")
+    if width is not None:
+        # only a fixed set of widths, so that variants can't be used to fill
+        # the disk or burn CPU
+        if not width.isdigit() or int(width) not in settings.IMAGE_VARIANT_WIDTHS:
+            raise Http404()
+        width = int(width)
+
+    image = (
+        await models.Image.objects.filter(slug=slug)
+        .only("slug", "extension", "file", "sha256", "width")
+        .afirst()
+    )
     if not image or extension != image.extension:
         raise Http404()
-    return HttpResponse(image.data, content_type="image/" + image.extension)
+    content_type = "image/" + image.extension
+
+    if width and image.file:
+        etag = f"{image.sha256}-w{width}"
+        if (response := images.not_modified(request, etag)) is not None:
+            return response
+        name = await sync_to_async(variants.get_or_create)(image, width)
+        if name is not None:
+            return images.serve(request, image.file.storage, name, content_type, etag)
+
+    if not image.file:
+        # Not yet moved out of the database by `manage.py migrate_image_blobs`.
+        # The slug never gets new content, so it is a valid validator too.
+        if (response := images.not_modified(request, image.slug)) is not None:
+            return response
+        data = await models.Image.objects.values_list("data", flat=True).aget(
+            pk=image.pk
+        )
+        return images.serve_bytes(data, content_type, image.slug)
+
+    return images.serve(
+        request, image.file.storage, image.file.name, content_type, image.sha256
+    )
+
+
+@fastlane.public
+async def image_thumbnail(request, slug, size):
+    if size not in settings.THUMBNAIL_SIZES:
+        raise Http404()
+    image = (
+        await models.Image.objects.filter(slug=slug)
+        .only("slug", "extension", "file", "sha256")
+        .afirst()
+    )
+    if not image:
+        raise Http404()
+    raw_url = reverse("image_raw", args=(image.slug, image.extension))
+    if not image.file:
+        # legacy in-database blob, no thumbnails until it's moved out
+        return redirect(raw_url)
+
+    etag = f"{image.sha256}-{size}"
+    if (response := images.not_modified(request, etag)) is not None:
+        return response
+    name = await sync_to_async(thumbnails.get_or_create)(image, size)
+    if name is None:
+        return redirect(raw_url)
+    return images.serve(
+        request, image.file.storage, name, thumbnails.CONTENT_TYPE, etag
+    )
 
 
 class ImageUpdate(LoginRequiredMixin, UpdateView):
@@ -438,6 +568,7 @@ def subscription_index(request):
     if hasattr(request, "subdomain"):
         return redirect("//" + settings.CANONICAL_HOST + reverse("subscription_index"))
 
+    subscriptions.refresh_if_stale(request.user)
     return render(
         request,
         "main/subscription_index.html",
@@ -457,7 +588,8 @@ def create_checkout_session(request):
 
     try:
         if not request.user.stripe_customer_id:
-            customer = stripe.Customer.create(
+            customer = stripe_client.call(
+                stripe.Customer.create,
                 email=request.user.email,
                 metadata={
                     "user_id": request.user.id,
@@ -465,10 +597,13 @@ def create_checkout_session(request):
                 },
             )
             request.user.stripe_customer_id = customer.id
-            request.user.save()
+            request.user.save(update_fields=["stripe_customer_id"])
         else:
-            customer = stripe.Customer.retrieve(request.user.stripe_customer_id)
-        checkout_session = stripe.checkout.Session.create(
+            customer = stripe_client.call(
+                stripe.Customer.retrieve, request.user.stripe_customer_id
+            )
+        checkout_session = stripe_client.call(
+            stripe.checkout.Session.create,
             customer=customer.id,
             payment_method_types=["card"],
             line_items=[
@@ -478,7 +613,9 @@ def create_checkout_session(request):
                 }
             ],
             mode="subscription",
-            success_url=request.build_absolute_uri(reverse("subscription_success")),
+            # Stripe fills in the session id, which subscription_status uses
+            success_url=request.build_absolute_uri(reverse("subscription_success"))
+            + "?session_id={CHECKOUT_SESSION_ID}",
             cancel_url=request.build_absolute_uri(reverse("subscription_index")),
         )
         return redirect(checkout_session.url)
@@ -492,9 +629,37 @@ def create_checkout_session(request):
 
 @login_required
 def subscription_success(request):
-    messages.success(request, "thanks for subscribing!")
-    time.sleep(2)
-    return redirect("subscription_index")
+    # The page polls subscription_status until the subscription shows up
+    # instead of holding a worker while the webhook is on its way.
+    return render(
+        request,
+        "main/subscription_success.html",
+        {"session_id": request.GET.get("session_id", "")},
+    )
+
+
+@login_required
+def subscription_status(request):
+    """
+    Report whether the user's subscription is active. If the webhook has not
+    arrived yet, look up the checkout session, at most once per
+    CHECKOUT_RECONCILE_INTERVAL seconds per user.
+    """
+    session_id = request.GET.get("session_id")
+    if (
+        not request.user.is_premium
+        and session_id
+        and cache.add(
+            f"checkout-reconcile:{request.user.id}",
+            True,
+            timeout=settings.CHECKOUT_RECONCILE_INTERVAL,
+        )
+    ):
+        try:
+            subscriptions.reconcile_checkout(request.user, session_id)
+        except Exception as e:
+            logger.warning(f"cannot reconcile checkout session {session_id}: {e}")
+    return JsonResponse({"is_premium": request.user.is_premium})
 
 
 @login_required
@@ -505,9 +670,12 @@ def subscription_cancel(request):
             try:
                 if request.user.stripe_subscription_id:
                     # cancel at period end
-                    stripe.Subscription.modify(
-                        request.user.stripe_subscription_id, cancel_at_period_end=True
+                    subscription = stripe_client.call(
+                        stripe.Subscription.modify,
+                        request.user.stripe_subscription_id,
+                        cancel_at_period_end=True,
                     )
+                    subscriptions.apply(request.user, subscription)
                     messages.success(
                         request,
                         "your subscription will end at the end of the current billing period and will not renew",
@@ -533,9 +701,12 @@ def subscription_resume(request):
     try:
         if request.user.stripe_subscription_id:
             # remove cancel_at_period_end flag to resume the subscription
-            stripe.Subscription.modify(
-                request.user.stripe_subscription_id, cancel_at_period_end=False
+            subscription = stripe_client.call(
+                stripe.Subscription.modify,
+                request.user.stripe_subscription_id,
+                cancel_at_period_end=False,
             )
+            subscriptions.apply(request.user, subscription)
             messages.success(
                 request,
                 "your subscription has been resumed and will continue to auto-renew",
@@ -575,139 +746,8 @@ def stripe_webhook(request):
         logger.error(f"invalid signature in Stripe webhook: {e}")
         return HttpResponse(status=400)
 
-    logger.info(f"processing webhook event: {event['type']}")
-
-    # send admin email notifications
-    send_webhook_admin_email(event["type"], event)
-
-    if event["type"] == "customer.subscription.created":
-        subscription = event["data"]["object"]
-        handle_subscription_created(subscription)
-    elif event["type"] == "customer.subscription.updated":
-        subscription = event["data"]["object"]
-        handle_subscription_updated(subscription)
-    elif event["type"] == "customer.subscription.deleted":
-        subscription = event["data"]["object"]
-        handle_subscription_deleted(subscription)
-    elif event["type"] == "invoice.payment_succeeded":
-        invoice = event["data"]["object"]
-        handle_payment_succeeded(invoice)
-    elif event["type"] == "invoice.payment_failed":
-        invoice = event["data"]["object"]
-        handle_payment_failed(invoice)
-    else:
-        logger.info(f"unhandled webhook event type: {event['type']}")
-
+    # Handled by `manage.py process_webhooks`, see main/webhooks.py. The
+    # payload is stored as sent, its signature checked out.
+    if webhooks.enqueue(json.loads(payload)):
+        logger.info(f"queued webhook event: {event['type']}")
     return HttpResponse(status=200)
-
-
-def handle_subscription_created(subscription):
-    try:
-        customer_id = subscription["customer"]
-        user = models.User.objects.get(stripe_customer_id=customer_id)
-
-        user.stripe_subscription_id = subscription["id"]
-        user.is_premium = subscription["status"] == "active"
-        user.subscription_start_date = timezone.datetime.fromtimestamp(
-            subscription["created"], tz=timezone.timezone.utc
-        )
-
-        if (
-            subscription.get("items")
-            and subscription["items"].get("data")
-            and len(subscription["items"]["data"]) > 0
-        ):
-            item = subscription["items"]["data"][0]
-            if item.get("current_period_end"):
-                user.subscription_end_date = timezone.datetime.fromtimestamp(
-                    item["current_period_end"], tz=timezone.timezone.utc
-                )
-        user.save()
-        logger.info(f"subscription created for user {user.username}")
-    except models.User.DoesNotExist:
-        logger.error(f"user not found for customer {customer_id}")
-    except Exception as e:
-        logger.error(f"error handling subscription created: {e}")
-
-
-def handle_subscription_updated(subscription):
-    try:
-        customer_id = subscription["customer"]
-        user = models.User.objects.get(stripe_customer_id=customer_id)
-        user.is_premium = subscription["status"] == "active"
-        if (
-            subscription.get("items")
-            and subscription["items"].get("data")
-            and len(subscription["items"]["data"]) > 0
-        ):
-            item = subscription["items"]["data"][0]
-            if item.get("current_period_end"):
-                user.subscription_end_date = timezone.datetime.fromtimestamp(
-                    item["current_period_end"], tz=timezone.timezone.utc
-                )
-        user.save()
-        logger.info(f"subscription updated for user {user.username}")
-    except models.User.DoesNotExist:
-        logger.error(f"user not found for customer {customer_id}")
-    except Exception as e:
-        logger.error(f"error handling subscription updated: {e}")
-
-
-def handle_subscription_deleted(subscription):
-    try:
-        customer_id = subscription["customer"]
-        user = models.User.objects.get(stripe_customer_id=customer_id)
-        user.is_premium = False
-        user.subscription_end_date = timezone.now()
-        user.save()
-        logger.info(f"subscription deleted for user {user.username}")
-    except models.User.DoesNotExist:
-        logger.error(f"user not found for customer {customer_id}")
-    except Exception as e:
-        logger.error(f"error handling subscription deleted: {e}")
-
-
-def handle_payment_succeeded(invoice):
-    try:
-        customer_id = invoice["customer"]
-        user = models.User.objects.get(stripe_customer_id=customer_id)
-        logger.info(f"payment succeeded for user {user.username}")
-    except models.User.DoesNotExist:
-        logger.error(f"user not found for customer {customer_id}")
-    except Exception as e:
-        logger.error(f"error handling payment succeeded: {e}")
-
-
-def handle_payment_failed(invoice):
-    try:
-        customer_id = invoice["customer"]
-        user = models.User.objects.get(stripe_customer_id=customer_id)
-        logger.warning(f"payment failed for user {user.username}")
-    except models.User.DoesNotExist:
-        logger.error(f"user not found for customer {customer_id}")
-    except Exception as e:
-        logger.error(f"error handling payment failed: {e}")
-
-
-def send_webhook_admin_email(webhook_type, webhook_data):
-    try:
-        formatted_data = json.dumps(webhook_data, indent=2, default=str)
-        subject = f"Stripe Webhook Received: {webhook_type}"
-        message = f"""
-A Stripe webhook has been received and processed.
-
-Webhook Type: {webhook_type}
-Timestamp: {timezone.now()}
-
-Webhook Data:
-{formatted_data}
-        """
-        mail_admins(
-            subject=subject,
-            message=message,
-            fail_silently=True,  # don't fail the webhook if email fails
-        )
-        logger.info(f"admin email sent for webhook type: {webhook_type}")
-    except Exception as e:
-        # no exceptions to avoid breaking webhook processing
-        logger.error(f"failed to send admin email for webhook: {e}")
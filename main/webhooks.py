@@ -0,0 +1,237 @@
+"""
+Queue of verified Stripe webhook events.
+
+views.stripe_webhook only verifies the signature, stores the event and returns
+200, so Stripe never waits on our handlers. `manage.py process_webhooks`
+claims stored events and runs the handlers below:
+
+* An event id is stored once, so Stripe's retries of a delivered event are
+  no-ops.
+* Events of the same customer are handled one at a time in the order Stripe
+  created them. An event waits while an older one of its customer is pending.
+* A failing event is retried with exponential backoff and jitter, up to
+  WEBHOOK_MAX_ATTEMPTS, then marked failed and left for an admin.
+"""
+
+import json
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from main import mail, metrics, models, subscriptions
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(value):
+    return timezone.datetime.fromtimestamp(value, tz=timezone.timezone.utc)
+
+
+def enqueue(event):
+    """Store a verified event (a dict), return False if it was already stored."""
+    obj = event["data"]["object"]
+    _, created = models.WebhookEvent.objects.get_or_create(
+        event_id=event["id"],
+        defaults={
+            "type": event["type"],
+            "customer_id": obj.get("customer") or "",
+            "payload": event,
+            "created": _timestamp(event["created"]),
+        },
+    )
+    metrics.incr("webhooks.received" if created else "webhooks.duplicate")
+    return created
+
+
+def claim(batch_size):
+    """
+    Lock and return up to `batch_size` events that are due, at most one per
+    customer. Rows locked by other workers are skipped.
+    """
+    now = timezone.now()
+    older_pending = models.WebhookEvent.objects.filter(
+        customer_id=OuterRef("customer_id"), status=models.WebhookEvent.PENDING
+    ).filter(
+        Q(created__lt=OuterRef("created"))
+        | Q(created=OuterRef("created"), pk__lt=OuterRef("pk"))
+    )
+    with transaction.atomic():
+        events = list(
+            models.WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=models.WebhookEvent.PENDING, run_after__lte=now)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .filter(Q(customer_id="") | ~Exists(older_pending))
+            .order_by("created", "pk")[:batch_size]
+        )
+        # the lease expires if this worker dies mid-batch
+        models.WebhookEvent.objects.filter(pk__in=[e.pk for e in events]).update(
+            locked_until=now + timedelta(seconds=settings.WEBHOOK_LEASE)
+        )
+    return events
+
+
+def backoff(attempts):
+    delay = min(
+        settings.WEBHOOK_RETRY_BASE * 2 ** (attempts - 1), settings.WEBHOOK_RETRY_MAX
+    )
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def process(event):
+    """Run the handler of a claimed event and record the outcome."""
+    event.attempts += 1
+    event.locked_until = None
+    try:
+        handle(event.payload)
+    except Exception as e:
+        logger.warning(f"webhook {event} failed, attempt {event.attempts}: {e}")
+        metrics.incr("webhooks.error")
+        event.last_error = f"{type(e).__name__}: {e}"
+        if event.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+            logger.error(f"webhook {event} failed for good")
+            event.status = models.WebhookEvent.FAILED
+        else:
+            event.run_after = timezone.now() + backoff(event.attempts)
+    else:
+        metrics.incr("webhooks.done")
+        event.status = models.WebhookEvent.DONE
+        event.processed_at = timezone.now()
+        send_webhook_admin_email(event.type, event.payload)
+    event.save(
+        update_fields=[
+            "attempts",
+            "locked_until",
+            "last_error",
+            "status",
+            "run_after",
+            "processed_at",
+        ]
+    )
+    return event.status == models.WebhookEvent.DONE
+
+
+def _process_in_thread(event):
+    try:
+        return process(event)
+    finally:
+        close_old_connections()
+
+
+def process_batch(batch_size, executor=None):
+    """Claim and process one batch, return the number of events claimed."""
+    events = claim(batch_size)
+    if executor is None:
+        for event in events:
+            process(event)
+    else:
+        list(executor.map(_process_in_thread, events))
+    return len(events)
+
+
+def prune():
+    """Forget handled events once Stripe can no longer redeliver them."""
+    cutoff = timezone.now() - timedelta(days=settings.WEBHOOK_RETENTION_DAYS)
+    deleted, _ = models.WebhookEvent.objects.filter(
+        status=models.WebhookEvent.DONE, processed_at__lt=cutoff
+    ).delete()
+    return deleted
+
+
+# Handlers. They are retried when they raise, so they must be idempotent.
+
+
+def handle(event):
+    handler = HANDLERS.get(event["type"])
+    if handler is None:
+        logger.info(f"unhandled webhook event type: {event['type']}")
+        return
+    handler(event["data"]["object"])
+
+
+def handle_subscription_created(subscription):
+    customer_id = subscription["customer"]
+    try:
+        user = models.User.objects.get(stripe_customer_id=customer_id)
+    except models.User.DoesNotExist:
+        logger.error(f"user not found for customer {customer_id}")
+        return
+    user.subscription_start_date = _timestamp(subscription["created"])
+    subscriptions.apply(user, subscription)
+    logger.info(f"subscription created for user {user.username}")
+
+
+def handle_subscription_updated(subscription):
+    customer_id = subscription["customer"]
+    try:
+        user = models.User.objects.get(stripe_customer_id=customer_id)
+    except models.User.DoesNotExist:
+        logger.error(f"user not found for customer {customer_id}")
+        return
+    subscriptions.apply(user, subscription)
+    logger.info(f"subscription updated for user {user.username}")
+
+
+def handle_subscription_deleted(subscription):
+    customer_id = subscription["customer"]
+    try:
+        user = models.User.objects.get(stripe_customer_id=customer_id)
+    except models.User.DoesNotExist:
+        logger.error(f"user not found for customer {customer_id}")
+        return
+    subscriptions.apply_deleted(user)
+    logger.info(f"subscription deleted for user {user.username}")
+
+
+def handle_payment_succeeded(invoice):
+    customer_id = invoice["customer"]
+    try:
+        user = models.User.objects.get(stripe_customer_id=customer_id)
+    except models.User.DoesNotExist:
+        logger.error(f"user not found for customer {customer_id}")
+        return
+    logger.info(f"payment succeeded for user {user.username}")
+
+
+def handle_payment_failed(invoice):
+    customer_id = invoice["customer"]
+    try:
+        user = models.User.objects.get(stripe_customer_id=customer_id)
+    except models.User.DoesNotExist:
+        logger.error(f"user not found for customer {customer_id}")
+        return
+    logger.warning(f"payment failed for user {user.username}")
+
+
+HANDLERS = {
+    "customer.subscription.created": handle_subscription_created,
+    "customer.subscription.updated": handle_subscription_updated,
+    "customer.subscription.deleted": handle_subscription_deleted,
+    "invoice.payment_succeeded": handle_payment_succeeded,
+    "invoice.payment_failed": handle_payment_failed,
+}
+
+
+def send_webhook_admin_email(webhook_type, webhook_data):
+    try:
+        formatted_data = json.dumps(webhook_data, indent=2, default=str)
+        subject = f"Stripe Webhook Received: {webhook_type}"
+        message = f"""
+A Stripe webhook has been received and processed.
+
+Webhook Type: {webhook_type}
+Timestamp: {timezone.now()}
+
+Webhook Data:
+{formatted_data}
+        """
+        # one mail per EMAIL_DIGEST_INTERVAL rather than one per event
+        mail.mail_admins_digest("Stripe webhooks", subject, message)
+        logger.info(f"admin email queued for webhook type: {webhook_type}")
+    except Exception as e:
+        # no exceptions to avoid breaking webhook processing
+        logger.error(f"failed to send admin email for webhook: {e}")
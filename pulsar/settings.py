@@ -61,6 +61,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "main.middleware.domain_check_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -71,6 +72,14 @@ MIDDLEWARE = [
     "main.middleware.host_middleware",
 ]
 
+# Middleware of anonymous reads on tenant sites, see main/fastlane.py
+PUBLIC_MIDDLEWARE = [
+    "django.middleware.security.SecurityMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "main.middleware.host_middleware",
+]
+
 ROOT_URLCONF = "pulsar.urls"
 
 TEMPLATES = [
@@ -92,6 +101,7 @@ TEMPLATES = [
 WSGI_APPLICATION = "pulsar.wsgi.application"
 
 AUTH_USER_MODEL = "main.User"
+AUTHENTICATION_BACKENDS = ["main.auth.AccountBackend"]
 
 LOGIN_REDIRECT_URL = "index"
 LOGOUT_REDIRECT_URL = "index"
@@ -127,6 +137,45 @@ if os.getenv("SQLITE", "") != "1":
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+if os.getenv("CACHE_DIR"):
+    # shared by all gunicorn workers of the host
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.getenv("CACHE_DIR"),
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    }
+
+# Full-page cache of public tenant sites, see main/pagecache.py
+PAGE_CACHE_TIMEOUT = int(os.getenv("PAGE_CACHE_TIMEOUT", "3600"))  # seconds
+
+# Tenant registry, see main/tenants.py
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "1024"))
+TENANT_CACHE_TTL = int(os.getenv("TENANT_CACHE_TTL", "60"))  # seconds
+
+# Host allowlist for Caddy's on-demand TLS ask, see main/allowlist.py
+DOMAIN_CHECK_REFRESH = int(os.getenv("DOMAIN_CHECK_REFRESH", "300"))  # seconds
+DOMAIN_CHECK_REJECT_SIZE = int(os.getenv("DOMAIN_CHECK_REJECT_SIZE", "10000"))
+DOMAIN_CHECK_REJECT_TTL = int(os.getenv("DOMAIN_CHECK_REJECT_TTL", "600"))  # seconds
+
+# Cache invalidation between workers and hosts, see main/bus.py
+BUS_POLL_INTERVAL = float(os.getenv("BUS_POLL_INTERVAL", "1"))  # seconds
+BUS_KEEPALIVE = 60  # seconds without events before checking the connection
+BUS_RETENTION = 300  # seconds SQLite deployments keep events for polling
+
+# Static copies of tenant sites served by Caddy, see main/prerender.py
+PRERENDER_ROOT = os.getenv("PRERENDER_ROOT", "")  # disabled when empty
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -164,6 +213,55 @@ USE_TZ = True
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "static"
 
+# Uploaded files
+MEDIA_ROOT = Path(os.getenv("MEDIA_ROOT", BASE_DIR / "media"))
+
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    # hashed names and precompressed copies, see main/staticfiles.py
+    "staticfiles": {
+        "BACKEND": "main.staticfiles.CompressedManifestStaticFilesStorage",
+    },
+    # content-addressed image files, see main/storage.py
+    "images": {
+        "BACKEND": "main.storage.ContentAddressedStorage",
+    },
+}
+
+# When set, image_raw responds with an X-Accel-Redirect header pointing at
+# this prefix + the storage name and lets the front end (Caddy) send the file.
+IMAGE_ACCEL_REDIRECT = os.getenv("IMAGE_ACCEL_REDIRECT", "")
+
+# Per-user image quota
+IMAGE_COUNT_LIMIT = 1000
+IMAGE_BYTES_LIMIT = 100 * 1024 * 1024
+
+# Per-upload limits, enforced while the request body streams in, see
+# main/uploads.py
+IMAGE_MAX_BYTES = 1_100_000
+IMAGE_UPLOAD_MAX_FILES = 20
+
+# Larger images are rejected on upload and never decoded, as a small file can
+# hold a huge image (a 12000x12000 PNG of one colour takes a few hundred kB
+# on disk and half a gigabyte decoded)
+MAX_IMAGE_PIXELS = 50_000_000
+
+# Thumbnail bounding boxes in px, see main/thumbnails.py
+THUMBNAIL_SIZES = (100, 300, 1000)
+THUMBNAIL_QUALITY = 80
+
+# Resized variants, requested as images/<slug>.<ext>?w=<width>, see
+# main/variants.py
+IMAGE_VARIANT_WIDTHS = (400, 800, 1200, 1600)
+IMAGE_VARIANT_CACHE_BYTES = int(
+    os.getenv("IMAGE_VARIANT_CACHE_BYTES", str(1024 * 1024 * 1024))
+)
+
+# Image URLs never change content, see main/images.py
+IMAGE_CACHE_MAX_AGE = 60 * 60 * 24 * 365  # 1 year in seconds
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -172,9 +270,18 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Email Configuration
 # https://docs.djangoproject.com/en/5.2/topics/email/
 
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# Mail is queued in the database and sent by `manage.py send_queued_email`
+# through EMAIL_QUEUE_BACKEND, see main/mail.py
+EMAIL_BACKEND = "main.mail.QueuedEmailBackend"
+EMAIL_QUEUE_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 if LOCALDEV:
     EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+EMAIL_DIGEST_INTERVAL = 60 * 60  # seconds
+EMAIL_MAX_ATTEMPTS = 8
+EMAIL_IDLE_TIMEOUT = 60  # seconds the worker keeps an idle SMTP connection
+EMAIL_TIMEOUT = 30  # seconds, for each SMTP operation
+EMAIL_CLAIM_TIMEOUT = 60 * 60  # seconds before a batch being sent is retried
+EMAIL_RETENTION_DAYS = 30
 EMAIL_HOST = os.getenv("EMAIL_HOST", "")
 EMAIL_PORT = int(os.getenv("EMAIL_PORT", "587"))
 EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "1") == "1"
@@ -194,3 +301,26 @@ STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY", "")
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
 STRIPE_PRICE_ID = os.getenv("STRIPE_PRICE_ID", "")
+
+# Stripe client, see main/stripe_client.py
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "")  # eg. a local stripe-mock
+STRIPE_CONNECT_TIMEOUT = 2  # seconds
+STRIPE_READ_TIMEOUT = 5  # seconds
+STRIPE_MAX_NETWORK_RETRIES = 2
+STRIPE_CIRCUIT_THRESHOLD = 5  # consecutive failures
+STRIPE_CIRCUIT_COOLDOWN = 30  # seconds
+
+# Seconds between checkout session lookups of the subscription success page
+CHECKOUT_RECONCILE_INTERVAL = 5
+
+# Stripe webhook queue, see main/webhooks.py
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "4"))
+WEBHOOK_MAX_ATTEMPTS = 8
+WEBHOOK_RETRY_BASE = 30  # seconds, doubled on every attempt
+WEBHOOK_RETRY_MAX = 6 * 60 * 60  # seconds
+WEBHOOK_LEASE = 5 * 60  # seconds a claimed event stays locked
+WEBHOOK_RETENTION_DAYS = 30  # Stripe redelivers events for up to 3 days
+
+# Re-fetch a user's subscription in the background when their local copy is
+# older than this many seconds, see main/subscriptions.py. 0 disables.
+SUBSCRIPTION_REFRESH_AFTER = int(os.getenv("SUBSCRIPTION_REFRESH_AFTER", "86400"))
@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 
 import os
 
-from django.core.wsgi import get_wsgi_application
+import django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pulsar.settings")
 
-application = get_wsgi_application()
+# What django.core.wsgi.get_wsgi_application does, with the handler that
+# serves anonymous reads of tenant sites without sessions (main/fastlane.py).
+django.setup(set_prefix=False)
+
+from main import bus  # noqa: E402
+from main.fastlane import FastLaneHandler  # noqa: E402
+
+application = FastLaneHandler()
+
+# Evict this worker's caches when another worker or host changes something.
+bus.start()